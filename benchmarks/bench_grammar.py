@@ -0,0 +1,77 @@
+"""
+Micro-benchmark: compiled command grammar vs legacy attr_getter.
+
+Run: python -m benchmarks.bench_grammar [mentions ...]
+"""
+import sys
+import timeit
+
+from collections import OrderedDict
+
+from guard_bot.bot.grammar import USERS, USERS_AND_PERIOD, compile_grammar
+
+
+def legacy_attr_getter(s: str, c: OrderedDict) -> dict:
+    """attr_getter as it was before guard_bot.bot.grammar, kept for comparison"""
+    result = {}
+    for k, value in c.items():
+        if not isinstance(value, list):
+            match = value.match(s)
+            if match:
+                result.update({k: match.groups()[0]})
+                s = s[match.span()[1] :]
+        else:
+            while True:
+                match = None
+                for el in value:
+                    attr_name = None
+                    if isinstance(el, tuple):
+                        attr_name = el[0]
+                        match = el[1].match(s)
+                    else:
+                        match = el.match(s)
+                    if match:
+                        if (attr_name or k) in result:
+                            if not isinstance(result[attr_name or k], list):
+                                result[attr_name or k] = [result[attr_name or k]]
+                            result[attr_name or k].append(match.groups()[0])
+                        else:
+                            result[attr_name or k] = match.groups()[0]
+                        s = s[match.span()[1] :]
+                        break
+                if not match:
+                    break
+                s = s.lstrip()
+        s = s.lstrip()
+    if s:
+        result.update({"comment": s})
+    return result
+
+
+def make_command(mentions: int) -> str:
+    users = []
+    for i in range(mentions):
+        users.append(
+            (f"@raid_user_{i}", f"#{100000 + i}", f"[user {i}](tg://user?id={200000 + i})")[i % 3]
+        )
+    return f"!mute {' '.join(users)} 1d 2h 3m raid"
+
+
+def bench(mentions: int, number: int = 2000):
+    text = make_command(mentions)
+    grammar = compile_grammar(USERS_AND_PERIOD)
+    assert legacy_attr_getter(text, USERS_AND_PERIOD) == grammar.parse(text).as_dict()
+    legacy = min(timeit.repeat(lambda: legacy_attr_getter(text, USERS_AND_PERIOD), number=number, repeat=3))
+    compiled = min(timeit.repeat(lambda: grammar.parse(text), number=number, repeat=3))
+    print(
+        f"mentions={mentions:4d} len={len(text):5d} "
+        f"legacy={legacy / number * 1e6:9.2f}us compiled={compiled / number * 1e6:9.2f}us "
+        f"x{legacy / compiled:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    for n in [int(x) for x in sys.argv[1:]] or [1, 10, 30, 100, 150]:
+        bench(n)
+    # sanity for the small spec as well
+    assert legacy_attr_getter("!ban @a #1 x", USERS) == compile_grammar(USERS).parse("!ban @a #1 x").as_dict()
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from guard_bot.bot.models import Spammers, ChatAdmins
+from guard_bot.bot.models import Spammers, ChatAdmins, ChatSettings, BlockedDomain
 
 
 # Register your models here.
@@ -14,3 +14,15 @@ class SpammersAdmin(admin.ModelAdmin):
 @admin.register(ChatAdmins)
 class ChatAdminsAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(ChatSettings)
+class ChatSettingsAdmin(admin.ModelAdmin):
+    list_display = ("chat_id", "warn_count", "warn_counter_period", "mute_period")
+    search_fields = ("chat_id",)
+
+
+@admin.register(BlockedDomain)
+class BlockedDomainAdmin(admin.ModelAdmin):
+    list_display = ("domain", "chat_id", "comment", "created")
+    search_fields = ("domain", "chat_id")
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import typing
+
+from guard_bot.bot.models import UserWarn
+
+if typing.TYPE_CHECKING:
+    from typing import List
+
+logger = logging.getLogger("asyncio")
+
+
+class AuditWriter:
+    """
+    Write-behind writer for UserWarn records.
+    Records are put to bounded queue and inserted by bulk_create in batches,
+    a batch is written when it is full or "flush_interval" seconds passed.
+    "flush" is a barrier: it returns when everything written before the call is in database
+    """
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 100, flush_interval: float = 0.5):
+        self.queue = asyncio.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.last_batch_size = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.closed = False
+        self._flush_now = asyncio.Event()
+        self._processed = asyncio.Condition()
+        self._task = None
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self._run(), name="audit_writer"
+            )
+
+    async def write(
+        self, chat_id: int, user_id: int, warn_type: int, comment: str = None, text: str = None
+    ):
+        """
+        Put record to queue, waits when queue is full
+        :param chat_id: int
+        :param user_id: int
+        :param warn_type: WarnType
+        :param comment: str
+        :param text: str, message text
+        :return:
+        """
+        if self.closed:
+            raise RuntimeError("Audit writer is closed")
+        self._start()
+        await self.queue.put(
+            UserWarn(
+                chat_id=chat_id, user_id=user_id, warn_type=warn_type, comment=comment, text=text
+            )
+        )
+        self.enqueued += 1
+
+    def _drain(self, batch: "List[UserWarn]"):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while True:
+                self._drain(batch)
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or self._flush_now.is_set() or remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self._flush_now.clear()
+            await self._write(batch)
+
+    async def _write(self, batch: "List[UserWarn]"):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await UserWarn.objects.abulk_create(batch)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"Audit batch of {len(batch)} records is lost")
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+        self.last_batch_size = len(batch)
+        self.last_flush_latency = loop.time() - started
+        self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+        async with self._processed:
+            self._processed.notify_all()
+
+    async def flush(self):
+        """
+        Wait until all records written before the call are processed
+        :return:
+        """
+        target = self.enqueued
+        async with self._processed:
+            while self.written + self.failed < target:
+                self._flush_now.set()
+                await self._processed.wait()
+
+    async def close(self):
+        """
+        Stop accepting records, drain the queue and stop writer
+        :return:
+        """
+        self.closed = True
+        await self.flush()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
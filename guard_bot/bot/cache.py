@@ -0,0 +1,369 @@
+import time
+import typing
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from guard_bot.bot.models import ChatSettings, TelegramUsername
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class AdminCache:
+    """
+    Process local cache of chat admins.
+    Entry is a mapping {user_id: packed AdminRights} with expiration time
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._chats = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int) -> "Optional[Dict[int, int]]":
+        """
+        Get admins rights for chat
+        :param chat_id: int
+        :return: dict {user_id: rights} or None if chat is not cached or expired
+        """
+        entry = self._chats.get(chat_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._chats[chat_id]
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, chat_id: int) -> "Optional[Dict[int, int]]":
+        """Get admins rights without counting and evicting, for read-only checks"""
+        entry = self._chats.get(chat_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, chat_id: int, rights: "Dict[int, int]"):
+        self._chats[chat_id] = (time.monotonic() + self.ttl, rights)
+
+    def invalidate(self, chat_id: int = None):
+        """
+        Drop chat from cache, drop all chats if chat_id is None
+        :param chat_id: int
+        :return:
+        """
+        if chat_id is None:
+            self._chats.clear()
+        else:
+            self._chats.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "hits": self.hits, "misses": self.misses}
+
+
+class LRUCache:
+    """
+    Bounded mapping with time to live, least recently used keys are evicted first
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: "Hashable", default: "Any" = None) -> "Any":
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, key: "Hashable", default: "Any" = None) -> "Any":
+        """Get value without counting and reordering"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: "Hashable", value: "Any"):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: "Hashable"):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class UsernameCache:
+    """
+    Username to user ID resolution cache.
+    Memory LRU is backed by TelegramUsername table, new mappings are written
+    by "flush" in batches, so warm state survives restarts.
+    A released username may be taken by another account at once, so "ttl" is short
+    and a mapping is dropped as soon as its user shows up with another username
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.memory = LRUCache(maxsize, ttl)
+        # user ID: username, finds the mapping to drop when user changes username
+        self.names = LRUCache(maxsize, ttl)
+        self.max_age = timedelta(seconds=ttl)
+        self.pending = {}
+        # username: user ID of mappings to delete from database
+        self.released = {}
+        self.db_hits = 0
+        self.learned = 0
+        self.releases = 0
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        return username.lstrip("@").lower()
+
+    async def get(self, username: str) -> "Optional[int]":
+        """
+        Get user ID from memory or database
+        :param username: str, with or without "@"
+        :return: int or None
+        """
+        username = self.normalize(username)
+        user_id = self.memory.get(username)
+        if user_id is None:
+            user_id = await TelegramUsername.get_user_id(username, self.max_age)
+            if user_id is not None and self.released.get(username) == user_id:
+                # released, not deleted from database yet
+                return None
+            if user_id is not None:
+                self.db_hits += 1
+                self.memory.set(username, user_id)
+        return user_id
+
+    def set(self, username: str, user_id: int):
+        """
+        Remember mapping, known mappings are not rewritten until they expire
+        :param username: str
+        :param user_id: int
+        :return:
+        """
+        username = self.normalize(username)
+        old = self.names.peek(user_id)
+        if old != username:
+            if old is not None:
+                self._release(old, user_id)
+            self.names.set(user_id, username)
+        if self.memory.peek(username) != user_id:
+            self.pending[username] = user_id
+            self.released.pop(username, None)
+            self.memory.set(username, user_id)
+
+    def _release(self, username: str, user_id: int):
+        """
+        Drop mapping of username which user does not have anymore
+        :param username: str, normalized username
+        :param user_id: int
+        :return:
+        """
+        if self.memory.peek(username) == user_id:
+            self.memory.pop(username)
+        if self.pending.get(username) == user_id:
+            del self.pending[username]
+        self.released[username] = user_id
+        self.releases += 1
+
+    def learn(self, user):
+        """
+        Remember username of message sender, forget the old one
+        :param user: telethon User or None
+        :return:
+        """
+        if user is None:
+            return
+        username = getattr(user, "username", None)
+        if isinstance(username, str) and username:
+            self.learned += 1
+            self.set(username, user.id)
+            return
+        old = self.names.peek(user.id)
+        if old is not None:
+            self._release(old, user.id)
+            self.names.pop(user.id)
+
+    async def flush(self):
+        """
+        Persist new mappings, delete released ones
+        :return:
+        """
+        if self.released:
+            released, self.released = self.released, {}
+            await TelegramUsername.delete_usernames(released)
+        if self.pending:
+            pending, self.pending = self.pending, {}
+            await TelegramUsername.set_usernames(pending)
+
+    def stats(self) -> dict:
+        return {
+            **self.memory.stats(),
+            "db_hits": self.db_hits,
+            "learned": self.learned,
+            "releases": self.releases,
+            "pending": len(self.pending),
+        }
+
+
+class ChatSettingsCache:
+    """
+    Process local cache of ChatSettings.
+    Chats without settings row are cached too (negative entries) and get default settings.
+    Entries are dropped by postgres NOTIFY from ChatSettings save signal (see PgListener),
+    ttl only limits staleness when notifications are lost
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float = None):
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._chats = {}
+        self._generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, chat_id: int) -> ChatSettings:
+        """
+        Get chat settings, missing row is not created
+        :param chat_id: int
+        :return: ChatSettings, unsaved with defaults if chat has no settings
+        """
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry[0] >= time.monotonic():
+            if entry[1] is None:
+                self.negative_hits += 1
+                return ChatSettings(chat_id=chat_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        generation = self._generation
+        settings = await ChatSettings.objects.filter(chat_id=chat_id).afirst()
+        # do not store value which was read before invalidation
+        if generation == self._generation:
+            ttl = self.negative_ttl if settings is None else self.ttl
+            self._chats[chat_id] = (time.monotonic() + ttl, settings)
+        return settings or ChatSettings(chat_id=chat_id)
+
+    def invalidate(self, chat_id: int = None):
+        """
+        Drop chat from cache, drop all chats if chat_id is None
+        :param chat_id: int
+        :return:
+        """
+        self._generation += 1
+        self.invalidations += 1
+        if chat_id is None:
+            self._chats.clear()
+        else:
+            self._chats.pop(chat_id, None)
+
+    def on_notify(self, payload: str):
+        """
+        Handler of CHAT_SETTINGS_CHANNEL notifications, payload is chat_id
+        :param payload: str
+        :return:
+        """
+        try:
+            self.invalidate(int(payload))
+        except ValueError:
+            self.invalidate()
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+class MessageHashCache:
+    """
+    Content hashes of recent messages, bounded per chat and by number of chats,
+    both least recently used first. Edit events without content change
+    (reactions, link previews) are recognized by equal hash
+    """
+
+    def __init__(self, max_chats: int, max_messages: int):
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self._chats: "OrderedDict[int, OrderedDict[int, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _chat(self, chat_id: int) -> "OrderedDict[int, bytes]":
+        messages = self._chats.get(chat_id)
+        if messages is None:
+            messages = self._chats[chat_id] = OrderedDict()
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return messages
+
+    def remember(self, chat_id: int, message_id: int, digest: bytes):
+        """
+        Store hash of new message
+        :param chat_id: int
+        :param message_id: int
+        :param digest: bytes
+        :return:
+        """
+        messages = self._chat(chat_id)
+        messages[message_id] = digest
+        messages.move_to_end(message_id)
+        if len(messages) > self.max_messages:
+            messages.popitem(last=False)
+
+    def changed(self, chat_id: int, message_id: int, digest: bytes) -> bool:
+        """
+        Compare hash of edited message with stored one and store the new hash
+        :param chat_id: int
+        :param message_id: int
+        :param digest: bytes
+        :return: bool, False if content is the same
+        """
+        messages = self._chats.get(chat_id)
+        if messages is not None and messages.get(message_id) == digest:
+            self._chats.move_to_end(chat_id)
+            messages.move_to_end(message_id)
+            self.hits += 1
+            return False
+        self.misses += 1
+        self.remember(chat_id, message_id, digest)
+        return True
+
+    def stats(self) -> dict:
+        checks = self.hits + self.misses
+        return {
+            "chats": len(self._chats),
+            "messages": sum(len(x) for x in self._chats.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / checks if checks else 0.0,
+        }
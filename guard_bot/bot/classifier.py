@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import time
+import typing
+import zlib
+
+from pathlib import Path
+
+import numpy as np
+
+from guard_bot.bot.duplicates import normalize
+
+if typing.TYPE_CHECKING:
+    from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("asyncio")
+
+DEFAULT_FEATURES_BITS = 18
+
+
+def features(text: str, bits: int = DEFAULT_FEATURES_BITS) -> "np.ndarray":
+    """
+    Hashing trick: words and word pairs of normalized text mapped to 2 ** bits columns
+    :param text: str
+    :param bits: int
+    :return: np.ndarray of column indices, with repeats
+    """
+    words = normalize(text).split()
+    tokens = words + [f"{x} {y}" for x, y in zip(words, words[1:])]
+    mask = (1 << bits) - 1
+    return np.fromiter(
+        (zlib.crc32(x.encode()) & mask for x in tokens), dtype=np.int64, count=len(tokens)
+    )
+
+
+class NaiveBayes:
+    """
+    Multinomial naive Bayes over hashed features.
+    Model is one float32 array: log likelihood ratio of every column and the
+    bias as the last item, so it can be memory mapped as is.
+    Classes get equal priors: the ratio of spam and ham in training data depends
+    on what moderators recorded, not on how much spam chats get, and with far
+    more spam than ham it would outweigh the words of short messages
+    """
+
+    def __init__(self, weights: "np.ndarray"):
+        self.weights = weights
+        self.bits = (len(weights) - 1).bit_length() - 1
+        assert len(weights) == (1 << self.bits) + 1, "model size must be 2 ** bits + 1"
+
+    @classmethod
+    def train(
+        cls,
+        spam: "Iterable[str]",
+        ham: "Iterable[str]",
+        bits: int = DEFAULT_FEATURES_BITS,
+        alpha: float = 1.0,
+        min_documents: int = 1,
+    ) -> "Tuple[NaiveBayes, int, int]":
+        """
+        Texts are read one by one, memory depends on number of features only
+        :param spam: iterable of str
+        :param ham: iterable of str
+        :param bits: int
+        :param alpha: float, additive smoothing
+        :param min_documents: int, fewer texts of a class are not enough to learn it
+        :return: tuple(model, spam count, ham count)
+        :raise ValueError: not enough texts of a class
+        """
+        size = 1 << bits
+        counts, documents = [], []
+        for texts in (spam, ham):
+            count = np.zeros(size, dtype=np.float64)
+            number = 0
+            for text in texts:
+                columns = features(text, bits)
+                if len(columns):
+                    count += np.bincount(columns, minlength=size)
+                    number += 1
+            counts.append(count)
+            documents.append(number)
+        if min(documents) < max(min_documents, 1):
+            raise ValueError(
+                f"At least {min_documents} texts of each class are required, "
+                f"got spam {documents[0]}, ham {documents[1]}"
+            )
+        spam_count, ham_count = counts
+        weights = np.empty(size + 1, dtype=np.float32)
+        weights[:size] = np.log((spam_count + alpha) / (spam_count.sum() + alpha * size)) - np.log(
+            (ham_count + alpha) / (ham_count.sum() + alpha * size)
+        )
+        weights[size] = 0.0
+        return cls(weights), documents[0], documents[1]
+
+    def save(self, path: "Path"):
+        """
+        Atomic write, running bots keep reading the old file until they reload
+        :param path: Path
+        :return:
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp")
+        with tmp.open("wb") as file:
+            np.save(file, self.weights)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: "Path") -> "NaiveBayes":
+        return cls(np.load(path, mmap_mode="r"))
+
+    def score_batch(self, batch: "List[np.ndarray]") -> "np.ndarray":
+        """
+        Spam probability of many messages with one gather and one segmented sum
+        :param batch: list of feature arrays made by "features"
+        :return: np.ndarray of float
+        """
+        lengths = np.fromiter((len(x) for x in batch), dtype=np.int64, count=len(batch))
+        scores = np.full(len(batch), self.weights[-1], dtype=np.float64)
+        if lengths.sum():
+            columns = np.concatenate(batch)
+            values = self.weights[columns].astype(np.float64)
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            not_empty = lengths > 0
+            scores[not_empty] += np.add.reduceat(values, offsets[not_empty])
+        return 1 / (1 + np.exp(-np.clip(scores, -50, 50)))
+
+    def score(self, text: str) -> float:
+        return float(self.score_batch([features(text, self.bits)])[0])
+
+
+class BatchScorer:
+    """
+    Collects messages arriving within "max_delay" seconds and scores them together,
+    a batch is scored at once when it reaches "max_batch" messages
+    """
+
+    def __init__(self, path: "Path", max_delay: float = 0.005, max_batch: int = 64):
+        self.path = Path(path)
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.model: "Optional[NaiveBayes]" = None
+        self._batch: "List[Tuple[np.ndarray, asyncio.Future]]" = []
+        self._timer: "Optional[asyncio.TimerHandle]" = None
+        self.batches = 0
+        self.scored = 0
+        self.max_batch_seen = 0
+        self.last_batch_duration = 0.0
+
+    def load(self) -> bool:
+        """
+        Load model file if it exists, old model stays on errors
+        :return: bool, True if model is loaded
+        """
+        try:
+            self.model = NaiveBayes.load(self.path)
+        except FileNotFoundError:
+            logger.info(f"No classifier model at {self.path}")
+        except (OSError, ValueError, AssertionError):
+            logger.exception(f"Classifier model {self.path} is broken")
+        return self.model is not None
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            scores = self.model.score_batch([x[0] for x in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), value in zip(batch, scores):
+            if not future.done():
+                future.set_result(float(value))
+        self.batches += 1
+        self.scored += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        self.last_batch_duration = time.perf_counter() - started
+
+    async def score(self, text: str) -> "Optional[float]":
+        """
+        :param text: str
+        :return: spam probability, None without model or without features in text
+        """
+        if self.model is None:
+            return None
+        columns = features(text, self.model.bits)
+        if not len(columns):
+            # nothing to judge by, e.g. emoji only
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((columns, future))
+        if len(self._batch) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.model is not None,
+            "batches": self.batches,
+            "scored": self.scored,
+            "avg_batch": self.scored / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch_seen,
+            "last_batch_duration": self.last_batch_duration,
+        }
@@ -0,0 +1,201 @@
+import asyncio
+import enum
+import logging
+import typing
+
+from collections import deque
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Tuple
+
+    Item = Tuple[Callable[[Any], Awaitable], Any, float]
+
+logger = logging.getLogger("asyncio")
+
+
+class Overflow(str, enum.Enum):
+    """What "put" does when the queue or the chat queue is full"""
+
+    # producer waits for space, at most "max_waiting" of them, later events are dropped.
+    # telethon runs every update in its own task, so a waiting producer holds its event too
+    WAIT = "wait"
+    # new event is dropped
+    DROP_NEW = "drop_new"
+    # the oldest event of the chat is dropped, of the longest chat on total overflow
+    DROP_OLDEST = "drop_oldest"
+
+
+class ChatDispatcher:
+    """
+    Bounded event queue partitioned by chat, served by "workers" tasks.
+    A chat is taken by one worker at a time, so events of a chat are handled in order
+    while chats run in parallel. Ready chats are served round robin, one event per turn,
+    and a chat holds at most "chat_maxsize" events, so a raided chat gets its share
+    of workers and of the queue and does not starve the others.
+    A raid outruns handlers, so dropping the oldest events of the raided chat
+    is the default: memory stays bounded and fresh messages are checked first
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        maxsize: int = 10000,
+        chat_maxsize: int = 1000,
+        overflow: "typing.Union[Overflow, str]" = Overflow.DROP_OLDEST,
+        max_waiting: int = 1000,
+    ):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.chat_maxsize = min(chat_maxsize, maxsize)
+        self.overflow = Overflow(overflow)
+        self.max_waiting = max_waiting
+        # chat is here while it has events or is being handled, it is in "_ready" at most once
+        self._chats: "Dict[Hashable, Deque[Item]]" = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._tasks: "List[asyncio.Task]" = []
+        self.closed = False
+        self.size = 0
+        self.active = 0
+        self.max_size = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.waits = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [
+                loop.create_task(self._run(), name=f"dispatcher_{i}") for i in range(self.workers)
+            ]
+
+    def _full(self, key: "Hashable") -> bool:
+        chat = self._chats.get(key)
+        return self.size >= self.maxsize or chat is not None and len(chat) >= self.chat_maxsize
+
+    def _drop_oldest(self, key: "Hashable"):
+        chat = self._chats.get(key)
+        if self.size >= self.maxsize and (chat is None or len(chat) < self.chat_maxsize):
+            # total overflow, the longest chat pays
+            chat = max(self._chats.values(), key=len)
+        chat.popleft()
+        self.size -= 1
+        self.dropped += 1
+
+    async def put(self, key: "Hashable", handler: "Callable[[Any], Awaitable]", event: "Any"):
+        """
+        Queue event, handled by "await handler(event)" after previous events of the same key
+        :param key: chat id
+        :param handler: coroutine function
+        :param event: telethon event
+        :return:
+        """
+        if self.closed:
+            raise RuntimeError("Dispatcher is closed")
+        self._start()
+        while self._full(key):
+            if self.overflow == Overflow.DROP_NEW:
+                self.dropped += 1
+                return
+            if self.overflow == Overflow.DROP_OLDEST:
+                self._drop_oldest(key)
+                break
+            if self.waiting >= self.max_waiting:
+                self.dropped += 1
+                return
+            self.waits += 1
+            self.waiting += 1
+            try:
+                self._space.clear()
+                await self._space.wait()
+            finally:
+                self.waiting -= 1
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = deque()
+            self._ready.put_nowait(key)
+        chat.append((handler, event, asyncio.get_running_loop().time()))
+        self.size += 1
+        self.enqueued += 1
+        self.max_size = max(self.max_size, self.size)
+        self._idle.clear()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            if not chat:
+                # events were dropped by overflow
+                del self._chats[key]
+                continue
+            handler, event, enqueued = chat.popleft()
+            self.size -= 1
+            self.active += 1
+            self._space.set()
+            wait = loop.time() - enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                await handler(event)
+            except Exception:
+                self.errors += 1
+                logger.exception(f"Event handler {getattr(handler, '__name__', handler)} failed")
+            finally:
+                self.active -= 1
+                self.processed += 1
+                # back to the end of the line, other ready chats go first
+                if chat:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                if not self.size and not self.active:
+                    self._idle.set()
+
+    async def join(self):
+        """
+        Wait until all queued events are handled
+        :return:
+        """
+        while self.size or self.active:
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def close(self, timeout: float = 5):
+        """
+        Stop accepting events, handle queued ones within timeout and stop workers
+        :param timeout: float
+        :return:
+        """
+        self.closed = True
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dispatcher closed with {self.size} events left")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        started = self.processed + self.active
+        return {
+            "workers": self.workers,
+            "size": self.size,
+            "max_size": self.max_size,
+            "chats": len(self._chats),
+            "active": self.active,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "waits": self.waits,
+            "waiting": self.waiting,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import re
+import time
+import typing
+
+from urllib.parse import urlsplit
+
+from telethon.tl.types import MessageEntityTextUrl, MessageEntityUrl
+from telethon.utils import get_inner_text
+
+from guard_bot.bot.models import BlockedDomain
+
+if typing.TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional
+
+# text fallback when message has no entities, e.g. sent by a bot or client without parsing
+_URL_RE = re.compile(
+    r"(?:https?://)?(?:[^\W_](?:[\w-]{0,61}[^\W_])?\.)+[^\W\d_][\w-]{1,62}(?::\d+)?(?:/\S*)?"
+)
+
+
+def normalize_domain(domain: str) -> "Optional[str]":
+    """
+    :param domain: str, "Example.XYZ.", "пример.рф"
+    :return: lower case ascii (punycode) domain or None if it is not valid
+    """
+    domain = domain.strip().rstrip(".").lower()
+    if not domain or "" in domain.split("."):
+        return None
+    if not domain.isascii():
+        try:
+            domain = domain.encode("idna").decode()
+        except UnicodeError:
+            return None
+    return domain
+
+
+def url_domain(url: str) -> "Optional[str]":
+    """
+    :param url: str, with or without scheme
+    :return: normalized domain or None
+    """
+    if "://" not in url:
+        url = f"http://{url}"
+    try:
+        hostname = urlsplit(url).hostname
+    except ValueError:
+        return None
+    return normalize_domain(hostname) if hostname else None
+
+
+def extract_urls(text: str, entities: "Optional[List]" = None) -> "List[str]":
+    """
+    Links of message, taken from Url/TextUrl entities, from text if there are no entities
+    :param text: str, message text
+    :param entities: list of telethon MessageEntity or None
+    :return: list of str
+    """
+    if not entities:
+        return _URL_RE.findall(text)
+    urls = []
+    entities = [x for x in entities if isinstance(x, (MessageEntityUrl, MessageEntityTextUrl))]
+    for entity, inner in zip(entities, get_inner_text(text, entities)):
+        urls.append(entity.url if isinstance(entity, MessageEntityTextUrl) else inner)
+    return urls
+
+
+class _Node:
+    __slots__ = ("children", "domain", "subdomains")
+
+    def __init__(self):
+        self.children: "Dict[str, _Node]" = {}
+        # entry which blocks this domain and entry which blocks its subdomains
+        self.domain: "Optional[str]" = None
+        self.subdomains: "Optional[str]" = None
+
+
+class DomainTrie:
+    """
+    Domains stored by labels from the top level one: "a.example.xyz" is xyz -> example -> a.
+    Lookup walks labels of checked domain, so it does not depend on number of entries
+    """
+
+    def __init__(self, entries: "Iterable[str]" = ()):
+        self.root = _Node()
+        self.size = 0
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry: str) -> bool:
+        """
+        :param entry: str, "example.xyz" blocks domain and subdomains, "*.example.xyz" subdomains only
+        :return: bool, False for invalid entry
+        """
+        only_subdomains = entry.startswith("*.")
+        domain = normalize_domain(entry[2:] if only_subdomains else entry)
+        if not domain:
+            return False
+        node = self.root
+        for label in reversed(domain.split(".")):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        if node.subdomains is None:
+            self.size += 1
+        if not only_subdomains:
+            node.domain = entry
+        node.subdomains = entry
+        return True
+
+    def match(self, domain: str) -> "Optional[str]":
+        """
+        :param domain: str, normalized domain
+        :return: matched entry or None
+        """
+        labels = domain.split(".")
+        node = self.root
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[i])
+            if node is None:
+                return None
+            if i and node.subdomains is not None:
+                return node.subdomains
+        return node.domain
+
+    def __len__(self):
+        return self.size
+
+
+class DomainBlocklist:
+    """
+    Global and per chat tries built from BlockedDomain table.
+    Tries are rebuilt on reload and swapped, concurrent reload requests are
+    coalesced into one more load after the running one
+    """
+
+    def __init__(self):
+        self._global = DomainTrie()
+        self._chats: "Dict[int, DomainTrie]" = {}
+        self._lock = asyncio.Lock()
+        self._dirty = False
+        self.loaded = False
+        self.loads = 0
+        self.lookups = 0
+        self.hits = 0
+        self.last_load_duration = None
+
+    def match(self, chat_id: int, domain: str) -> "Optional[str]":
+        """
+        :param chat_id: int
+        :param domain: str, normalized domain
+        :return: matched entry or None
+        """
+        self.lookups += 1
+        entry = self._global.match(domain)
+        if entry is None:
+            chat = self._chats.get(chat_id)
+            entry = chat.match(domain) if chat is not None else None
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    async def load(self):
+        """
+        Read whole table and swap tries
+        :return:
+        """
+        started = time.monotonic()
+        global_trie, chats = DomainTrie(), {}
+        async for domain, chat_id in BlockedDomain.objects.values_list("domain", "chat_id"):
+            if chat_id is None:
+                global_trie.add(domain)
+            else:
+                trie = chats.get(chat_id)
+                if trie is None:
+                    trie = chats[chat_id] = DomainTrie()
+                trie.add(domain)
+        self._global, self._chats = global_trie, chats
+        self.loaded = True
+        self.loads += 1
+        self.last_load_duration = time.monotonic() - started
+
+    async def reload(self):
+        """
+        Load, if load is running already, it is repeated once after
+        :return:
+        """
+        self._dirty = True
+        if self._lock.locked():
+            return
+        async with self._lock:
+            while self._dirty:
+                self._dirty = False
+                await self.load()
+
+    def stats(self) -> dict:
+        return {
+            "global": len(self._global),
+            "chats": len(self._chats),
+            "chat_entries": sum(len(x) for x in self._chats.values()),
+            "loads": self.loads,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "last_load_duration": self.last_load_duration,
+        }
@@ -0,0 +1,222 @@
+import re
+import time
+import typing
+import zlib
+
+from collections import deque
+
+if typing.TYPE_CHECKING:
+    from typing import Deque, Dict, List, Optional, Tuple
+
+_NON_WORD = re.compile(r"[\W_]+")
+_DIGITS = re.compile(r"\d+")
+_MASK32 = 0xFFFFFFFF
+_EMPTY = _MASK32 + 1
+
+
+def normalize(text: str) -> str:
+    """
+    Case, punctuation, emoji, spacing and numbers are the usual variations of a spam wave
+    :param text: str
+    :return: str, lower case words separated by one space, every number is "0"
+    """
+    return _DIGITS.sub("0", _NON_WORD.sub(" ", text.casefold())).strip()
+
+
+def signature(text: str, hashes: int = 64, shingle: int = 5) -> "Optional[Tuple[int, ...]]":
+    """
+    One permutation MinHash of character shingles: every shingle is hashed once,
+    high bits select a bin and the minimum of low bits is kept per bin.
+    Empty bins borrow the next non-empty bin (rotation densification),
+    so two signatures agree in a bin with probability close to Jaccard similarity
+    :param text: str, normalized text
+    :param hashes: int, number of bins, power of 2
+    :param shingle: int, characters in shingle
+    :return: tuple of ints or None if text is shorter than shingle
+    """
+    data = text.encode()
+    if len(data) < shingle:
+        return None
+    shift = 32 - (hashes.bit_length() - 1)
+    low = (1 << shift) - 1
+    bins = [_EMPTY] * hashes
+    crc32 = zlib.crc32
+    for i in range(len(data) - shingle + 1):
+        hashed = (crc32(data[i : i + shingle]) * 0x9E3779B1) & _MASK32
+        position = hashed >> shift
+        value = hashed & low
+        if value < bins[position]:
+            bins[position] = value
+    for i in range(hashes):
+        if bins[i] == _EMPTY:
+            for distance in range(1, hashes):
+                value = bins[(i + distance) % hashes]
+                if value != _EMPTY and value < low + 1:
+                    # offset keeps borrowed values distinct from real ones
+                    bins[i] = value + distance * (low + 1) * 2
+                    break
+    return tuple(bins)
+
+
+def prepare(text: str, min_length: int = 30, hashes: int = 64) -> "Optional[Tuple[int, ...]]":
+    """
+    CPU part of duplicate check, runs in process pool for long texts
+    :param text: str, raw message text
+    :param min_length: int, shorter normalized texts are not checked
+    :param hashes: int
+    :return: signature or None for short text
+    """
+    text = normalize(text)
+    if len(text) < min_length:
+        return None
+    return signature(text, hashes)
+
+
+class _Entry:
+    __slots__ = ("created", "chat_id", "key", "signature", "bands")
+
+    def __init__(self, created, chat_id, key, signature, bands):
+        self.created = created
+        self.chat_id = chat_id
+        self.key = key
+        self.signature = signature
+        self.bands = bands
+
+
+class NearDuplicateIndex:
+    """
+    Messages of all chats over a sliding time window, indexed by LSH bands of
+    MinHash signatures. A message is a duplicate when similar messages were posted
+    in at least "min_chats" chats within "window" seconds.
+    Memory is bounded by window and "capacity", the oldest entries are evicted first,
+    so every band bucket is a queue in time order too
+    """
+
+    def __init__(
+        self,
+        window: float = 600,
+        min_chats: int = 3,
+        min_length: int = 30,
+        capacity: int = 100_000,
+        similarity: float = 0.6,
+        hashes: int = 64,
+        bands: int = 16,
+        max_candidates: int = 256,
+    ):
+        assert hashes & (hashes - 1) == 0 and hashes % bands == 0
+        self.window = window
+        self.min_chats = min_chats
+        self.min_length = min_length
+        self.capacity = capacity
+        self.similarity = similarity
+        self.hashes = hashes
+        self.rows = hashes // bands
+        self.max_candidates = max_candidates
+        self._entries: "Deque[_Entry]" = deque()
+        self._keys: "Dict[Tuple[int, int], _Entry]" = {}
+        self._buckets: "Dict[int, Deque[_Entry]]" = {}
+        self.lookups = 0
+        self.candidates = 0
+        self.duplicates = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bands(self, sig: "Tuple[int, ...]") -> "List[int]":
+        rows = self.rows
+        return [hash((i, sig[i : i + rows])) for i in range(0, self.hashes, rows)]
+
+    def _evict(self, now: float):
+        entries, buckets = self._entries, self._buckets
+        oldest = now - self.window
+        while entries and (entries[0].created < oldest or len(entries) > self.capacity):
+            entry = entries.popleft()
+            self._keys.pop(entry.key, None)
+            for band in entry.bands:
+                bucket = buckets[band]
+                bucket.popleft()
+                if not bucket:
+                    del buckets[band]
+            self.evictions += 1
+
+    def check(
+        self, chat_id: int, message_id: int, text: str, now: "Optional[float]" = None
+    ) -> int:
+        """
+        Add message to index and count chats with similar messages
+        :param chat_id: int
+        :param message_id: int
+        :param text: str
+        :param now: float, monotonic time
+        :return: int, number of chats including current one, 0 for short text
+        """
+        return self.add(chat_id, message_id, prepare(text, self.min_length, self.hashes), now)
+
+    def add(
+        self,
+        chat_id: int,
+        message_id: int,
+        sig: "Optional[Tuple[int, ...]]",
+        now: "Optional[float]" = None,
+    ) -> int:
+        """
+        Same as "check" for signature made by "prepare"
+        :param chat_id: int
+        :param message_id: int
+        :param sig: tuple or None
+        :param now: float, monotonic time
+        :return: int
+        """
+        if sig is None:
+            return 0
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        self.lookups += 1
+        bands = self._bands(sig)
+
+        chats = {chat_id}
+        seen = set()
+        required = self.similarity * self.hashes
+        buckets = self._buckets
+        for band in bands:
+            for entry in buckets.get(band, ()):
+                if entry.chat_id in chats or id(entry) in seen:
+                    continue
+                if len(seen) >= self.max_candidates:
+                    break
+                seen.add(id(entry))
+                same = sum(1 for x, y in zip(sig, entry.signature) if x == y)
+                if same >= required:
+                    chats.add(entry.chat_id)
+            if len(chats) >= self.min_chats:
+                break
+        self.candidates += len(seen)
+
+        key = (chat_id, message_id)
+        # edits of indexed message do not count twice
+        if key not in self._keys:
+            entry = _Entry(now, chat_id, key, sig, bands)
+            self._entries.append(entry)
+            self._keys[key] = entry
+            for band in bands:
+                bucket = buckets.get(band)
+                if bucket is None:
+                    bucket = buckets[band] = deque()
+                bucket.append(entry)
+            if len(self._entries) > self.capacity:
+                self._evict(now)
+
+        if len(chats) >= self.min_chats:
+            self.duplicates += 1
+        return len(chats)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "lookups": self.lookups,
+            "candidates": self.candidates,
+            "duplicates": self.duplicates,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import typing
+
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Callable, Optional
+
+logger = logging.getLogger("asyncio")
+
+
+class CpuExecutor:
+    """
+    Process pool for CPU-bound work of spam stages, so it does not block the event loop.
+    Only plain picklable features go to workers, functions must live in modules which
+    do not need django to be set up. Not more than "pending_per_worker" calls per worker
+    are in flight, "submit" returns None instead of queueing more
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        pending_per_worker: int = 2,
+        start_method: str = "forkserver",
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = self.workers * pending_per_worker
+        self.start_method = start_method
+        self._pool: "Optional[ProcessPoolExecutor]" = None
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.broken = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context(self.start_method)
+            )
+        return self._pool
+
+    def start(self, timeout: float = 60):
+        """
+        Start workers before the first call, a cold pool would not answer
+        within stage budget. Blocks until every worker is up or timeout
+        :param timeout: float, seconds
+        :return:
+        """
+        pool = self._get_pool()
+        started = time.monotonic()
+        wait([pool.submit(os.getpid) for _ in range(self.workers)], timeout)
+        logger.info(f"Process pool of {self.workers} started in {time.monotonic() - started:.2f}s")
+
+    def _done(self, future):
+        self.pending -= 1
+        self.completed += 1
+
+    def submit(self, fn: "Callable", *args: "Any") -> "Optional[asyncio.Future]":
+        """
+        Run function in pool
+        :param fn: picklable function
+        :param args: picklable arguments
+        :return: asyncio.Future or None when pool is saturated
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker died, next call starts a new pool
+            logger.exception("Process pool is broken")
+            self.broken += 1
+            self._pool = None
+            return None
+        self.pending += 1
+        self.submitted += 1
+        # pending counts calls until worker finishes, even if caller gave up waiting
+        future.add_done_callback(lambda x: self._schedule_done(loop, x))
+        return asyncio.wrap_future(future)
+
+    def _schedule_done(self, loop: "asyncio.AbstractEventLoop", future):
+        try:
+            loop.call_soon_threadsafe(self._done, future)
+        except RuntimeError:
+            # loop is closed, call finished after shutdown
+            pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "broken": self.broken,
+        }
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a sleeping task
+    """
+
+    def __init__(self, interval: float = 1):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+        self.samples = 0
+
+    def record(self, lag: float):
+        self.last = lag
+        self.max = max(self.max, lag)
+        self.total += lag
+        self.samples += 1
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, time.monotonic() - started - self.interval))
+
+    def stats(self) -> dict:
+        return {
+            "last": self.last,
+            "max": self.max,
+            "avg": self.total / self.samples if self.samples else 0.0,
+        }
@@ -0,0 +1,110 @@
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from typing import Dict, Hashable, Optional, Tuple
+
+    from guard_bot.bot.models import ChatSettings
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class FloodDetector:
+    """
+    Token bucket per (chat, user) and per chat, refilled lazily on message.
+    Bucket idle longer than "idle" seconds is full again, so it is dropped
+    by a sweep which runs once per "idle" seconds
+    """
+
+    def __init__(self, idle: float = 600):
+        self.idle = idle
+        self._users: "Dict[Tuple[int, int], _Bucket]" = {}
+        self._chats: "Dict[int, _Bucket]" = {}
+        self._swept = 0.0
+        self.user_floods = 0
+        self.chat_floods = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _take(
+        buckets: "Dict[Hashable, _Bucket]", key: "Hashable", limit: int, period: float, now: float
+    ) -> bool:
+        """
+        Take one token, limit messages per period
+        :return: bool, True if bucket is empty, it is refilled then
+        """
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = _Bucket(limit - 1, now)
+            return False
+        bucket.tokens = min(limit, bucket.tokens + (now - bucket.updated) * limit / period)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return False
+        # one action per flood, next one only after full limit of messages
+        bucket.tokens = limit
+        return True
+
+    def _sweep(self, now: float):
+        self._swept = now
+        oldest = now - self.idle
+        for buckets in (self._users, self._chats):
+            idle = [key for key, bucket in buckets.items() if bucket.updated < oldest]
+            for key in idle:
+                del buckets[key]
+            self.evictions += len(idle)
+
+    def hit(
+        self,
+        chat_id: int,
+        user_id: int,
+        chat_settings: "ChatSettings",
+        now: "Optional[float]" = None,
+    ) -> "Tuple[bool, bool]":
+        """
+        Count message, limits are taken from chat settings, zero limit disables check
+        :param chat_id: int
+        :param user_id: int
+        :param chat_settings: ChatSettings
+        :param now: float, monotonic time
+        :return: tuple(user flood, chat flood)
+        """
+        now = time.monotonic() if now is None else now
+        if now - self._swept > self.idle:
+            self._sweep(now)
+        user_flood = chat_flood = False
+        if chat_settings.flood_user_limit:
+            user_flood = self._take(
+                self._users,
+                (chat_id, user_id),
+                chat_settings.flood_user_limit,
+                chat_settings.flood_user_period.total_seconds(),
+                now,
+            )
+            self.user_floods += user_flood
+        if chat_settings.flood_chat_limit:
+            chat_flood = self._take(
+                self._chats,
+                chat_id,
+                chat_settings.flood_chat_limit,
+                chat_settings.flood_chat_period.total_seconds(),
+                now,
+            )
+            self.chat_floods += chat_flood
+        return user_flood, chat_flood
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "chats": len(self._chats),
+            "user_floods": self.user_floods,
+            "chat_floods": self.chat_floods,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,174 @@
+import re
+import typing
+
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from functools import lru_cache
+
+if typing.TYPE_CHECKING:
+    from typing import Optional, Union, List, Tuple
+
+TG_USER = re.compile(r"\[[^\]]*\]\(tg\:\/+\w+\?id=(\d+)\)", re.I)
+DOG_USER = re.compile(r"(@\w+)", re.I)
+SHARP_USER = re.compile(r"#(\d+)", re.I)
+COMMAND = re.compile(r"!(\w+)", re.I)
+HOURS = re.compile(r"(\d+)(hr|h)+", re.I)
+MINUTES = re.compile(r"(\d+)(min|m)+", re.I)
+DAYS = re.compile(r"(\d+)(days|d)+", re.I)
+USER_PERMS = [re.compile(
+    r"(message|media|sticker|gif|game|inline|link|poll|invite)+",
+    re.I
+)]
+
+USERS_LIST = [TG_USER, DOG_USER, SHARP_USER]
+PERIOD = [("hours", HOURS), ("minutes", MINUTES), ("days", DAYS)]
+USERS_AND_PERMS = OrderedDict({'command': COMMAND, 'users': USERS_LIST, 'perms': USER_PERMS})
+USERS = OrderedDict({"command": COMMAND, "users": USERS_LIST})
+USERS_AND_PERIOD = OrderedDict(
+    {"command": COMMAND, "users": USERS_LIST, "period": PERIOD}
+)
+PERIOD_ONLY = OrderedDict({"command": COMMAND, "period": PERIOD})
+
+# telegram does not deliver longer messages, anything above is crafted input
+MAX_COMMAND_LENGTH = 4096
+MAX_COMMAND_TOKENS = 256
+
+_SPACES = re.compile(r"\s*")
+
+
+class GrammarError(ValueError):
+    pass
+
+
+class CommandTooLong(GrammarError):
+    pass
+
+
+@dataclass(slots=True)
+class CommandArgs:
+    """
+    Typed result of command parsing, unset attributes stay None
+    """
+
+    command: "Optional[str]" = None
+    users: "Union[str, List[str], None]" = None
+    perms: "Union[str, List[str], None]" = None
+    hours: "Union[str, List[str], None]" = None
+    minutes: "Union[str, List[str], None]" = None
+    days: "Union[str, List[str], None]" = None
+    comment: "Optional[str]" = None
+
+    def add(self, name: str, value: str):
+        """
+        Set attribute, second and next values of the same attribute are collected to list
+        :param name: str
+        :param value: str
+        :return:
+        """
+        current = getattr(self, name)
+        if current is None:
+            setattr(self, name, value)
+        elif isinstance(current, list):
+            current.append(value)
+        else:
+            setattr(self, name, [current, value])
+
+    def as_dict(self) -> dict:
+        """
+        Dict with attributes which were found, same shape as old attr_getter result
+        :return: dict
+        """
+        result = {}
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if value is not None:
+                result[field.name] = value
+        return result
+
+
+ARG_NAMES = frozenset(x.name for x in fields(CommandArgs)) - {"comment"}
+
+
+class Grammar:
+    """
+    Compiled command grammar.
+    Every spec key becomes one segment: a single alternation of all segment rules
+    wrapped in named groups. Segments are applied in spec order, each rule is tried
+    at the current position only, so the whole text is parsed in one pass without slicing.
+    """
+
+    def __init__(self, spec: "Tuple[Tuple[str, tuple, bool], ...]"):
+        self.segments = []
+        for key, rules, repeat in spec:
+            parts, groups, index = [], {}, 1
+            for i, (attr_name, pattern) in enumerate(rules):
+                group_name = f"{key}__{i}"
+                parts.append(f"(?P<{group_name}>{pattern.pattern})")
+                # value is the first group of the rule, right after the wrapper group
+                groups[group_name] = (attr_name or key, index + 1)
+                index += 1 + pattern.groups
+            flags = 0
+            for _, pattern in rules:
+                flags |= pattern.flags
+            # trailing spaces are consumed by the token itself
+            regex = re.compile(f"(?:{'|'.join(parts)})\\s*", flags)
+            self.segments.append((regex.match, groups, repeat))
+
+    def parse(self, s: str) -> CommandArgs:
+        """
+        Parse command text
+        :param s: str, example !ban @user #1234 some reason
+        :return: CommandArgs
+        """
+        end = len(s)
+        if end > MAX_COMMAND_LENGTH:
+            raise CommandTooLong(f"Command is longer than {MAX_COMMAND_LENGTH}")
+        result = CommandArgs()
+        pos, tokens = 0, 0
+        for match_at, groups, repeat in self.segments:
+            match = match_at(s, pos)
+            while match:
+                tokens += 1
+                if tokens > MAX_COMMAND_TOKENS:
+                    raise CommandTooLong(f"Command has more than {MAX_COMMAND_TOKENS} arguments")
+                attr_name, index = groups[match.lastgroup]
+                result.add(attr_name, match.group(index))
+                stop, pos = not repeat or match.end() == pos, match.end()
+                if stop:
+                    break
+                match = match_at(s, pos)
+            pos = _SPACES.match(s, pos).end()
+        if pos < end:
+            result.comment = s[pos:]
+        return result
+
+
+def _spec_key(spec: OrderedDict) -> "Tuple[Tuple[str, tuple, bool], ...]":
+    key = []
+    for name, value in spec.items():
+        if isinstance(value, list):
+            rules = tuple(x if isinstance(x, tuple) else (None, x) for x in value)
+            repeat = True
+        else:
+            rules, repeat = ((None, value),), False
+        for attr_name, pattern in rules:
+            if (attr_name or name) not in ARG_NAMES:
+                raise GrammarError(f"Unknown command attribute {attr_name or name}")
+            if pattern.groups < 1:
+                raise GrammarError(f"Rule {pattern.pattern} has no value group")
+        key.append((name, rules, repeat))
+    return tuple(key)
+
+
+@lru_cache(maxsize=None)
+def _compile(key: "Tuple[Tuple[str, tuple, bool], ...]") -> Grammar:
+    return Grammar(key)
+
+
+def compile_grammar(spec: OrderedDict) -> Grammar:
+    """
+    Compile spec to grammar, grammars are cached by spec rules
+    :param spec: OrderedDict, example OrderedDict({'command': COMMAND, 'users': USERS_LIST})
+    :return: Grammar
+    """
+    return _compile(_spec_key(spec))
@@ -0,0 +1,205 @@
+import logging
+import re
+import typing
+
+from collections import deque
+
+from guard_bot.bot.cache import LRUCache
+
+if typing.TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional, Tuple
+
+    from guard_bot.bot.models import ChatSettings
+
+logger = logging.getLogger("asyncio")
+
+
+def split_lines(value: str) -> "List[str]":
+    """
+    :param value: str, one item per line
+    :return: list of not empty stripped lines
+    """
+    return [x.strip() for x in (value or "").splitlines() if x.strip()]
+
+
+class AhoCorasick:
+    """
+    Automaton for many phrases, finds them in one pass over text.
+    Phrases are case insensitive and match whole words only,
+    so "spam" is not found in "spammer"
+    """
+
+    def __init__(self, phrases: "Iterable[str]" = ()):
+        self._goto: "List[Dict[str, int]]" = [{}]
+        self._fail: "List[int]" = [0]
+        self._out: "List[Tuple[str, ...]]" = [()]
+        for phrase in phrases:
+            self._add(phrase.casefold())
+        self._build()
+
+    def _add(self, phrase: str):
+        if not phrase:
+            return
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        if phrase not in self._out[state]:
+            self._out[state] += (phrase,)
+
+    def _build(self):
+        # breadth first, so fail state of a node is ready before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._out[child] += self._out[fail]
+
+    def __len__(self):
+        return sum(1 for x in self._out if x)
+
+    @staticmethod
+    def _is_word(text: str, start: int, end: int) -> bool:
+        return (start == 0 or not text[start - 1].isalnum()) and (
+            end == len(text) or not text[end].isalnum()
+        )
+
+    def search(self, text: str) -> "Optional[str]":
+        """
+        :param text: str
+        :return: first found phrase or None
+        """
+        if len(self._goto) == 1:
+            return None
+        text = text.casefold()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase in out[state]:
+                if self._is_word(text, i + 1 - len(phrase), i + 1):
+                    return phrase
+        return None
+
+
+def compile_patterns(
+    patterns: "Iterable[str]",
+) -> "Tuple[Optional[re.Pattern], List[Tuple[int, re.Pattern]], List[Tuple[str, re.error]]]":
+    """
+    Patterns are joined into one case insensitive regex with a named group "p<index>"
+    per pattern. Groups, backreferences and inline global flags of a pattern would
+    break the joined regex or change its meaning, such patterns are compiled separately
+    :param patterns: list of str
+    :return: tuple (joined regex or None, list of (index, regex) compiled separately,
+        list of (pattern, error) for invalid patterns, indexes skip them)
+    :raise re.error: joined regex does not compile
+    """
+    joined, separate, invalid = [], [], []
+    index = 0
+    for pattern in patterns:
+        try:
+            regex = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            invalid.append((pattern, e))
+            continue
+        try:
+            # inline global flags are allowed at the start of the expression only
+            joinable = not regex.groups and re.compile(f"(?:)|(?:{pattern})")
+        except re.error:
+            joinable = False
+        if joinable:
+            joined.append(f"(?P<p{index}>{pattern})")
+        else:
+            separate.append((index, regex))
+        index += 1
+    regex = re.compile("|".join(joined), re.IGNORECASE) if joined else None
+    return regex, separate, invalid
+
+
+class ChatBlocklist:
+    """
+    Compiled phrases and patterns of one chat, patterns are joined into one regex
+    with a named group per pattern to report which one matched
+    """
+
+    def __init__(self, phrases: "Iterable[str]" = (), patterns: "Iterable[str]" = ()):
+        self.phrases = AhoCorasick(phrases)
+        patterns = list(patterns)
+        try:
+            self.regex, self.separate, invalid = compile_patterns(patterns)
+        except re.error:
+            logger.exception("Blocklist patterns are not joined")
+            self.regex = None
+            self.separate, invalid = [], []
+            for pattern in patterns:
+                try:
+                    self.separate.append((len(self.separate), re.compile(pattern, re.IGNORECASE)))
+                except re.error as e:
+                    invalid.append((pattern, e))
+        for pattern, error in invalid:
+            logger.warning(f"Invalid blocklist pattern {pattern!r} skipped. {error}")
+        skipped = {pattern for pattern, _ in invalid}
+        self.patterns = [x for x in patterns if x not in skipped]
+
+    def search(self, text: str) -> "Optional[str]":
+        """
+        :param text: str
+        :return: str, found phrase or pattern, None if nothing found
+        """
+        phrase = self.phrases.search(text)
+        if phrase is not None:
+            return f"phrase {phrase}"
+        if self.regex is not None:
+            match = self.regex.search(text)
+            if match is not None:
+                return f"pattern {self.patterns[int(match.lastgroup[1:])]}"
+        for index, regex in self.separate:
+            if regex.search(text) is not None:
+                return f"pattern {self.patterns[index]}"
+        return None
+
+
+class BlocklistCache:
+    """
+    Compiled blocklists by chat, entry is rebuilt only when blocklist version
+    of chat settings changes, other settings changes keep it
+    """
+
+    def __init__(self, maxsize: int, ttl: float = 24 * 60 * 60):
+        self._cache = LRUCache(maxsize, ttl)
+        self.compiles = 0
+
+    def get(self, chat_settings: "ChatSettings") -> "Optional[ChatBlocklist]":
+        """
+        :param chat_settings: ChatSettings
+        :return: ChatBlocklist or None if chat has no blocklist
+        """
+        if not chat_settings.blocklist_version:
+            return None
+        entry = self._cache.get(chat_settings.chat_id)
+        if entry is not None and entry[0] == chat_settings.blocklist_version:
+            return entry[1]
+        self.compiles += 1
+        blocklist = ChatBlocklist(
+            split_lines(chat_settings.blocked_phrases),
+            split_lines(chat_settings.blocked_patterns),
+        )
+        self._cache.set(chat_settings.chat_id, (chat_settings.blocklist_version, blocklist))
+        return blocklist
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "compiles": self.compiles}
@@ -0,0 +1,110 @@
+import asyncio
+import time
+import typing
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+if typing.TYPE_CHECKING:
+    from typing import Hashable, Optional
+
+
+class LockException(Exception):
+    pass
+
+
+class LockStats:
+    __slots__ = ("acquired", "contended", "timeouts", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self) -> dict:
+        return {x: getattr(self, x) for x in self.__slots__}
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class KeyedLock:
+    """
+    Lock manager with asyncio.Lock per key.
+    Waiters of the same key are woken in FIFO order, lock is dropped when
+    nobody holds or waits for it, so only keys in use take memory.
+    Usage: async with locks.acquire(("refresh_admins", chat_id), timeout=1.0): ...
+    """
+
+    def __init__(self, max_stats_keys: int = 1024):
+        self._locks = {}
+        self._stats = OrderedDict()
+        self.max_stats_keys = max_stats_keys
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key: "Hashable") -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def _key_stats(self, key: "Hashable") -> LockStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = LockStats()
+            if len(self._stats) > self.max_stats_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+        return stats
+
+    @asynccontextmanager
+    async def acquire(self, key: "Hashable", timeout: "Optional[float]" = None):
+        """
+        Hold lock for key
+        :param key: hashable, e.g. ("refresh_admins", chat_id)
+        :param timeout: float, seconds to wait, None - wait forever
+        :return: async context manager
+        :raises LockException: lock was not acquired in timeout
+        """
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _Entry()
+        entry.users += 1
+        try:
+            stats = self._key_stats(key)
+            if entry.lock.locked():
+                stats.contended += 1
+                started = time.monotonic()
+                try:
+                    await asyncio.wait_for(entry.lock.acquire(), timeout)
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    raise LockException("Already locked by another coroutine")
+                waited = time.monotonic() - started
+                stats.wait_total += waited
+                stats.wait_max = max(stats.wait_max, waited)
+            else:
+                await entry.lock.acquire()
+            stats.acquired += 1
+            try:
+                yield self
+            finally:
+                entry.lock.release()
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[key]
+
+    def stats(self) -> dict:
+        return {
+            "held": len(self._locks),
+            "keys": {key: value.as_dict() for key, value in self._stats.items()},
+        }
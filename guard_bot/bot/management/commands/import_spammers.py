@@ -0,0 +1,169 @@
+import gzip
+import sys
+import time
+import typing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from guard_bot.bot.models import SPAMMERS_CHANNEL, Spammers
+
+if typing.TYPE_CHECKING:
+    from typing import Callable, Optional, TextIO
+
+_MAX_ID = 2**63 - 1
+
+STAGING_TABLE = "bot_spammers_import"
+
+MERGE_SQL = """
+WITH merged AS (
+    INSERT INTO {table} (telegram_id, from_cas, updated)
+    SELECT DISTINCT telegram_id, %(from_cas)s, now() FROM {staging}
+    ON CONFLICT (telegram_id) DO UPDATE SET from_cas = true, updated = now()
+    WHERE NOT {table}.from_cas AND EXCLUDED.from_cas
+    RETURNING xmax = 0 AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+# rows of the same origin which are absent from the file
+DELETE_SQL = """
+DELETE FROM {table} AS spammers
+WHERE spammers.from_cas = %(from_cas)s
+AND NOT EXISTS (SELECT 1 FROM {staging} WHERE {staging}.telegram_id = spammers.telegram_id)
+"""
+
+
+class IdStream:
+    """
+    File-like object for COPY FROM STDIN, turns lines of a csv/text dump
+    into one telegram ID per line. Only first column is used, invalid lines
+    (headers, comments, garbage) are counted and skipped
+    """
+
+    def __init__(
+        self,
+        file: "TextIO",
+        report_every: int = 0,
+        report: "Optional[Callable[[int, float], None]]" = None,
+    ):
+        self.file = file
+        self.report_every = report_every
+        self.report = report
+        self.rows = 0
+        self.invalid = 0
+        self.started = time.monotonic()
+
+    @staticmethod
+    def parse(line: str) -> "Optional[int]":
+        """
+        :param line: str, "123", "123,comment", "123 comment" or '"123",...'
+        :return: int or None if line has no valid ID
+        """
+        fields = line.split(",", 1)[0].replace('"', " ").split(None, 1)
+        if not fields or not fields[0].isascii() or not fields[0].isdigit():
+            return None
+        field = fields[0]
+        value = int(field)
+        if not 0 < value <= _MAX_ID:
+            return None
+        return value
+
+    def read(self, size: int = -1) -> str:
+        chunk = []
+        length = 0
+        for line in self.file:
+            value = self.parse(line)
+            if value is None:
+                if line.strip():
+                    self.invalid += 1
+                continue
+            value = f"{value}\n"
+            chunk.append(value)
+            length += len(value)
+            self.rows += 1
+            if self.report and self.report_every and self.rows % self.report_every == 0:
+                self.report(self.rows, time.monotonic() - self.started)
+            if 0 < size <= length:
+                break
+        return "".join(chunk)
+
+
+class Command(BaseCommand):
+    help = (
+        "stream csv/text dump of telegram IDs into Spammers table "
+        "with COPY and one set-based merge, running bots refresh their index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="file with ID in first column, '-' for stdin, .gz is supported")
+        parser.add_argument("--cas", action="store_true", help="mark imported IDs as from CAS")
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="delete IDs of the same origin (CAS or not) which are absent from file",
+        )
+        parser.add_argument(
+            "--report-every",
+            type=int,
+            default=1_000_000,
+            help="print progress every N rows, 0 disables it",
+        )
+
+    def _open(self, path: str) -> "TextIO":
+        if path == "-":
+            return sys.stdin
+        try:
+            if path.endswith(".gz"):
+                return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+            return open(path, encoding="utf-8", errors="replace")
+        except OSError as e:
+            raise CommandError(f"Can't open {path}: {e}")
+
+    def _report(self, rows: int, elapsed: float):
+        self.stdout.write(f"Read {rows} rows, {rows / max(elapsed, 1e-9):.0f} rows/s")
+
+    def handle(self, *args, path="-", cas=False, replace=False, report_every=0, **options):
+        """
+        File is never loaded in memory: lines go to a temporary table with COPY,
+        merge and delete are single statements. Everything is one transaction,
+        NOTIFY makes running bots refresh their spammers index after commit
+        :param path: str
+        :param cas: bool
+        :param replace: bool
+        :param report_every: int
+        :return:
+        """
+        table = Spammers._meta.db_table
+        params = {"from_cas": cas}
+        started = time.monotonic()
+        file = self._open(path)
+        stream = IdStream(file, report_every, self._report)
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMPORARY TABLE {STAGING_TABLE} (telegram_id bigint NOT NULL) ON COMMIT DROP"
+                )
+                cursor.copy_expert(f"COPY {STAGING_TABLE} (telegram_id) FROM STDIN", stream)
+                cursor.execute(f"ANALYZE {STAGING_TABLE}")
+                cursor.execute(MERGE_SQL.format(table=table, staging=STAGING_TABLE), params)
+                inserted, updated = cursor.fetchone()
+                deleted = 0
+                if replace:
+                    cursor.execute(DELETE_SQL.format(table=table, staging=STAGING_TABLE), params)
+                    deleted = cursor.rowcount
+                if inserted or updated or deleted:
+                    # full load, not refresh: rows get the transaction start time as
+                    # "updated", other writes committed while the import runs move
+                    # index cursors past it. Deleted IDs disappear on full load only too
+                    cursor.execute("SELECT pg_notify(%s, %s)", [SPAMMERS_CHANNEL, "reload"])
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Read {stream.rows} rows ({stream.invalid} invalid) in {elapsed:.2f}s, "
+            f"{stream.rows / max(elapsed, 1e-9):.0f} rows/s. "
+            f"Inserted {inserted}, updated {updated}, deleted {deleted}"
+        )
@@ -3,9 +3,10 @@ import logging
 import re
 import typing
 
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from datetime import timedelta
 from functools import wraps
+from types import MappingProxyType
 
 from guard_bot.bot.messages import (
     WRONG_COMMAND,
@@ -16,12 +17,14 @@ from guard_bot.bot.messages import (
     RESULT_MESSAGE,
     RESULT_ERROR_MESSAGE,
     REASON,
+    FLOOD_REASON,
     RESULT_KICK_MESSAGE,
     ERROR_KICK_MESSAGE,
     USER_WARNED,
     USER_MUTED,
     USER_NOT_MUTED,
     USER_WARN_DELETED,
+    USER_NOT_FOUND,
     SLOW_MODE_ON,
     SLOW_MODE_OFF,
     PERM_ON_RESULT_MESSAGE,
@@ -29,7 +32,7 @@ from guard_bot.bot.messages import (
 )
 
 if typing.TYPE_CHECKING:
-    from typing import Union, List, Tuple
+    from typing import Union, List, Tuple, Dict, Optional
     from telethon import hints
 
 
@@ -42,9 +45,13 @@ from telethon.errors import (
     ChatAdminRequiredError,
     UserIdInvalidError,
     SecondsInvalidError,
+    FloodWaitError,
+    UsernameInvalidError,
+    UsernameNotOccupiedError,
+    ChatNotModifiedError,
 )
 from telethon import types
-from telethon.tl.functions.channels import ToggleSlowModeRequest
+from telethon.tl.functions.channels import GetFullChannelRequest, ToggleSlowModeRequest
 from telethon.tl.types import (
     ChannelParticipantsAdmins,
     PeerUser,
@@ -52,30 +59,84 @@ from telethon.tl.types import (
     ChannelParticipantCreator,
 )
 
-from guard_bot.bot.models import ChatAdmins, UserWarn, WarnType
+from guard_bot.bot.grammar import (
+    TG_USER,
+    DOG_USER,
+    SHARP_USER,
+    COMMAND,
+    HOURS,
+    MINUTES,
+    DAYS,
+    USER_PERMS,
+    USERS_LIST,
+    PERIOD,
+    USERS_AND_PERMS,
+    USERS,
+    USERS_AND_PERIOD,
+    PERIOD_ONLY,
+    GrammarError,
+    compile_grammar,
+)
+from guard_bot.bot.audit import AuditWriter
+from guard_bot.bot.cache import (
+    AdminCache,
+    ChatSettingsCache,
+    MessageHashCache,
+    UsernameCache,
+)
+from guard_bot.bot.classifier import BatchScorer
+from guard_bot.bot.locks import KeyedLock, LockException
+from guard_bot.bot.models import (
+    BLOCKED_DOMAINS_CHANNEL,
+    CHAT_SETTINGS_CHANNEL,
+    CLASSIFIER_CHANNEL,
+    SPAMMERS_CHANNEL,
+    AdminRights,
+    ChatAdmins,
+    ChatSettings,
+    UserWarn,
+    WarnType,
+)
+from guard_bot.bot.dispatcher import ChatDispatcher
+from guard_bot.bot.domains import DomainBlocklist
+from guard_bot.bot.duplicates import NearDuplicateIndex
+from guard_bot.bot.executor import CpuExecutor, LoopLagMonitor
+from guard_bot.bot.flood import FloodDetector
+from guard_bot.bot.keywords import BlocklistCache
+from guard_bot.bot.notify import PgListener
+from guard_bot.bot.spam import (
+    AdminStage,
+    BlocklistStage,
+    ClassifierStage,
+    DomainStage,
+    DuplicatesStage,
+    SpamContext,
+    SpamPipeline,
+    SpamResult,
+    SpammersStage,
+    Verdict,
+    content_hash,
+)
+from guard_bot.bot.spammers import SpammerIndex
+from guard_bot.bot.scheduler import TokenBucket, RefreshScheduler
 
 logger = logging.getLogger("asyncio")
 
-TG_USER = re.compile(r"\[[^\]]*\]\(tg\:\/+\w+\?id=(\d+)\)", re.I)
-DOG_USER = re.compile(r"(@\w+)", re.I)
-SHARP_USER = re.compile(r"#(\d+)", re.I)
-COMMAND = re.compile(r"!(\w+)", re.I)
-HOURS = re.compile(r"(\d+)(hr|h)+", re.I)
-MINUTES = re.compile(r"(\d+)(min|m)+", re.I)
-DAYS = re.compile(r"(\d+)(days|d)+", re.I)
-USER_PERMS = [re.compile(
-    r"(message|media|sticker|gif|game|inline|link|poll|invite)+",
-    re.I
-)]
-
-USERS_LIST = [TG_USER, DOG_USER, SHARP_USER]
-PERIOD = [("hours", HOURS), ("minutes", MINUTES), ("days", DAYS)]
-USERS_AND_PERMS = OrderedDict({'command': COMMAND, 'users': USERS_LIST, 'perms': USER_PERMS})
-USERS = OrderedDict({"command": COMMAND, "users": USERS_LIST})
-USERS_AND_PERIOD = OrderedDict(
-    {"command": COMMAND, "users": USERS_LIST, "period": PERIOD}
+# event filters, applied by telethon before any handler is scheduled
+COMMAND_PREFIX = re.compile(r"!(\w*)")
+NOT_COMMAND = re.compile(r"(?!!)")
+UNKNOWN_COMMAND = "?"
+
+MODERATION_ERRORS = (
+    UserAdminInvalidError,
+    ChatAdminRequiredError,
+    UserIdInvalidError,
+    FloodWaitError,
 )
 
+# command target can't be resolved to ID, unknown or invalid @username
+RESOLVE_ERRORS = (ValueError, UsernameInvalidError, UsernameNotOccupiedError)
+
 SLOW_MODE_VALUES = [0, 10, 30, 60, 60 * 5, 60 * 15, 60 * 60]
 
 USER_PERMS_MAPPING = {
@@ -94,18 +155,25 @@ USER_PERMS_MAPPING = {
 def attr_setter(attrs: OrderedDict = None):
     """
     Decorator for bot command method.
-    Extracts attrs from event by "attr_getter" function,
+    Compiles attrs to grammar once, extracts attrs from event with it,
     add attr "chat_id" and call bot method with attrs
     :param attrs: OrderedDict
     :return: object
     """
     """attrib_setter(params={'attr_name1': [TG_USER, DOG_USER, SHARP_USER]})"""
 
+    grammar = compile_grammar(attrs)
+
     def decorator(method):
         @wraps(method)
         async def _impl(self, event, *args, **kwargs):
-            params = attr_getter(event.message.text, attrs)
-            kwargs.update(params)
+            try:
+                params = grammar.parse(event.message.text)
+            except GrammarError as e:
+                logger.warning(f"Rejected command in chat {event.message.chat.id}. {e}")
+                await event.message.reply(WRONG_COMMAND)
+                return
+            kwargs.update(params.as_dict())
             kwargs.update({"chat_id": event.message.chat.id})
             return await method(self, event, *args, **kwargs)
 
@@ -117,35 +185,19 @@ def attr_setter(attrs: OrderedDict = None):
 def admin_check(can_do: str):
     """
     Decorator for check user rights, set "is_chat_command" flag to decorated method.
+    Rights are taken from admin cache, see Command.get_admin_rights
 
     :param can_do: str, 'can_add_admin|can_ban|can_delete', see guard_bot.bot.models.ChatAdmins
     :return: object
     """
 
+    right = AdminRights.from_name(can_do)
+
     def decorator(method):
         @wraps(method)
         async def _impl(self, event, *args, **kwargs):
-            admin = None
-            if not await ChatAdmins.objects.filter(
-                chat_id=event.message.chat.id
-            ).aexists():
-                # maybe new, not cached chat
-                async for u in self.client.iter_participants(
-                    event.message.chat.id, filter=ChannelParticipantsAdmins
-                ):
-                    if u.id == event.message.sender.id and (
-                        isinstance(u.participant, ChannelParticipantAdmin)
-                        and u.participant.admin_rights.add_admins
-                        or isinstance(u.participant, ChannelParticipantCreator)
-                    ):
-                        admin = u
-                        setattr(admin, "can_add_admin", True)
-                        break
-            else:
-                admin = await ChatAdmins.objects.filter(
-                    chat_id=event.message.chat.id, user_id=event.message.sender.id
-                ).afirst()
-            if admin and getattr(admin, can_do, False):
+            rights = await self.get_admin_rights(event.message.chat.id)
+            if rights.get(event.message.sender.id, 0) & right:
                 return await method(self, event, *args, **kwargs)
             return
 
@@ -158,82 +210,41 @@ def admin_check(can_do: str):
 def attr_getter(s: str, c: OrderedDict) -> dict:
     """
     Get attributes from given string by rules from ordered dict
-    Uses by "attr_setter" decorator for bot command to throw attrs in method
+    Rules are compiled to grammar on first call, see guard_bot.bot.grammar
     :param s: str, example !ban @user #1234 some reason
     :param c: OrderedDict, example OrderedDict({'command': COMMAND, 'users': USERS_LIST})
     :return: dict, example {'command': 'ban', 'users':['@user', '#1234'], 'comment': 'some reason'}
     """
-    result = {}
-    for k, value in c.items():
-        if not isinstance(value, list):
-            match = value.match(s)
-            if match:
-                result.update({k: match.groups()[0]})
-                s = s[match.span()[1] :]
-        else:
-            while True:
-                match = None
-                for el in value:
-                    attr_name = None
-                    if isinstance(el, tuple):
-                        attr_name = el[0]
-                        match = el[1].match(s)
-                    else:
-                        match = el.match(s)
-                    if match:
-                        if (attr_name or k) in result:
-                            if not isinstance(result[attr_name or k], list):
-                                result[attr_name or k] = [result[attr_name or k]]
-                            result[attr_name or k].append(match.groups()[0])
-                        else:
-                            result[attr_name or k] = match.groups()[0]
-                        s = s[match.span()[1] :]
-                        break
-                if not match:
-                    break
-                s = s.lstrip()
-        s = s.lstrip()
-    if s:
-        result.update({"comment": s})
-    return result
-
-
-class LockException(Exception):
-    pass
-
-
-class Lock:
-    def __init__(
-        self,
-        memset: set = None,
-        obj_id: int = None,
-        timeout: float = 1.0,
-        check: float = 0.1,
-    ):
-        self.memset = memset
-        self.obj_id = obj_id
-        self.timeout = timeout or 0.0
-        self.check = check
-
-    async def _acquire_lock(self) -> bool:
-        current_timeout = 0.0
-        while current_timeout < self.timeout:
-            if self.obj_id in self.memset:
-                current_timeout += self.check
-                await asyncio.sleep(self.check)
-            else:
-                self.memset.add(self.obj_id)
-                return True
-        return False
+    return compile_grammar(c).parse(s).as_dict()
+
 
-    async def __aenter__(self):
-        locked = await self._acquire_lock()
-        if locked:
-            return self
-        raise LockException("Already locked by another coroutine")
+class CommandRegistry:
+    """
+    Frozen dispatch table of chat commands with per command counters.
+    Built once from methods marked by "admin_check" decorator
+    """
+
+    def __init__(self, obj):
+        cls = type(obj)
+        self.handlers = MappingProxyType({
+            name: getattr(obj, name)
+            for name in dir(cls)
+            if getattr(getattr(cls, name, None), "is_chat_command", False)
+        })
+        self.counters = Counter()
+
+    def get(self, command: str):
+        """
+        Get bound handler for command and count the call
+        :param command: str, command name without "!"
+        :return: handler or None
+        """
+        handler = self.handlers.get(command)
+        self.counters[command if handler else UNKNOWN_COMMAND] += 1
+        return handler
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        self.memset.remove(self.obj_id)
+    def stats(self) -> dict:
+        return dict(self.counters)
 
 
 def get_command(message_text: str) -> str:
@@ -256,6 +267,21 @@ def get_user_name(user: "Union[PeerUser, str]") -> str:
     return f"[{user}](tg://user?id={user})" if user.isdigit() else user
 
 
+def get_participant_rights(participant) -> AdminRights:
+    """
+    Get packed admin rights of chat participant
+    :param participant: ChannelParticipantAdmin or ChannelParticipantCreator
+    :return: AdminRights
+    """
+    if isinstance(participant, ChannelParticipantAdmin):
+        return AdminRights.pack(
+            can_delete=participant.admin_rights.delete_messages,
+            can_ban=participant.admin_rights.ban_users,
+            can_add_admin=participant.admin_rights.add_admins,
+        )
+    return AdminRights.CAN_DELETE | AdminRights.CAN_BAN | AdminRights.CAN_ADD_ADMIN
+
+
 def get_id_from_entity(entity: "hints.EntityLike") -> int:
     """
     Get entity ID from any type
@@ -283,11 +309,35 @@ class Command(BaseCommand):
         :param options: ignored
         :return:
         """
+        if self.executor is not None:
+            self.executor.start()
         self.loop.create_task(self.get_me(), name="get_me")
         self.loop.create_task(self.refresh_admins_task(), name="refresh_admins")
+        self.loop.create_task(self.usernames_task(), name="usernames")
+        self.loop.create_task(self.listener.listen(), name="listener")
+        self.loop.create_task(self.spammers_task(), name="spammers")
+        self.loop.create_task(self.loop_lag.run(), name="loop_lag")
+        self.loop.create_task(self.stats_task(), name="stats")
         self.set_events()
 
-        self.client.run_until_disconnected()
+        try:
+            self.client.run_until_disconnected()
+        finally:
+            self.loop.run_until_complete(self.shutdown())
+
+    async def shutdown(self):
+        """
+        Write everything what is kept in memory
+        :return:
+        """
+        await self.dispatcher.close()
+        for chat_id, task in list(self.slow_mode_restores.items()):
+            logger.warning(f"Chat {chat_id} is left in slow mode")
+            task.cancel()
+        await self.audit.close()
+        await self.usernames.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
 
     async def refresh_admins_for_chat(self, chat_id: int, db_admins: set[int]):
         """
@@ -298,49 +348,16 @@ class Command(BaseCommand):
         :return:
         """
         try:
-            async with Lock(self.groups_memset, chat_id):
-                tg_admin_ids = set()
+            async with self.locks.acquire(("refresh_admins", chat_id), timeout=1.0):
+                tg_admins = {}
                 async for tg_admin in self.client.iter_participants(
                     chat_id, filter=ChannelParticipantsAdmins
                 ):
-                    tg_admin_ids.add(tg_admin.id)
-                    if tg_admin.id not in db_admins:
-                        await ChatAdmins.objects.acreate(
-                            chat_id=chat_id,
-                            user_id=tg_admin.id,
-                            can_delete=tg_admin.participant.admin_rights.delete_messages,
-                            can_ban=tg_admin.participant.admin_rights.ban_users,
-                            can_add_admin=tg_admin.participant.admin_rights.add_admins,
-                        ) if isinstance(
-                            tg_admin.participant, ChannelParticipantAdmin
-                        ) else await ChatAdmins.objects.acreate(
-                            chat_id=chat_id,
-                            user_id=tg_admin.id,
-                            can_delete=True,
-                            can_ban=True,
-                            can_add_admin=True,
-                        )
-                    else:
-                        await ChatAdmins.objects.filter(
-                            chat_id=chat_id, user_id=tg_admin.id
-                        ).aupdate(
-                            can_delete=tg_admin.participant.admin_rights.delete_messages,
-                            can_ban=tg_admin.participant.admin_rights.ban_users,
-                            can_add_admin=tg_admin.participant.admin_rights.add_admins,
-                        ) if isinstance(
-                            tg_admin.participant, ChannelParticipantAdmin
-                        ) else await ChatAdmins.objects.acreate(
-                            chat_id=chat_id,
-                            user_id=tg_admin.id,
-                            can_delete=True,
-                            can_ban=True,
-                            can_add_admin=True,
-                        )
-                delete_ids = db_admins.difference(tg_admin_ids)
-                if delete_ids:
-                    await ChatAdmins.objects.filter(
-                        chat_id=chat_id, user_id__in=delete_ids
-                    ).adelete()
+                    tg_admins[tg_admin.id] = get_participant_rights(tg_admin.participant)
+                rights = await ChatAdmins.aset_chat_admins(
+                    chat_id, tg_admins, db_admins.difference(tg_admins)
+                )
+                self.admin_cache.set(chat_id, rights)
         except LockException as e:
             logger.warning(f"Reloading admins for chat {chat_id}. {e}")
 
@@ -350,10 +367,9 @@ class Command(BaseCommand):
         :return: None
         """
         chat_admins = await ChatAdmins.get_admins_by_chat()
-        for chat_id, db_admins in chat_admins.items():
-            logger.info(f"Reloading admins for chat {chat_id}")
-            await self.refresh_admins_for_chat(chat_id, db_admins)
-            await asyncio.sleep(settings.BETWEEN_GROUPS_REFRESH_COOLDOWN)
+        logger.info(f"Reloading admins for {len(chat_admins)} chats")
+        await self.refresh_scheduler.run_cycle(self.refresh_admins_for_chat, chat_admins)
+        logger.info(f"Admins reloaded: {self.refresh_scheduler.stats()}")
         await asyncio.sleep(settings.ADMIN_GROUPS_REFRESH_PERIOD * 60)
 
     async def refresh_admins_task(self):
@@ -364,6 +380,79 @@ class Command(BaseCommand):
         while True:
             await self._refresh_admins_task()
 
+    async def usernames_task(self):
+        """
+        Periodic Task for persisting learned usernames
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(settings.USERNAME_FLUSH_PERIOD)
+            try:
+                await self.usernames.flush()
+            except Exception:
+                logger.exception("Usernames flush failed")
+
+    async def spammers_task(self):
+        """
+        Periodic Task for spammers index refresh, full reload drops deleted IDs
+        :return: None
+        """
+        cycle = 0
+        while True:
+            try:
+                if cycle % settings.SPAMMERS_FULL_RELOAD_EVERY == 0:
+                    await self.spammers.load()
+                else:
+                    await self.spammers.refresh()
+                logger.info(f"Spammers index: {self.spammers.stats()}")
+            except Exception:
+                logger.exception("Spammers refresh failed")
+            cycle += 1
+            await asyncio.sleep(settings.SPAMMERS_REFRESH_PERIOD)
+
+    async def stats_task(self):
+        """
+        Periodic Task for logging stats of in-memory components
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(settings.STATS_PERIOD)
+            logger.info(f"Event loop lag: {self.loop_lag.stats()}")
+            logger.info(f"Dispatcher: {self.dispatcher.stats()}")
+            logger.info(f"Spam pipeline: {self.spam_pipeline.stats()}")
+            logger.info(f"Message hashes: {self.message_hashes.stats()}")
+            if self.executor is not None:
+                logger.info(f"Process pool: {self.executor.stats()}")
+
+    def reload_domains(self, payload: str = ""):
+        """
+        Domain blocklist was changed or notifications could be lost on reconnect
+        :param payload: str, ignored, whole blocklist is reloaded
+        :return: None
+        """
+        self.loop.create_task(self.domains.reload(), name="domains_reload")
+
+    def reload_classifier(self, payload: str = ""):
+        """
+        New model was trained, file is memory mapped again
+        :param payload: str, ignored, model path is taken from settings,
+            train_classifier notifies only for that path
+        :return: None
+        """
+        if self.classifier.load():
+            logger.info(f"Classifier model loaded from {self.classifier.path}")
+
+    def on_spammers_notify(self, payload: str):
+        """
+        Spammers table was changed by import, "reload" payload means that rows were deleted
+        :param payload: str
+        :return: None
+        """
+        if payload == "reload":
+            self.loop.create_task(self.spammers.load(), name="spammers_load")
+        else:
+            self.loop.create_task(self.spammers.refresh(), name="spammers_refresh")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.me = None
@@ -371,7 +460,114 @@ class Command(BaseCommand):
             settings.BOT_DB, settings.API_ID, settings.API_HASH
         ).start(bot_token=settings.BOT_TOKEN)
         self.loop = self.client.loop
-        self.groups_memset = set()
+        self.locks = KeyedLock()
+        self.requests_bucket = TokenBucket(
+            settings.REQUESTS_RATE, settings.REQUESTS_BURST
+        )
+        self.refresh_scheduler = RefreshScheduler(
+            self.requests_bucket,
+            concurrency=settings.ADMIN_REFRESH_CONCURRENCY,
+            cooldown=settings.BETWEEN_GROUPS_REFRESH_COOLDOWN,
+        )
+        self.admin_cache = AdminCache(settings.ADMIN_CACHE_TTL)
+        self.audit = AuditWriter(
+            settings.AUDIT_QUEUE_SIZE,
+            settings.AUDIT_BATCH_SIZE,
+            settings.AUDIT_FLUSH_INTERVAL,
+        )
+        self.usernames = UsernameCache(
+            settings.USERNAME_CACHE_SIZE, settings.USERNAME_CACHE_TTL
+        )
+        self.chat_settings = ChatSettingsCache(
+            settings.CHAT_SETTINGS_CACHE_TTL, settings.CHAT_SETTINGS_NEGATIVE_TTL
+        )
+        self.spammers = SpammerIndex(settings.SPAMMERS_BLOOM_ERROR_RATE or None)
+        self.listener = PgListener()
+        self.listener.subscribe(
+            CHAT_SETTINGS_CHANNEL,
+            self.chat_settings.on_notify,
+            on_reconnect=self.chat_settings.invalidate,
+        )
+        self.listener.subscribe(SPAMMERS_CHANNEL, self.on_spammers_notify)
+        self.domains = DomainBlocklist()
+        self.listener.subscribe(
+            BLOCKED_DOMAINS_CHANNEL, self.reload_domains, on_reconnect=self.reload_domains
+        )
+        self.duplicates = NearDuplicateIndex(
+            window=settings.DUPLICATES_WINDOW,
+            min_chats=settings.DUPLICATES_MIN_CHATS,
+            min_length=settings.DUPLICATES_MIN_LENGTH,
+            capacity=settings.DUPLICATES_CAPACITY,
+            similarity=settings.DUPLICATES_SIMILARITY,
+        )
+        self.flood = FloodDetector(settings.FLOOD_IDLE)
+        # chat id: task turning slow mode of chat flood off
+        self.slow_mode_restores: "Dict[int, asyncio.Task]" = {}
+        self.blocklists = BlocklistCache(settings.BLOCKLIST_CACHE_SIZE)
+        self.executor = None
+        if settings.CPU_POOL_WORKERS >= 0:
+            self.executor = CpuExecutor(
+                settings.CPU_POOL_WORKERS, settings.CPU_POOL_PENDING_PER_WORKER
+            )
+        self.loop_lag = LoopLagMonitor(settings.LOOP_LAG_INTERVAL)
+        self.message_hashes = MessageHashCache(
+            settings.EDIT_CACHE_CHATS, settings.EDIT_CACHE_MESSAGES
+        )
+        self.classifier = BatchScorer(
+            settings.CLASSIFIER_MODEL_PATH,
+            settings.CLASSIFIER_BATCH_DELAY,
+            settings.CLASSIFIER_BATCH_SIZE,
+        )
+        self.classifier.load()
+        self.listener.subscribe(
+            CLASSIFIER_CHANNEL, self.reload_classifier, on_reconnect=self.reload_classifier
+        )
+        self.spam_pipeline = SpamPipeline(
+            [
+                AdminStage(self.admin_cache),
+                SpammersStage(self.spammers),
+                DomainStage(self.domains),
+                BlocklistStage(self.blocklists),
+                DuplicatesStage(
+                    self.duplicates, offload_length=settings.DUPLICATES_OFFLOAD_LENGTH
+                ),
+                ClassifierStage(self.classifier),
+            ],
+            budget=settings.SPAM_STAGE_BUDGET,
+            executor=self.executor,
+        )
+        self.dispatcher = ChatDispatcher(
+            settings.EVENT_WORKERS,
+            settings.EVENT_QUEUE_SIZE,
+            settings.EVENT_CHAT_QUEUE_SIZE,
+            settings.EVENT_OVERFLOW,
+            settings.EVENT_MAX_WAITING,
+        )
+        self.commands = CommandRegistry(self)
+
+    async def get_admin_rights(self, chat_id: int) -> "Dict[int, int]":
+        """
+        Get chat admins rights from cache, load them on cache miss
+
+        :param chat_id: int
+        :return: dict {user_id: packed AdminRights}
+        """
+        rights = self.admin_cache.get(chat_id)
+        if rights is None:
+            rights = await ChatAdmins.get_rights_by_chat(chat_id)
+            if not rights:
+                # maybe new, not cached chat, only admin who can add admins may refresh it
+                async for u in self.client.iter_participants(
+                    chat_id, filter=ChannelParticipantsAdmins
+                ):
+                    if (
+                        isinstance(u.participant, ChannelParticipantAdmin)
+                        and u.participant.admin_rights.add_admins
+                        or isinstance(u.participant, ChannelParticipantCreator)
+                    ):
+                        rights[u.id] = int(AdminRights.CAN_ADD_ADMIN)
+            self.admin_cache.set(chat_id, rights)
+        return rights
 
     async def get_me(self):
         """
@@ -383,60 +579,260 @@ class Command(BaseCommand):
 
     def set_events(self):
         """
-        set events
+        set events, commands and other messages are split by event filters
         :return:
         """
         self.client.add_event_handler(
-            self.on_new_message, events.NewMessage(incoming=True)
+            self.run_command, events.NewMessage(incoming=True, pattern=COMMAND_PREFIX)
         )
         self.client.add_event_handler(
-            self.on_edit_message, events.MessageEdited(incoming=True)
+            self.queue_new_message, events.NewMessage(incoming=True, pattern=NOT_COMMAND)
         )
+        self.client.add_event_handler(
+            self.queue_edit_message, events.MessageEdited(incoming=True)
+        )
+        self.client.add_event_handler(self.on_chat_action, events.ChatAction())
 
     async def run_command(self, event: events.NewMessage):
         """
         Run bot command
-        :param event:
+        :param event: event matched by COMMAND_PREFIX filter
         :return:
         """
-        command = get_command(event.message.text)
-        method = getattr(self, command, None)
-        if method and getattr(method, "is_chat_command", False):
+        self.usernames.learn(event.message.sender)
+        method = self.commands.get(event.pattern_match.group(1))
+        if method:
             await method(event)
         else:
             await event.message.reply(WRONG_COMMAND)
 
-    async def spam_check(self, event: "Union[events.NewMessage, events.MessageEdited]"):
+    async def spam_check(
+        self,
+        event: "Union[events.NewMessage, events.MessageEdited]",
+        is_edit: bool = False,
+    ) -> "Optional[SpamResult]":
+        """
+        Run spam pipeline for message and apply its verdict, private chats are not checked
+        :param event: events.NewMessage or events.MessageEdited
+        :param is_edit: bool
+        :return: SpamResult or None
         """
-        spam check for message
-        :param event: events.MessageEdited
+        if event.is_private:
+            return None
+        context = SpamContext.from_event(event, is_edit)
+        if context is None:
+            return None
+        chat_settings = await self.chat_settings.get(context.chat_id)
+        if not chat_settings.spam_check:
+            return None
+        digest = content_hash(event.message)
+        if not is_edit:
+            self.message_hashes.remember(context.chat_id, context.message_id, digest)
+        elif not self.message_hashes.changed(context.chat_id, context.message_id, digest):
+            return None
+        result = await self.spam_pipeline.run(context, chat_settings)
+        if result and result.verdict > Verdict.CLEAN:
+            await self.apply_verdict(context, result)
+        return result
+
+    async def apply_verdict(self, context: SpamContext, result: SpamResult):
+        """
+        Delete spam message, warn or ban sender, every verdict is recorded as SPAM
+        :param context: SpamContext
+        :param result: SpamResult with DELETE, WARN or BAN verdict
         :return:
         """
-        # TODO: think about it
-        pass
+        chat_id, user_id = context.chat_id, context.user_id
+        logger.info(
+            f"Spam in chat {chat_id} from {user_id}: {result.verdict.name} by {result.comment}"
+        )
+        try:
+            await self.tg_request(
+                self.client.delete_messages, chat_id, message_ids=context.message_id
+            )
+            await self.audit.write(
+                chat_id=chat_id,
+                user_id=user_id,
+                warn_type=WarnType.SPAM,
+                comment=result.comment,
+                text=context.text,
+            )
+            if result.verdict == Verdict.WARN:
+                _, time_period = await UserWarn.awarn(
+                    chat_id=chat_id, user_id=user_id, comment=result.comment
+                )
+                if time_period:
+                    await self.tg_request(
+                        self.client.edit_permissions,
+                        chat_id,
+                        user_id,
+                        until_date=time_period,
+                        send_messages=False,
+                    )
+                    await self.audit.write(
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        warn_type=WarnType.MUTE,
+                        comment=result.comment,
+                    )
+            elif result.verdict == Verdict.BAN:
+                await self.tg_request(
+                    self.client.edit_permissions, chat_id, user_id, view_messages=False
+                )
+                await self.audit.write(
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    warn_type=WarnType.BAN,
+                    comment=result.comment,
+                )
+        except MODERATION_ERRORS as e:
+            logger.warning(f"Spam verdict in chat {chat_id} not applied. {e}")
+
+    async def queue_new_message(self, event: events.NewMessage):
+        """New message goes to dispatcher, checked after previous events of its chat"""
+        await self.dispatcher.put(event.chat_id, self.on_new_message, event)
+
+    async def queue_edit_message(self, event: events.MessageEdited):
+        """Edit goes to dispatcher, so it is never checked before the message itself"""
+        await self.dispatcher.put(event.chat_id, self.on_edit_message, event)
 
     async def on_new_message(self, event: events.NewMessage):
-        """Run command or spam check"""
-        if event.message.text and event.message.text.startswith("!"):
-            await self.run_command(event)
-        else:
-            await self.spam_check(event)
+        """Flood and spam check, commands never get here"""
+        self.usernames.learn(event.message.sender)
+        if await self.flood_check(event):
+            return
+        await self.spam_check(event)
+
+    async def flood_check(self, event: events.NewMessage) -> bool:
+        """
+        Mute user flooding the chat, turn slow mode on when the whole chat floods.
+        Admins and private chats are not counted
+        :param event: events.NewMessage
+        :return: bool, True if user was muted
+        """
+        message = event.message
+        if event.is_private or message.sender is None:
+            return False
+        # bare id, admins, settings and warnings are keyed by it, event.chat_id is marked
+        chat_id, user_id = message.chat.id, message.sender.id
+        rights = self.admin_cache.peek(chat_id)
+        if rights and user_id in rights:
+            return False
+        chat_settings = await self.chat_settings.get(chat_id)
+        user_flood, chat_flood = self.flood.hit(chat_id, user_id, chat_settings)
+        if chat_flood:
+            await self.flood_slow_mode(chat_id, chat_settings)
+        if user_flood:
+            logger.info(f"User {user_id} floods in chat {chat_id}")
+            period = chat_settings.flood_mute_period
+            result_message = await self._mute_or_ban(
+                event,
+                chat_id=chat_id,
+                users=[str(user_id)],
+                days=period.days,
+                minutes=period.seconds // 60,
+                comment=FLOOD_REASON,
+                use_reply=False,
+            )
+            if result_message:
+                await self.tg_request(self.client.send_message, chat_id, message=result_message)
+        return user_flood
+
+    async def flood_slow_mode(self, chat_id: int, chat_settings: ChatSettings):
+        """
+        Turn slow mode on for chat flood and off after "flood_slow_mode_period".
+        Slow mode which is already on, e.g. set by admins, is not touched
+        :param chat_id: int
+        :param chat_settings: ChatSettings
+        :return:
+        """
+        if chat_id in self.slow_mode_restores:
+            return
+        try:
+            full = await self.tg_request(self.client, GetFullChannelRequest(chat_id))
+            if full.full_chat.slowmode_seconds:
+                return
+            logger.info(f"Chat {chat_id} flood, slow mode on")
+            await self._freeze(
+                chat_id=chat_id, seconds=chat_settings.flood_slow_mode.total_seconds()
+            )
+        except ChatNotModifiedError:
+            return
+        except (SecondsInvalidError,) + MODERATION_ERRORS:
+            logger.exception(f"Slow mode in chat {chat_id} failed")
+            return
+        self.slow_mode_restores[chat_id] = self.loop.create_task(
+            self.flood_slow_mode_off(chat_id, chat_settings.flood_slow_mode_period.total_seconds()),
+            name=f"slow_mode_off_{chat_id}",
+        )
+        try:
+            await self.tg_request(self.client.send_message, chat_id, message=SLOW_MODE_ON)
+        except MODERATION_ERRORS as e:
+            logger.warning(f"Slow mode notice in chat {chat_id} not sent. {e}")
+
+    async def flood_slow_mode_off(self, chat_id: int, delay: float):
+        """
+        Turn slow mode set by "flood_slow_mode" off
+        :param chat_id: int
+        :param delay: float, seconds
+        :return:
+        """
+        try:
+            await asyncio.sleep(delay)
+            logger.info(f"Chat {chat_id} slow mode off")
+            await self._freeze(chat_id=chat_id)
+            await self.tg_request(self.client.send_message, chat_id, message=SLOW_MODE_OFF)
+        except ChatNotModifiedError:
+            pass
+        except MODERATION_ERRORS:
+            logger.exception(f"Slow mode off in chat {chat_id} failed")
+        finally:
+            self.slow_mode_restores.pop(chat_id, None)
 
     async def on_edit_message(self, event: events.MessageEdited):
-        """Spam check"""
-        await self.spam_check(event)
+        """Spam check, edits which did not change content are skipped"""
+        await self.spam_check(event, is_edit=True)
+
+    async def on_chat_action(self, event: events.ChatAction):
+        """
+        Ban known spammers right after join, join message is deleted too.
+        Only groups are checked, channels and private chats have no joins to moderate
+        """
+        if not (event.user_joined or event.user_added) or not event.is_group:
+            return
+        # bare id like message.chat.id, event.chat_id is marked
+        chat_id = (await event.get_chat()).id
+        chat_settings = await self.chat_settings.get(chat_id)
+        if not chat_settings.spam_check:
+            return
+        for user_id in event.user_ids:
+            if user_id in self.spammers:
+                context = SpamContext(
+                    event=event,
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    message_id=event.action_message.id,
+                    text="",
+                )
+                await self.apply_verdict(
+                    context, SpamResult(Verdict.BAN, SpammersStage.name, "known spammer")
+                )
 
     async def _get_users(
-        self, event: events.NewMessage, users: "Union[str, list[str]]"
+        self,
+        event: events.NewMessage,
+        users: "Union[str, list[str]]",
+        use_reply: bool = True,
     ) -> "List[Union[str, int]]":
         """
         Get usernames
         :param event: events.NewMessage
         :param users: string or list of strings
+        :param use_reply: bool, take user from replied message
         :return: if message is reply, then return list as [user_id], where user_id is integer, else
         return list of users as [str, ...]
         """
-        if event.message.is_reply:
+        if use_reply and event.message.is_reply:
             message: Union[
                 hints.MessageLike, hints.TotalList
             ] = await self.client.get_messages(
@@ -450,14 +846,21 @@ class Command(BaseCommand):
 
     async def get_user_id(self, user: "Union[hints.EntityLike, str]") -> int:
         """
-        Get user ID
+        Get user ID, usernames are resolved through cache first
         :param user: str or EntityLike
         :return: int
         """
         if isinstance(user, str) and user.isdigit():
             return int(user)
+        if isinstance(user, str):
+            user_id = await self.usernames.get(user)
+            if user_id is not None:
+                return user_id
         user_entity = await self.client.get_input_entity(user)
-        return get_id_from_entity(user_entity)
+        user_id = get_id_from_entity(user_entity)
+        if isinstance(user, str):
+            self.usernames.set(user, user_id)
+        return user_id
 
     async def get_user_name_and_id(
         self, user: "Union[hints.EntityLike, str]"
@@ -471,6 +874,56 @@ class Command(BaseCommand):
         user_name = get_user_name(user)
         return user_name, user_id
 
+    async def resolve_user(
+        self, user: "Union[hints.EntityLike, str]"
+    ) -> "Tuple[str, Optional[int]]":
+        """
+        Username and ID of command target, resolve errors are logged
+        :param user: str or EntityLike
+        :return: tuple(str, int), ID is None if user can't be resolved
+        """
+        try:
+            return await self.get_user_name_and_id(user)
+        except FloodWaitError as e:
+            self.requests_bucket.pause(e.seconds)
+            logger.warning(f"User {user} not resolved. {e}")
+        except RESOLVE_ERRORS as e:
+            logger.warning(f"User {user} not resolved. {e}")
+        return get_user_name(user), None
+
+    async def tg_request(self, request, *args, **kwargs):
+        """
+        Call telegram client method under global requests rate limit.
+        FloodWaitError pauses all requests for its time and is raised to caller
+        :param request: client coroutine function
+        :return: request result
+        """
+        await self.requests_bucket.acquire()
+        try:
+            return await request(*args, **kwargs)
+        except FloodWaitError as e:
+            self.requests_bucket.pause(e.seconds)
+            raise
+
+    async def _for_each_user(self, users: list, action) -> str:
+        """
+        Resolve users and run action for them concurrently, results are joined in users order.
+        User which can't be resolved gets USER_NOT_FOUND, others are not affected
+        :param users: list
+        :param action: coroutine function (user_name, user_id) -> str
+        :return: str
+        """
+        semaphore = asyncio.Semaphore(settings.MODERATION_CONCURRENCY)
+
+        async def run(user):
+            async with semaphore:
+                user_name, user_id = await self.resolve_user(user)
+                if user_id is None:
+                    return USER_NOT_FOUND.format(user_name)
+                return await action(user_name, user_id)
+
+        return "".join(await asyncio.gather(*[run(user) for user in users]))
+
     async def _mute_or_ban(
         self,
         event: events.NewMessage,
@@ -482,6 +935,7 @@ class Command(BaseCommand):
         hours: int = 0,
         minutes: int = 0,
         comment: str = None,
+        use_reply: bool = True,
         **kwargs,
     ):
         """Base method for mute or ban users"""
@@ -490,22 +944,25 @@ class Command(BaseCommand):
             (UNMUTED if undo else MUTED) if mute else (UNBANNED if undo else BANNED)
         )
         result_message = ""
-        users = await self._get_users(event, users)
+        users = await self._get_users(event, users, use_reply)
         if not users:
             return result_message
-        for user in users:
-            user_name, user_id = await self.get_user_name_and_id(user)
+
+        async def mute_or_ban_user(user_name, user_id):
             try:
                 kwargs = {"send_messages" if mute else "view_messages": undo}
                 delta = timedelta(
                     days=int(days), hours=int(hours), minutes=int(minutes)
                 )
-                await self.client.edit_permissions(
-                    chat_id, user_id, until_date=delta, **kwargs
+                await self.tg_request(
+                    self.client.edit_permissions,
+                    chat_id,
+                    user_id,
+                    until_date=delta,
+                    **kwargs,
                 )
                 delta_str = f" on {delta}" if delta else ""
-                result_message += RESULT_MESSAGE.format(user_name, action, delta_str)
-                await UserWarn.set_warn(
+                await self.audit.write(
                     chat_id=chat_id,
                     user_id=user_id,
                     warn_type=(WarnType.UNMUTE if undo else WarnType.MUTE)
@@ -513,8 +970,11 @@ class Command(BaseCommand):
                     else (WarnType.UNBAN if undo else WarnType.BAN),
                     comment=comment,
                 )
-            except (UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError):
-                result_message += RESULT_ERROR_MESSAGE.format(user_name, action)
+                return RESULT_MESSAGE.format(user_name, action, delta_str)
+            except MODERATION_ERRORS:
+                return RESULT_ERROR_MESSAGE.format(user_name, action)
+
+        result_message += await self._for_each_user(users, mute_or_ban_user)
         if comment:
             result_message += REASON.format(comment)
         await event.message.delete()
@@ -577,19 +1037,21 @@ class Command(BaseCommand):
         users = await self._get_users(event, users)
         if not users:
             return result_message
-        for user in users:
-            user_name, user_id = await self.get_user_name_and_id(user)
+
+        async def kick_user(user_name, user_id):
             try:
-                await self.client.kick_participant(chat_id, user_id)
-                result_message += RESULT_KICK_MESSAGE.format(user_name)
-                await UserWarn.set_warn(
+                await self.tg_request(self.client.kick_participant, chat_id, user_id)
+                await self.audit.write(
                     chat_id=chat_id,
                     user_id=user_id,
                     warn_type=WarnType.KICK,
                     comment=comment,
                 )
-            except (UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError):
-                result_message += ERROR_KICK_MESSAGE.format(user_name)
+                return RESULT_KICK_MESSAGE.format(user_name)
+            except MODERATION_ERRORS:
+                return ERROR_KICK_MESSAGE.format(user_name)
+
+        result_message += await self._for_each_user(users, kick_user)
         if comment:
             result_message += REASON.format(comment)
         await event.message.delete()
@@ -622,34 +1084,33 @@ class Command(BaseCommand):
         users = await self._get_users(event, users)
         if not users:
             return result_message
-        for user in users:
-            user_name, user_id = await self.get_user_name_and_id(user)
-            time_period = await UserWarn.have_to_mute(chat_id=chat_id, user_id=user_id)
-            result_message += USER_WARNED.format(user_name)
-            await UserWarn.set_warn(
-                chat_id=chat_id,
-                user_id=user_id,
-                warn_type=WarnType.WARN,
-                comment=comment,
+
+        async def warn_user(user_name, user_id):
+            _, time_period = await UserWarn.awarn(
+                chat_id=chat_id, user_id=user_id, comment=comment
             )
+            user_message = USER_WARNED.format(user_name)
             if time_period:
                 try:
-                    await self.client.edit_permissions(
-                        chat_id, user_id, until_date=time_period, send_messages=False
+                    await self.tg_request(
+                        self.client.edit_permissions,
+                        chat_id,
+                        user_id,
+                        until_date=time_period,
+                        send_messages=False,
                     )
-                    result_message += USER_MUTED.format(user_name, time_period)
-                    await UserWarn.set_warn(
+                    user_message += USER_MUTED.format(user_name, time_period)
+                    await self.audit.write(
                         chat_id=chat_id,
                         user_id=user_id,
                         warn_type=WarnType.MUTE,
                         comment=comment,
                     )
-                except (
-                    UserAdminInvalidError,
-                    ChatAdminRequiredError,
-                    UserIdInvalidError,
-                ):
-                    result_message += USER_NOT_MUTED.format(user_name, time_period)
+                except MODERATION_ERRORS:
+                    user_message += USER_NOT_MUTED.format(user_name, time_period)
+            return user_message
+
+        result_message += await self._for_each_user(users, warn_user)
         if comment:
             result_message += REASON.format(comment)
         await event.message.delete()
@@ -686,12 +1147,18 @@ class Command(BaseCommand):
         users = await self._get_users(event, users)
         if not users:
             return
-        for user in users:
-            user_name, user_id = await self.get_user_name_and_id(user)
-            warn_count = await UserWarn.delete_current_warnings(
-                chat_id=chat_id, user_id=user_id
-            )
-            result_message += USER_WARN_DELETED.format(user_name, warn_count)
+        chat_settings = await self.chat_settings.get(chat_id)
+        names = [await self.resolve_user(user) for user in users]
+        deleted = await UserWarn.adelete_warnings(
+            chat_id,
+            [user_id for _, user_id in names if user_id is not None],
+            chat_settings.warn_counter_period,
+        )
+        for user_name, user_id in names:
+            if user_id is None:
+                result_message += USER_NOT_FOUND.format(user_name)
+            else:
+                result_message += USER_WARN_DELETED.format(user_name, deleted[user_id])
         if comment:
             result_message += REASON.format(comment)
         if result_message:
@@ -708,20 +1175,22 @@ class Command(BaseCommand):
         days: int = 0,
         hours: int = 0,
         minutes: int = 0,
+        seconds: int = 0,
         **kwargs,
     ):
         """Base method for chat slowdown"""
         seconds = timedelta(
-            days=int(days), hours=int(hours), minutes=int(minutes)
+            days=int(days), hours=int(hours), minutes=int(minutes), seconds=int(seconds)
         ).seconds
-        await self.client(
+        await self.tg_request(
+            self.client,
             ToggleSlowModeRequest(
                 channel=chat_id,
                 seconds=min(SLOW_MODE_VALUES, key=lambda x: abs(x - seconds)),
-            )
+            ),
         )
 
-    @attr_setter(OrderedDict({"command": COMMAND, "period": PERIOD}))
+    @attr_setter(PERIOD_ONLY)
     @admin_check("can_delete")
     async def freeze(self, event: events.NewMessage, chat_id=None, **kwargs):
         """Slowdown chat"""
@@ -731,7 +1200,7 @@ class Command(BaseCommand):
         except SecondsInvalidError:
             pass
 
-    @attr_setter(OrderedDict({"command": COMMAND, "period": PERIOD}))
+    @attr_setter(PERIOD_ONLY)
     @admin_check("can_delete")
     async def unfreeze(self, event: events.NewMessage, chat_id=None, **kwargs):
         """unfreeze chat"""
@@ -763,20 +1232,26 @@ class Command(BaseCommand):
         users = await self._get_users(event, users)
         if not users:
             return result_message
-        for user in users:
-            user_name, user_id = await self.get_user_name_and_id(user)
+
+        async def on_off_user_perm(user_name, user_id):
             try:
                 kwargs = dict([(USER_PERMS_MAPPING[x], on) for x in perms])
-                await self.client.edit_permissions(
-                    chat_id, user_id, until_date=None, **kwargs
+                await self.tg_request(
+                    self.client.edit_permissions,
+                    chat_id,
+                    user_id,
+                    until_date=None,
+                    **kwargs,
                 )
-                result_message += (
+                return (
                     PERM_ON_RESULT_MESSAGE if on else PERM_OFF_RESULT_MESSAGE
                 ).format(user_name, ",".join(perms))
-            except (UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError):
-                result_message += (
+            except MODERATION_ERRORS:
+                return (
                     PERM_ON_ERROR_RESULT_MESSAGE if on else PERM_OFF_ERROR_RESULT_MESSAGE
                 ).format(user_name, ",".join(perms))
+
+        result_message += await self._for_each_user(users, on_off_user_perm)
         if comment:
             result_message += REASON.format(comment)
         await event.message.delete()
@@ -0,0 +1,129 @@
+import itertools
+import time
+import typing
+
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from guard_bot.bot.classifier import DEFAULT_FEATURES_BITS, NaiveBayes
+from guard_bot.bot.models import CLASSIFIER_CHANNEL, UserWarn, WarnType
+
+if typing.TYPE_CHECKING:
+    from typing import Iterator, List
+
+CHUNK_SIZE = 2000
+MIN_DOCUMENTS = 100
+
+
+def _file_lines(paths: "List[str]") -> "Iterator[str]":
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                yield from (x.strip() for x in file if x.strip())
+        except OSError as e:
+            raise CommandError(f"Can't open {path}: {e}")
+
+
+class Command(BaseCommand):
+    help = (
+        "train hashed-feature naive Bayes spam classifier on texts of SPAM records, "
+        "records reversed by unban or unmute are ham, running bots reload the model"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=settings.CLASSIFIER_MODEL_PATH,
+            help="model file, memory mapped by bots",
+        )
+        parser.add_argument(
+            "--bits", type=int, default=DEFAULT_FEATURES_BITS, help="2 ** bits hashed features"
+        )
+        parser.add_argument("--alpha", type=float, default=1.0, help="additive smoothing")
+        parser.add_argument(
+            "--min-documents",
+            type=int,
+            default=MIN_DOCUMENTS,
+            help="minimal number of spam and of ham messages",
+        )
+        parser.add_argument(
+            "--spam", action="append", default=[], help="extra spam file, one message per line"
+        )
+        parser.add_argument(
+            "--ham", action="append", default=[], help="extra ham file, one message per line"
+        )
+
+    @staticmethod
+    def _texts(reversed_: bool) -> "Iterator[str]":
+        """
+        Texts of SPAM records, streamed by chunks
+        :param reversed_: bool, True for records followed by unban or unmute of the user
+        :return: iterator of str
+        """
+        reversal = UserWarn.objects.filter(
+            chat_id=OuterRef("chat_id"),
+            user_id=OuterRef("user_id"),
+            warn_type__in=(WarnType.UNBAN, WarnType.UNMUTE),
+            created__gte=OuterRef("created"),
+        )
+        queryset = (
+            UserWarn.objects.filter(warn_type=WarnType.SPAM, text__isnull=False)
+            # own verdicts would only confirm the model
+            .exclude(comment__startswith="classifier")
+            .filter(Exists(reversal) if reversed_ else ~Exists(reversal))
+            .values_list("text", flat=True)
+        )
+        return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+    def handle(
+        self,
+        *args,
+        output="",
+        bits=0,
+        alpha=1.0,
+        min_documents=MIN_DOCUMENTS,
+        spam=(),
+        ham=(),
+        **options,
+    ):
+        """
+        Records are read once, model memory depends on "bits" only.
+        File is replaced atomically, NOTIFY makes running bots reload it.
+        Bots load CLASSIFIER_MODEL_PATH only, a model saved elsewhere is not announced
+        :param output: str
+        :param bits: int
+        :param alpha: float
+        :param min_documents: int
+        :param spam: list of str
+        :param ham: list of str
+        :return:
+        """
+        if not 8 <= bits <= 26:
+            raise CommandError("bits must be between 8 and 26")
+        started = time.monotonic()
+        try:
+            model, spam_count, ham_count = NaiveBayes.train(
+                itertools.chain(self._texts(False), _file_lines(spam)),
+                itertools.chain(self._texts(True), _file_lines(ham)),
+                bits=bits,
+                alpha=alpha,
+                min_documents=min_documents,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        model.save(Path(output))
+        self.stdout.write(
+            f"Trained on {spam_count} spam and {ham_count} ham messages "
+            f"in {time.monotonic() - started:.2f}s, saved to {output}"
+        )
+        if Path(output).resolve() != Path(settings.CLASSIFIER_MODEL_PATH).resolve():
+            self.stdout.write(
+                f"Running bots are not notified, they load {settings.CLASSIFIER_MODEL_PATH}"
+            )
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CLASSIFIER_CHANNEL, str(output)])
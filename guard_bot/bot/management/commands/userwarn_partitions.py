@@ -0,0 +1,83 @@
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from guard_bot.bot.models import ChatSettings, UserWarn
+from guard_bot.bot.partitions import (
+    archive_default,
+    archive_partition,
+    create_partition,
+    drop_partition,
+    list_partitions,
+    month_start,
+    partition_for,
+)
+
+
+class Command(BaseCommand):
+    help = "create next UserWarn partitions, archive and drop old ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=settings.USERWARN_PARTITIONS_AHEAD,
+            help="months to create after current one",
+        )
+        parser.add_argument(
+            "--retention",
+            type=int,
+            default=settings.USERWARN_RETENTION_MONTHS,
+            help="months to keep attached before current one",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            default=settings.USERWARN_ARCHIVE_DIR,
+            help="directory for gzipped csv of dropped partitions and old default rows",
+        )
+
+    def handle(self, *args, ahead=0, retention=0, archive_dir=None, **options):
+        """
+        Partition maintenance, safe to run repeatedly, e.g. daily from cron
+        :param ahead: int
+        :param retention: int
+        :param archive_dir: str
+        :return:
+        """
+        table = UserWarn._meta.db_table
+        now = timezone.now()
+        oldest = month_start(now, -retention)
+        max_period = ChatSettings.objects.aggregate(period=Max("warn_counter_period"))["period"]
+        max_period = max(
+            max_period or timedelta(0),
+            ChatSettings._meta.get_field("warn_counter_period").default,
+        )
+        # active warnings must stay attached
+        if now - max_period < oldest:
+            raise CommandError(
+                f"Retention {retention} months is shorter than warn counter period {max_period}"
+            )
+
+        partitions = list_partitions(table)
+        existing = {x.name for x in partitions}
+        for months in range(ahead + 1):
+            partition = partition_for(table, month_start(now, months))
+            if partition.name not in existing:
+                create_partition(table, partition)
+                self.stdout.write(f"Created {partition.name}")
+
+        for partition in partitions:
+            if partition.end > oldest:
+                continue
+            # archive while attached, a failed dump leaves the partition for the next run
+            path = archive_partition(partition, Path(archive_dir))
+            drop_partition(table, partition)
+            self.stdout.write(f"Archived {partition.name} to {path}")
+
+        path = archive_default(table, oldest, Path(archive_dir))
+        if path is not None:
+            self.stdout.write(f"Archived old rows of default partition to {path}")
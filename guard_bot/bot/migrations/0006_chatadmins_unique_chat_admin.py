@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:13
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_chat_admins(apps, schema_editor):
+    """Keep one row per (chat_id, user_id): shadow admin first, then the oldest one"""
+    ChatAdmins = apps.get_model("bot", "ChatAdmins")
+    duplicates = (
+        ChatAdmins.objects.values("chat_id", "user_id")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        qs = ChatAdmins.objects.filter(
+            chat_id=duplicate["chat_id"], user_id=duplicate["user_id"]
+        )
+        keep = qs.order_by("-shadow_admin", "id").first()
+        qs.exclude(id=keep.id).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0005_chatadmins_can_add_admin"),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_chat_admins, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="chatadmins",
+            name="bot_chatadm_chat_id_0c7fdc_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="chatadmins",
+            constraint=models.UniqueConstraint(
+                fields=("chat_id", "user_id"), name="unique_chat_admin"
+            ),
+        ),
+    ]
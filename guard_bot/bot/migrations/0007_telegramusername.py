@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0006_chatadmins_unique_chat_admin"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramUsername",
+            fields=[
+                (
+                    "username",
+                    models.CharField(
+                        max_length=64,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Username",
+                    ),
+                ),
+                ("user_id", models.BigIntegerField(verbose_name="Telegram user ID")),
+                (
+                    "updated",
+                    models.DateTimeField(auto_now=True, verbose_name="Updated"),
+                ),
+            ],
+            options={
+                "verbose_name": "Telegram username",
+                "verbose_name_plural": "Telegram usernames",
+            },
+        ),
+    ]
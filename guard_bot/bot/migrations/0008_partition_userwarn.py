@@ -0,0 +1,131 @@
+# Generated by Django 4.1.7 on 2026-10-17 09:20
+
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+# months created ahead, management command userwarn_partitions keeps them going
+AHEAD = 2
+
+
+def month_start(value, months=0):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_userwarn(apps, schema_editor):
+    """
+    Replace bot_userwarn with table partitioned by month of "created".
+    Primary key of partitioned table has to include partition key, so it is (id, created),
+    ids still come from one sequence. Index names are kept for Django state
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    execute = schema_editor.execute
+    execute("ALTER TABLE bot_userwarn RENAME TO bot_userwarn_old")
+    execute("ALTER INDEX bot_userwarn_pkey RENAME TO bot_userwarn_old_pkey")
+    execute(
+        "ALTER INDEX bot_userwar_chat_id_539915_idx RENAME TO bot_userwarn_old_chat_idx"
+    )
+    execute(
+        "ALTER INDEX bot_userwar_created_3fadcb_idx RENAME TO bot_userwarn_old_created_idx"
+    )
+    execute("CREATE SEQUENCE bot_userwarn_partitioned_id_seq")
+    execute(
+        """
+        CREATE TABLE bot_userwarn (
+            id bigint NOT NULL DEFAULT nextval('bot_userwarn_partitioned_id_seq'),
+            created timestamp with time zone NOT NULL,
+            user_id bigint NOT NULL,
+            chat_id bigint NOT NULL,
+            comment text NULL,
+            warn_type integer NOT NULL,
+            CONSTRAINT bot_userwarn_pkey PRIMARY KEY (id, created)
+        ) PARTITION BY RANGE (created)
+        """
+    )
+    execute("ALTER SEQUENCE bot_userwarn_partitioned_id_seq OWNED BY bot_userwarn.id")
+    execute(
+        "CREATE INDEX bot_userwar_chat_id_539915_idx "
+        "ON bot_userwarn (chat_id, user_id, created DESC, warn_type)"
+    )
+    execute("CREATE INDEX bot_userwar_created_3fadcb_idx ON bot_userwarn (created)")
+    execute("CREATE TABLE bot_userwarn_default PARTITION OF bot_userwarn DEFAULT")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(created), now() FROM bot_userwarn_old")
+        first, now = cursor.fetchone()
+    start, end = month_start(first or now), month_start(now, AHEAD + 1)
+    while start < end:
+        next_start = month_start(start, 1)
+        execute(
+            f"CREATE TABLE bot_userwarn_p{start:%Y%m} PARTITION OF bot_userwarn "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [start, next_start],
+        )
+        start = next_start
+
+    execute(
+        "INSERT INTO bot_userwarn (id, created, user_id, chat_id, comment, warn_type) "
+        "SELECT id, created, user_id, chat_id, comment, warn_type FROM bot_userwarn_old"
+    )
+    execute(
+        "SELECT setval('bot_userwarn_partitioned_id_seq', "
+        "(SELECT coalesce(max(id), 0) + 1 FROM bot_userwarn), false)"
+    )
+    execute("DROP TABLE bot_userwarn_old")
+    execute("ALTER SEQUENCE bot_userwarn_partitioned_id_seq RENAME TO bot_userwarn_id_seq")
+
+
+def unpartition_userwarn(apps, schema_editor):
+    """Move rows of attached partitions back to plain table"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    execute = schema_editor.execute
+    execute("ALTER TABLE bot_userwarn RENAME TO bot_userwarn_partitioned")
+    execute("ALTER INDEX bot_userwarn_pkey RENAME TO bot_userwarn_partitioned_pkey")
+    execute(
+        "ALTER INDEX bot_userwar_chat_id_539915_idx "
+        "RENAME TO bot_userwarn_partitioned_chat_idx"
+    )
+    execute(
+        "ALTER INDEX bot_userwar_created_3fadcb_idx "
+        "RENAME TO bot_userwarn_partitioned_created_idx"
+    )
+    execute("ALTER SEQUENCE bot_userwarn_id_seq RENAME TO bot_userwarn_partitioned_id_seq")
+    execute(
+        """
+        CREATE TABLE bot_userwarn (
+            id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+            created timestamp with time zone NOT NULL,
+            user_id bigint NOT NULL,
+            chat_id bigint NOT NULL,
+            comment text NULL,
+            warn_type integer NOT NULL
+        )
+        """
+    )
+    execute(
+        "CREATE INDEX bot_userwar_chat_id_539915_idx "
+        "ON bot_userwarn (chat_id, user_id, created DESC, warn_type)"
+    )
+    execute("CREATE INDEX bot_userwar_created_3fadcb_idx ON bot_userwarn (created)")
+    execute(
+        "INSERT INTO bot_userwarn (id, created, user_id, chat_id, comment, warn_type) "
+        "SELECT id, created, user_id, chat_id, comment, warn_type FROM bot_userwarn_partitioned"
+    )
+    execute(
+        "SELECT setval(pg_get_serial_sequence('bot_userwarn', 'id'), "
+        "(SELECT coalesce(max(id), 0) + 1 FROM bot_userwarn), false)"
+    )
+    execute("DROP TABLE bot_userwarn_partitioned CASCADE")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0007_telegramusername"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_userwarn, unpartition_userwarn),
+    ]
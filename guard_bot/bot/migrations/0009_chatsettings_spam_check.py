@@ -0,0 +1,27 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0008_partition_userwarn"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsettings",
+            name="spam_check",
+            field=models.BooleanField(default=False, verbose_name="Spam check"),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="spam_stages",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text='Per stage options, example {"spammers": {"enabled": false}, "admin": {}}',
+                verbose_name="Spam check stages",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0009_chatsettings_spam_check"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="spammers",
+            name="updated",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="Updated"
+            ),
+        ),
+    ]
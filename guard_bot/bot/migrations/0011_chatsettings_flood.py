@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:41
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0010_spammers_updated"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_chat_limit",
+            field=models.IntegerField(
+                default=100,
+                verbose_name="Messages in chat per flood period, 0 disables check",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_chat_period",
+            field=models.DurationField(
+                default=datetime.timedelta(seconds=10), verbose_name="Chat flood period"
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_mute_period",
+            field=models.DurationField(
+                default=datetime.timedelta(seconds=3600),
+                verbose_name="Mute period for flood",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_slow_mode",
+            field=models.DurationField(
+                default=datetime.timedelta(seconds=30),
+                verbose_name="Slow mode on chat flood",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_user_limit",
+            field=models.IntegerField(
+                default=10,
+                verbose_name="Messages of user per flood period, 0 disables check",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_user_period",
+            field=models.DurationField(
+                default=datetime.timedelta(seconds=10), verbose_name="User flood period"
+            ),
+        ),
+    ]
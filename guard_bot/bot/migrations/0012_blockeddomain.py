@@ -0,0 +1,63 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0011_chatsettings_flood"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BlockedDomain",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "domain",
+                    models.CharField(
+                        help_text="example.xyz blocks domain and subdomains, *.example.xyz only subdomains",
+                        max_length=255,
+                        verbose_name="Domain",
+                    ),
+                ),
+                (
+                    "chat_id",
+                    models.BigIntegerField(
+                        blank=True,
+                        help_text="Empty for all chats",
+                        null=True,
+                        verbose_name="Chat ID",
+                    ),
+                ),
+                (
+                    "comment",
+                    models.CharField(
+                        blank=True, max_length=255, verbose_name="Comment"
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Created"),
+                ),
+            ],
+            options={
+                "verbose_name": "Blocked domain",
+                "verbose_name_plural": "Blocked domains",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="blockeddomain",
+            index=models.Index(
+                fields=["chat_id"], name="bot_blocked_chat_id_655fda_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0012_blockeddomain"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsettings",
+            name="blocked_patterns",
+            field=models.TextField(
+                blank=True,
+                help_text="One regular expression per line, case insensitive",
+                verbose_name="Blocked patterns",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="blocked_phrases",
+            field=models.TextField(
+                blank=True,
+                help_text="One phrase per line, case insensitive, whole words only",
+                verbose_name="Blocked phrases",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatsettings",
+            name="blocklist_version",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=32,
+                verbose_name="Blocklist version",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-17 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0013_chatsettings_blocklist"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsettings",
+            name="classifier_threshold",
+            field=models.FloatField(
+                default=0.95,
+                help_text="Spam probability to delete message, 1 disables classifier",
+                verbose_name="Classifier threshold",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userwarn",
+            name="text",
+            field=models.TextField(blank=True, null=True, verbose_name="Message text"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-17 02:13
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("bot", "0014_classifier"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsettings",
+            name="flood_slow_mode_period",
+            field=models.DurationField(
+                default=datetime.timedelta(seconds=600),
+                verbose_name="Slow mode period on chat flood",
+            ),
+        ),
+    ]
@@ -1,8 +1,23 @@
+import enum
+import hashlib
+import re
+
+from array import array
 from datetime import timedelta
 
-from django.db import models, IntegrityError
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import connection, models, IntegrityError, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
+# postgres channel for chat settings changes, payload is chat_id
+CHAT_SETTINGS_CHANNEL = "guard_bot_chat_settings"
+SPAMMERS_CHANNEL = "guard_bot_spammers"
+BLOCKED_DOMAINS_CHANNEL = "guard_bot_blocked_domains"
+CLASSIFIER_CHANNEL = "guard_bot_classifier"
+
 
 class WarnType(models.IntegerChoices):
     WARN = 1, "Warn"
@@ -15,14 +30,148 @@ class WarnType(models.IntegerChoices):
     SPAM = 8, "SPAM"
 
 
+class AdminRights(enum.IntFlag):
+    NONE = 0
+    CAN_DELETE = 1
+    CAN_BAN = 2
+    CAN_ADD_ADMIN = 4
+
+    @classmethod
+    def pack(cls, can_delete=False, can_ban=False, can_add_admin=False):
+        return (
+            (cls.CAN_DELETE if can_delete else cls.NONE)
+            | (cls.CAN_BAN if can_ban else cls.NONE)
+            | (cls.CAN_ADD_ADMIN if can_add_admin else cls.NONE)
+        )
+
+    @classmethod
+    def from_name(cls, can_do: str):
+        """
+        :param can_do: str, 'can_add_admin|can_ban|can_delete'
+        :return: AdminRights
+        """
+        return cls[can_do.upper()]
+
+
 class Spammers(models.Model):
     telegram_id = models.BigIntegerField(verbose_name="TelegramID", primary_key=True)
     from_cas = models.BooleanField(default=False, verbose_name="From CAS")
+    updated = models.DateTimeField(verbose_name="Updated", auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "Telegram ID"
         verbose_name_plural = "Telegram IDs"
 
+    @classmethod
+    def read_ids(cls, since=None, chunk_size: int = 10000):
+        """
+        Spammer IDs changed since cursor, rows are streamed into int64 array
+        :param since: datetime or None for all
+        :param chunk_size: int, rows fetched at once
+        :return: tuple (array of int64, new cursor)
+        """
+        qs = cls.objects.order_by("updated")
+        if since is not None:
+            # rows with the same timestamp may be committed later, re-reading them is harmless.
+            # Rows committed later with an earlier timestamp are missed, long transactions
+            # (import_spammers) notify "reload" instead of "refresh"
+            qs = qs.filter(updated__gte=since)
+        ids, cursor = array("q"), since
+        rows = qs.values_list("telegram_id", "updated").iterator(chunk_size=chunk_size)
+        for telegram_id, updated in rows:
+            ids.append(telegram_id)
+            cursor = updated
+        return ids, cursor
+
+    @classmethod
+    async def get_ids(cls, since=None):
+        return await sync_to_async(cls.read_ids)(since)
+
+
+class BlockedDomain(models.Model):
+    domain = models.CharField(
+        verbose_name="Domain",
+        max_length=255,
+        help_text="example.xyz blocks domain and subdomains, *.example.xyz only subdomains",
+    )
+    chat_id = models.BigIntegerField(
+        verbose_name="Chat ID", null=True, blank=True, help_text="Empty for all chats"
+    )
+    comment = models.CharField(verbose_name="Comment", max_length=255, blank=True)
+    created = models.DateTimeField(verbose_name="Created", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Blocked domain"
+        verbose_name_plural = "Blocked domains"
+        indexes = [models.Index(fields=["chat_id"])]
+
+    def __str__(self):
+        return f"{self.domain}:{self.chat_id or '*'}"
+
+
+@receiver(post_save, sender=BlockedDomain)
+@receiver(post_delete, sender=BlockedDomain)
+def notify_blocked_domains_changed(sender, instance, **kwargs):
+    """
+    Notify bot processes about blocklist change, postgres delivers it on commit
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)",
+            [BLOCKED_DOMAINS_CHANNEL, str(instance.chat_id or "")],
+        )
+
+
+class TelegramUsername(models.Model):
+    username = models.CharField(verbose_name="Username", max_length=64, primary_key=True)
+    user_id = models.BigIntegerField(verbose_name="Telegram user ID")
+    updated = models.DateTimeField(verbose_name="Updated", auto_now=True)
+
+    class Meta:
+        verbose_name = "Telegram username"
+        verbose_name_plural = "Telegram usernames"
+
+    def __str__(self):
+        return f"{self.username}:{self.user_id}"
+
+    @classmethod
+    async def get_user_id(cls, username, max_age):
+        """
+        :param username: str, normalized username
+        :param max_age: timedelta, older mappings are ignored
+        :return: int or None
+        """
+        return await cls.objects.filter(
+            username=username, updated__gt=timezone.now() - max_age
+        ).values_list("user_id", flat=True).afirst()
+
+    @classmethod
+    async def set_usernames(cls, usernames):
+        """
+        :param usernames: dict, {username: user_id}
+        :return:
+        """
+        await cls.objects.abulk_create(
+            [cls(username=k, user_id=v) for k, v in usernames.items()],
+            update_conflicts=True,
+            unique_fields=["username"],
+            update_fields=["user_id", "updated"],
+        )
+
+    @classmethod
+    async def delete_usernames(cls, usernames):
+        """
+        Delete mappings, a username taken by another user since then is kept
+        :param usernames: dict, {username: user_id}
+        :return:
+        """
+        if not usernames:
+            return
+        condition = models.Q()
+        for username, user_id in usernames.items():
+            condition |= models.Q(username=username, user_id=user_id)
+        await cls.objects.filter(condition).adelete()
+
 
 class ChatAdmins(models.Model):
     chat_id = models.BigIntegerField(verbose_name="Telegram chat ID")
@@ -35,8 +184,10 @@ class ChatAdmins(models.Model):
     class Meta:
         verbose_name = "Chat Admin"
         verbose_name_plural = "Chat Admins"
-        indexes = [
-            models.Index(fields=["chat_id", "user_id"]),
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_id", "user_id"], name="unique_chat_admin"
+            ),
         ]
 
     def __str__(self):
@@ -53,6 +204,109 @@ class ChatAdmins(models.Model):
             chat.add(admin.user_id)
         return chats
 
+    @classmethod
+    def _rights_qs(cls, chat_id):
+        return cls.objects.filter(chat_id=chat_id).values_list(
+            "user_id", "can_delete", "can_ban", "can_add_admin"
+        )
+
+    @staticmethod
+    def _pack_rights(rights, row):
+        user_id, can_delete, can_ban, can_add_admin = row
+        rights[user_id] = rights.get(user_id, 0) | int(
+            AdminRights.pack(can_delete, can_ban, can_add_admin)
+        )
+
+    @classmethod
+    async def get_rights_by_chat(cls, chat_id):
+        """
+        Packed rights of all chat admins, shadow admins included
+        :param chat_id: int
+        :return: dict, {user_id: int(AdminRights)}
+        """
+        rights = {}
+        async for row in cls._rights_qs(chat_id):
+            cls._pack_rights(rights, row)
+        return rights
+
+    @classmethod
+    @transaction.atomic
+    def set_chat_admins(cls, chat_id, admins, delete_ids=None):
+        """
+        Upsert chat admins and delete removed ones in one transaction
+        :param chat_id: int
+        :param admins: dict, {user_id: AdminRights} - full admin list from telegram
+        :param delete_ids: iterable of user ids which are not admins anymore
+        :return: dict, {user_id: int(AdminRights)}, rights of all chat admins after update
+        """
+        if admins:
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        can_delete=bool(rights & AdminRights.CAN_DELETE),
+                        can_ban=bool(rights & AdminRights.CAN_BAN),
+                        can_add_admin=bool(rights & AdminRights.CAN_ADD_ADMIN),
+                    )
+                    for user_id, rights in admins.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["chat_id", "user_id"],
+                update_fields=["can_delete", "can_ban", "can_add_admin"],
+            )
+        if delete_ids:
+            cls.objects.filter(chat_id=chat_id, user_id__in=delete_ids).delete()
+        rights = {}
+        for row in cls._rights_qs(chat_id):
+            cls._pack_rights(rights, row)
+        return rights
+
+    @classmethod
+    async def aset_chat_admins(cls, chat_id, admins, delete_ids=None):
+        return await sync_to_async(cls.set_chat_admins)(chat_id, admins, delete_ids)
+
+
+# lock and warn are sent as one query, count does not see the row inserted
+# by the same statement, so it is added
+WARN_SQL = """
+SELECT pg_advisory_xact_lock(hashtextextended(%(chat_id)s || ':' || %(user_id)s, 0));
+WITH settings AS (
+    SELECT warn_count, warn_counter_period, mute_period
+    FROM (
+        SELECT 0 AS priority, warn_count, warn_counter_period, mute_period
+        FROM {settings_table} WHERE chat_id = %(chat_id)s
+        UNION ALL
+        SELECT 1, %(warn_count)s, %(warn_counter_period)s, %(mute_period)s
+    ) AS s
+    ORDER BY priority LIMIT 1
+), warn AS (
+    INSERT INTO {warn_table} (created, chat_id, user_id, comment, warn_type)
+    VALUES (now(), %(chat_id)s, %(user_id)s, %(comment)s, %(warn_type)s)
+    RETURNING id
+), active AS (
+    -- scalar subquery is an initplan, partitions are pruned by its value at execution
+    SELECT count(*) + 1 AS warn_count
+    FROM {warn_table}
+    WHERE chat_id = %(chat_id)s AND user_id = %(user_id)s AND warn_type = %(warn_type)s
+        AND created > now() - (SELECT warn_counter_period FROM settings)
+)
+SELECT
+    active.warn_count,
+    CASE WHEN active.warn_count >= settings.warn_count THEN settings.mute_period END
+FROM active, settings, warn
+"""
+
+DELETE_WARNINGS_SQL = """
+WITH deleted AS (
+    DELETE FROM {warn_table}
+    WHERE chat_id = %(chat_id)s AND user_id = ANY(%(user_ids)s) AND warn_type = %(warn_type)s
+        AND created > now() - %(warn_period)s
+    RETURNING user_id
+)
+SELECT user_id, count(*) FROM deleted GROUP BY user_id
+"""
+
 
 class UserWarn(models.Model):
     created = models.DateTimeField(verbose_name="Created", auto_now_add=True)
@@ -60,6 +314,8 @@ class UserWarn(models.Model):
     chat_id = models.BigIntegerField(verbose_name="Chat ID")
     comment = models.TextField(verbose_name="Comment", null=True)
     warn_type = models.IntegerField(choices=WarnType.choices)
+    # text of deleted spam message, training data of classifier
+    text = models.TextField(verbose_name="Message text", null=True, blank=True)
 
     def __str__(self):
         return f"{self.user_id}-{self.chat_id}-{self.comment}"
@@ -89,30 +345,96 @@ class UserWarn(models.Model):
         )
 
     @classmethod
-    async def check_warn_counter(cls, chat_id, user_id):
-        settings = await ChatSettings.get_chat_settings(chat_id=chat_id)
+    async def check_warn_counter(cls, chat_id, user_id, settings=None):
+        settings = settings or await ChatSettings.get_chat_settings(chat_id=chat_id)
         warn_count = await cls.get_warn_qs(
             chat_id=chat_id, user_id=user_id, warn_period=settings.warn_counter_period
         ).acount()
         return settings, warn_count
 
     @classmethod
-    async def have_to_mute(cls, chat_id, user_id):
+    async def have_to_mute(cls, chat_id, user_id, settings=None):
         settings, warn_count = await cls.check_warn_counter(
-            chat_id=chat_id, user_id=user_id
+            chat_id=chat_id, user_id=user_id, settings=settings
         )
         if warn_count + 1 >= settings.warn_count:
             return settings.mute_period
         return None
 
     @classmethod
-    async def delete_current_warnings(cls, chat_id, user_id):
-        settings = await ChatSettings.get_chat_settings(chat_id=chat_id)
-        qs = cls.get_warn_qs(
-            chat_id=chat_id, user_id=user_id, warn_period=settings.warn_counter_period
+    @transaction.atomic
+    def warn(cls, chat_id, user_id, comment: str = None):
+        """
+        Insert warning and check it against chat settings in one round trip.
+        Advisory lock serializes warnings of the same user, the second statement
+        runs with a new snapshot, so it sees warnings committed while it waited
+        :param chat_id: int
+        :param user_id: int
+        :param comment: str
+        :return: tuple (active warnings including this one, mute period or None)
+        """
+        defaults = {
+            name: ChatSettings._meta.get_field(name).default
+            for name in ("warn_count", "warn_counter_period", "mute_period")
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                WARN_SQL.format(
+                    warn_table=cls._meta.db_table,
+                    settings_table=ChatSettings._meta.db_table,
+                ),
+                {
+                    "chat_id": chat_id,
+                    "user_id": user_id,
+                    "comment": comment,
+                    "warn_type": WarnType.WARN,
+                    **defaults,
+                },
+            )
+            warn_count, mute_period = cursor.fetchone()
+        return warn_count, mute_period
+
+    @classmethod
+    async def awarn(cls, chat_id, user_id, comment: str = None):
+        return await sync_to_async(cls.warn)(chat_id, user_id, comment)
+
+    @classmethod
+    def delete_warnings(cls, chat_id, user_ids, warn_period):
+        """
+        Delete active warnings of many users with one statement
+        :param chat_id: int
+        :param user_ids: iterable of int
+        :param warn_period: timedelta, chat warn_counter_period
+        :return: dict, {user_id: deleted warnings count}
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        result = dict.fromkeys(user_ids, 0)
+        if not user_ids:
+            return result
+        with connection.cursor() as cursor:
+            cursor.execute(
+                DELETE_WARNINGS_SQL.format(warn_table=cls._meta.db_table),
+                {
+                    "chat_id": chat_id,
+                    "user_ids": user_ids,
+                    "warn_type": WarnType.WARN,
+                    "warn_period": warn_period,
+                },
+            )
+            result.update(cursor.fetchall())
+        return result
+
+    @classmethod
+    async def adelete_warnings(cls, chat_id, user_ids, warn_period):
+        return await sync_to_async(cls.delete_warnings)(chat_id, user_ids, warn_period)
+
+    @classmethod
+    async def delete_current_warnings(cls, chat_id, user_id, settings=None):
+        settings = settings or await ChatSettings.get_chat_settings(chat_id=chat_id)
+        result = await cls.adelete_warnings(
+            chat_id, [user_id], settings.warn_counter_period
         )
-        await qs.adelete()
-        return await qs.acount()
+        return result[user_id]
 
 
 class ChatSettings(models.Model):
@@ -124,6 +446,54 @@ class ChatSettings(models.Model):
     mute_period = models.DurationField(
         verbose_name="Mute period", default=timedelta(days=1)
     )
+    # opt-in, spam stages delete messages
+    spam_check = models.BooleanField(verbose_name="Spam check", default=False)
+    spam_stages = models.JSONField(
+        verbose_name="Spam check stages",
+        default=dict,
+        blank=True,
+        help_text='Per stage options, example {"spammers": {"enabled": false}, "admin": {}}',
+    )
+    flood_user_limit = models.IntegerField(
+        verbose_name="Messages of user per flood period, 0 disables check", default=10
+    )
+    flood_user_period = models.DurationField(
+        verbose_name="User flood period", default=timedelta(seconds=10)
+    )
+    flood_mute_period = models.DurationField(
+        verbose_name="Mute period for flood", default=timedelta(hours=1)
+    )
+    flood_chat_limit = models.IntegerField(
+        verbose_name="Messages in chat per flood period, 0 disables check", default=100
+    )
+    flood_chat_period = models.DurationField(
+        verbose_name="Chat flood period", default=timedelta(seconds=10)
+    )
+    flood_slow_mode = models.DurationField(
+        verbose_name="Slow mode on chat flood", default=timedelta(seconds=30)
+    )
+    flood_slow_mode_period = models.DurationField(
+        verbose_name="Slow mode period on chat flood", default=timedelta(minutes=10)
+    )
+    blocked_phrases = models.TextField(
+        verbose_name="Blocked phrases",
+        blank=True,
+        help_text="One phrase per line, case insensitive, whole words only",
+    )
+    blocked_patterns = models.TextField(
+        verbose_name="Blocked patterns",
+        blank=True,
+        help_text="One regular expression per line, case insensitive",
+    )
+    classifier_threshold = models.FloatField(
+        verbose_name="Classifier threshold",
+        default=0.95,
+        help_text="Spam probability to delete message, 1 disables classifier",
+    )
+    # compiled blocklists are cached by it, set on save
+    blocklist_version = models.CharField(
+        verbose_name="Blocklist version", max_length=32, blank=True, editable=False
+    )
 
     class Meta:
         verbose_name = "Chat settings"
@@ -132,6 +502,60 @@ class ChatSettings(models.Model):
     def __str__(self):
         return f"{self.chat_id}"
 
+    def clean(self):
+        self._clean_blocked_patterns()
+        self._clean_spam_stages()
+
+    def _clean_blocked_patterns(self):
+        """
+        Every pattern and the regex they are joined into by ChatBlocklist must compile
+        """
+        from guard_bot.bot.keywords import compile_patterns, split_lines
+
+        try:
+            _, _, invalid = compile_patterns(split_lines(self.blocked_patterns))
+        except re.error as e:
+            raise ValidationError({"blocked_patterns": f"Patterns can't be joined: {e}"})
+        if invalid:
+            pattern, error = invalid[0]
+            raise ValidationError({"blocked_patterns": f"{pattern}: {error}"})
+
+    def _clean_spam_stages(self):
+        """
+        {stage name: {"enabled": bool, "verdict": verdict name}}, stage names
+        are not checked, options of a stage which is not used are ignored
+        """
+        from guard_bot.bot.spam import Verdict
+
+        if not isinstance(self.spam_stages, dict):
+            raise ValidationError({"spam_stages": "Must be an object of stage options"})
+        for name, options in self.spam_stages.items():
+            if not isinstance(options, dict):
+                raise ValidationError({"spam_stages": f"{name}: options must be an object"})
+            unknown = set(options) - {"enabled", "verdict"}
+            if unknown:
+                raise ValidationError(
+                    {"spam_stages": f"{name}: unknown options {', '.join(sorted(unknown))}"}
+                )
+            if not isinstance(options.get("enabled", True), bool):
+                raise ValidationError({"spam_stages": f"{name}: enabled must be true or false"})
+            if "verdict" in options and Verdict.get(options["verdict"]) is None:
+                raise ValidationError(
+                    {
+                        "spam_stages": f"{name}: verdict must be one of "
+                        f"{', '.join(x.name.lower() for x in Verdict)}"
+                    }
+                )
+
+    def save(self, *args, **kwargs):
+        if self.blocked_phrases.strip() or self.blocked_patterns.strip():
+            self.blocklist_version = hashlib.blake2b(
+                f"{self.blocked_phrases}\0{self.blocked_patterns}".encode(), digest_size=16
+            ).hexdigest()
+        else:
+            self.blocklist_version = ""
+        super().save(*args, **kwargs)
+
     @classmethod
     async def get_chat_settings(cls, chat_id):
         settings = await cls.objects.filter(chat_id=chat_id).afirst()
@@ -141,3 +565,15 @@ class ChatSettings(models.Model):
             except IntegrityError:
                 return await cls.objects.filter(chat_id=chat_id).afirst()
         return settings
+
+
+@receiver(post_save, sender=ChatSettings)
+@receiver(post_delete, sender=ChatSettings)
+def notify_chat_settings_changed(sender, instance, **kwargs):
+    """
+    Notify bot processes about settings change, postgres delivers it on commit
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, %s)", [CHAT_SETTINGS_CHANNEL, str(instance.chat_id)]
+        )
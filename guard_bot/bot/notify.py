@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import typing
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.db import connections
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+if typing.TYPE_CHECKING:
+    from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("asyncio")
+
+
+class PgListener:
+    """
+    One postgres LISTEN connection on the event loop for many channels.
+    Callbacks are called in the loop with notification payload,
+    "on_reconnect" callbacks are called after every (re)connect, because
+    notifications sent while nobody was listening are lost
+    """
+
+    def __init__(self):
+        self._handlers: "Dict[str, Callable[[str], None]]" = {}
+        self._on_reconnect: "List[Callable[[], None]]" = []
+        self.listening = False
+        self.notifications = 0
+        self.reconnects = 0
+
+    def subscribe(
+        self,
+        channel: str,
+        callback: "Callable[[str], None]",
+        on_reconnect: "Optional[Callable[[], None]]" = None,
+    ):
+        """
+        :param channel: str, postgres channel name
+        :param callback: called with payload
+        :param on_reconnect: called without arguments after connect
+        :return:
+        """
+        self._handlers[channel] = callback
+        if on_reconnect is not None:
+            self._on_reconnect.append(on_reconnect)
+
+    def _connect(self):
+        conn = psycopg2.connect(**connections["default"].get_connection_params())
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            for channel in self._handlers:
+                cursor.execute(f"LISTEN {channel}")
+        return conn
+
+    def _dispatch(self, channel: str, payload: str):
+        self.notifications += 1
+        try:
+            self._handlers[channel](payload)
+        except Exception:
+            logger.exception(f"Notification handler of {channel} failed")
+
+    async def listen(self, retry_period: float = 5):
+        """
+        Dispatch notifications, reconnects forever
+        :param retry_period: float, seconds between reconnects
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            conn = None
+            try:
+                conn = await sync_to_async(self._connect)()
+                readable = asyncio.Event()
+                loop.add_reader(conn.fileno(), readable.set)
+                try:
+                    self.reconnects += 1
+                    for callback in self._on_reconnect:
+                        callback()
+                    self.listening = True
+                    while True:
+                        await readable.wait()
+                        readable.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            self._dispatch(notify.channel, notify.payload)
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except Exception:
+                logger.exception("Postgres listener failed")
+            finally:
+                self.listening = False
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(retry_period)
+
+    def stats(self) -> dict:
+        return {
+            "channels": list(self._handlers),
+            "listening": self.listening,
+            "notifications": self.notifications,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,158 @@
+import gzip
+import re
+import typing
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.db import connection, transaction
+
+if typing.TYPE_CHECKING:
+    from typing import List, Optional
+
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+
+@dataclass(frozen=True)
+class Partition:
+    """
+    Monthly range partition, rows with start <= created < end
+    """
+
+    name: str
+    start: datetime
+    end: datetime
+
+
+def month_start(value: datetime, months: int = 0) -> datetime:
+    """
+    First moment of the month, shifted by "months"
+    :param value: datetime
+    :param months: int, may be negative
+    :return: datetime in UTC
+    """
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_for(table: str, value: datetime) -> Partition:
+    start = month_start(value)
+    return Partition(f"{table}_p{start:%Y%m}", start, month_start(start, 1))
+
+
+def default_partition(table: str) -> str:
+    return f"{table}_default"
+
+
+def list_partitions(table: str) -> "List[Partition]":
+    """
+    Attached monthly partitions ordered by range
+    :param table: str, partitioned table name
+    :return: list of Partition
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        names = [name for name, in cursor.fetchall()]
+    result = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match and match["table"] == table:
+            result.append(
+                partition_for(table, datetime(int(match["year"]), int(match["month"]), 1))
+            )
+    return sorted(result, key=lambda x: x.start)
+
+
+@transaction.atomic
+def create_partition(table: str, partition: Partition):
+    """
+    Create partition as standalone table, move its rows out of default partition
+    and attach it. Attaching fails while default partition has rows of the range
+    :param table: str
+    :param partition: Partition
+    :return:
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {partition.name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {default_partition(table)} "
+            f"WHERE created >= %s AND created < %s RETURNING *) "
+            f"INSERT INTO {partition.name} SELECT * FROM moved",
+            [partition.start, partition.end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {partition.name} FOR VALUES FROM (%s) TO (%s)",
+            [partition.start, partition.end],
+        )
+
+
+def detach_partition(table: str, partition: Partition):
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition.name}")
+
+
+@transaction.atomic
+def drop_partition(table: str, partition: Partition):
+    """
+    Detach and drop partition in one transaction, nothing is left half done
+    :param table: str
+    :param partition: Partition
+    :return:
+    """
+    detach_partition(table, partition)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE {partition.name}")
+
+
+def archive_partition(partition: Partition, directory: Path) -> Path:
+    """
+    Dump partition to gzipped csv, it stays attached, so a failed dump is
+    retried by the next run. File appears only when it is completely written
+    :param partition: Partition
+    :param directory: Path
+    :return: Path of archive
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{partition.name}.csv.gz"
+    tmp_path = directory / f"{partition.name}.csv.gz.tmp"
+    with connection.cursor() as cursor:
+        with gzip.open(tmp_path, "wb") as file:
+            cursor.copy_expert(
+                f"COPY {partition.name} TO STDOUT WITH (FORMAT csv, HEADER)", file
+            )
+    tmp_path.rename(path)
+    return path
+
+
+def archive_default(table: str, before: datetime, directory: Path) -> "Optional[Path]":
+    """
+    Move rows older than "before" from default partition to gzipped csv, e.g. rows
+    written before partitioning. Rows are deleted by the statement which dumps them
+    in one transaction, so a failed dump deletes nothing
+    :param table: str
+    :param before: datetime
+    :param directory: Path
+    :return: Path of archive or None when there are no such rows
+    """
+    default = default_partition(table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created < %s)", [before])
+        if not cursor.fetchone()[0]:
+            return None
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{default}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}.csv.gz"
+        path, tmp_path = directory / name, directory / f"{name}.tmp"
+        delete = cursor.mogrify(
+            f"DELETE FROM {default} WHERE created < %s RETURNING *", [before]
+        ).decode()
+        with gzip.open(tmp_path, "wb") as file:
+            cursor.copy_expert(f"COPY ({delete}) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+        tmp_path.rename(path)
+    return path
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+import typing
+
+from telethon.errors import FloodWaitError
+
+if typing.TYPE_CHECKING:
+    from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger("asyncio")
+
+
+class TokenBucket:
+    """
+    Global rate limiter for telegram requests.
+    Waiters are served in FIFO order, FloodWaitError pauses the whole bucket
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1):
+        """
+        Wait for tokens
+        :param tokens: float
+        :return:
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Stop issuing tokens, used on FloodWaitError
+        :param seconds: float
+        :return:
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RefreshScheduler:
+    """
+    Runs chat refreshes concurrently, limited by concurrency and token bucket.
+    Keeps last successful refresh time of every chat for staleness report
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        concurrency: int = 4,
+        cooldown: float = 0,
+        max_attempts: int = 3,
+    ):
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.cooldown = cooldown
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.flood_waits = 0
+        self.errors = 0
+        self.last_cycle_duration = None
+        self.refreshed = {}
+
+    async def _refresh(
+        self,
+        semaphore: asyncio.Semaphore,
+        refresh: "Callable[[int, Set[int]], Awaitable]",
+        chat_id: int,
+        db_admins: "Set[int]",
+    ):
+        async with semaphore:
+            for attempt in range(self.max_attempts):
+                await self.bucket.acquire()
+                self.in_flight += 1
+                try:
+                    await refresh(chat_id, db_admins)
+                    self.refreshed[chat_id] = time.monotonic()
+                    break
+                except FloodWaitError as e:
+                    self.flood_waits += 1
+                    logger.warning(
+                        f"Reloading admins for chat {chat_id}. Flood wait {e.seconds}s"
+                    )
+                    self.bucket.pause(e.seconds)
+                except Exception:
+                    self.errors += 1
+                    logger.exception(f"Reloading admins for chat {chat_id} failed")
+                    break
+                finally:
+                    self.in_flight -= 1
+            if self.cooldown:
+                await asyncio.sleep(self.cooldown)
+
+    async def run_cycle(
+        self,
+        refresh: "Callable[[int, Set[int]], Awaitable]",
+        chats: "Dict[int, Set[int]]",
+    ):
+        """
+        Refresh all chats once
+        :param refresh: coroutine function (chat_id, db_admins)
+        :param chats: dict {chat_id: db_admins}
+        :return:
+        """
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *[
+                self._refresh(semaphore, refresh, chat_id, db_admins)
+                for chat_id, db_admins in chats.items()
+            ]
+        )
+        for chat_id in self.refreshed.keys() - chats.keys():
+            del self.refreshed[chat_id]
+        self.last_cycle_duration = time.monotonic() - started
+
+    def staleness(self, chat_id: int) -> "Optional[float]":
+        """
+        Seconds since last successful refresh, None if chat was never refreshed
+        :param chat_id: int
+        :return: float
+        """
+        refreshed = self.refreshed.get(chat_id)
+        return None if refreshed is None else time.monotonic() - refreshed
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "chats": len(self.refreshed),
+            "in_flight": self.in_flight,
+            "flood_waits": self.flood_waits,
+            "errors": self.errors,
+            "last_cycle_duration": self.last_cycle_duration,
+            "max_staleness": max((now - x for x in self.refreshed.values()), default=None),
+        }
@@ -0,0 +1,491 @@
+import asyncio
+import enum
+import hashlib
+import inspect
+import logging
+import time
+import typing
+
+from collections import Counter
+from dataclasses import dataclass, field
+
+from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto, MessageMediaWebPage
+
+from guard_bot.bot.domains import extract_urls, url_domain
+from guard_bot.bot.duplicates import prepare
+from guard_bot.bot.models import Spammers
+
+if typing.TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+    from guard_bot.bot.cache import AdminCache
+    from guard_bot.bot.classifier import BatchScorer
+    from guard_bot.bot.domains import DomainBlocklist
+    from guard_bot.bot.duplicates import NearDuplicateIndex
+    from guard_bot.bot.executor import CpuExecutor
+    from guard_bot.bot.keywords import BlocklistCache
+    from guard_bot.bot.models import ChatSettings
+    from guard_bot.bot.spammers import SpammerIndex
+
+logger = logging.getLogger("asyncio")
+
+
+class Verdict(enum.IntEnum):
+    """
+    Result of a stage, the first stage with a verdict other than PASS decides.
+    CLEAN stops pipeline without action, DELETE, WARN and BAN stop it with action
+    """
+
+    PASS = 0
+    CLEAN = 1
+    DELETE = 2
+    WARN = 3
+    BAN = 4
+
+    @classmethod
+    def from_name(cls, name: str) -> "Verdict":
+        return cls[name.upper()]
+
+    @classmethod
+    def get(cls, name: "Any") -> "Optional[Verdict]":
+        """
+        :param name: verdict name from chat configuration
+        :return: Verdict or None if name is not valid
+        """
+        try:
+            return cls.from_name(name)
+        except (KeyError, AttributeError):
+            return None
+
+
+@dataclass(slots=True)
+class SpamContext:
+    """
+    Message data extracted once per event, shared by all stages
+    """
+
+    event: "Any"
+    chat_id: int
+    user_id: int
+    message_id: int
+    text: str
+    is_edit: bool = False
+    entities: "Optional[list]" = None
+    # set by pipeline
+    chat_settings: "Optional[ChatSettings]" = None
+    # stages may leave data for next ones
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_event(cls, event, is_edit: bool = False) -> "Optional[SpamContext]":
+        """
+        :param event: events.NewMessage or events.MessageEdited
+        :param is_edit: bool
+        :return: SpamContext or None if message has no sender
+        """
+        message = event.message
+        if message.sender is None:
+            return None
+        return cls(
+            event=event,
+            chat_id=message.chat.id,
+            user_id=message.sender.id,
+            message_id=message.id,
+            text=message.message or "",
+            is_edit=is_edit,
+            entities=message.entities,
+        )
+
+
+def content_hash(message) -> bytes:
+    """
+    Hash of what spam stages look at: text, entities and media.
+    Link preview is ignored, telegram adds it with an edit event
+    :param message: telethon Message
+    :return: bytes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((message.message or "").encode())
+    for entity in message.entities or ():
+        digest.update(
+            repr(
+                (
+                    type(entity).__name__,
+                    entity.offset,
+                    entity.length,
+                    getattr(entity, "url", None),
+                    getattr(entity, "user_id", None),
+                )
+            ).encode()
+        )
+    media = message.media
+    if isinstance(media, MessageMediaPhoto):
+        digest.update(repr(("photo", getattr(media.photo, "id", None))).encode())
+    elif isinstance(media, MessageMediaDocument):
+        digest.update(repr(("document", getattr(media.document, "id", None))).encode())
+    elif media is not None and not isinstance(media, MessageMediaWebPage):
+        digest.update(type(media).__name__.encode())
+    return digest.digest()
+
+
+@dataclass(slots=True)
+class SpamResult:
+    verdict: Verdict
+    stage: str
+    reason: "Optional[str]" = None
+
+    @property
+    def comment(self) -> str:
+        return f"{self.stage}: {self.reason}" if self.reason else self.stage
+
+
+class Stage:
+    """
+    Pipeline stage.
+    "check" returns Verdict, (Verdict, reason) or None for PASS, synchronously
+    or as awaitable. Only awaitable results are limited by time budget, so cheap
+    checks are plain function calls. Stages are ordered by "cost"
+    """
+
+    name = "stage"
+    cost = 0
+    budget: "Optional[float]" = None
+
+    def check(
+        self, context: SpamContext
+    ) -> "Union[None, Verdict, tuple, Awaitable[Union[None, Verdict, tuple]]]":
+        raise NotImplementedError
+
+
+class CpuStage(Stage):
+    """
+    Stage with CPU-bound part. "analyze" is a module level function of "features",
+    which are plain picklable data taken from context, it runs in process pool
+    when pipeline has one and "offload" allows it. "finish" makes result of its
+    return value in the event loop. "fallback" is the result when pool is saturated
+    """
+
+    cpu_bound = True
+    fallback: "Union[None, Verdict, tuple]" = None
+    analyze: "Callable[..., Any]"
+
+    def features(self, context: SpamContext) -> tuple:
+        return (context.text,)
+
+    def offload(self, context: SpamContext) -> bool:
+        return True
+
+    def finish(self, context: SpamContext, analysis: "Any"):
+        return analysis
+
+    def check(self, context: SpamContext):
+        return self.finish(context, self.analyze(*self.features(context)))
+
+
+class AdminStage(Stage):
+    """Chat admins are never checked, rights are taken from admin cache only"""
+
+    name = "admin"
+    cost = 0
+
+    def __init__(self, admin_cache: "AdminCache"):
+        self.admin_cache = admin_cache
+
+    def check(self, context: SpamContext):
+        rights = self.admin_cache.peek(context.chat_id)
+        if rights and context.user_id in rights:
+            return Verdict.CLEAN
+        return None
+
+
+class SpammersStage(Stage):
+    """
+    Sender is in Spammers table, checked by in-memory index.
+    Database is queried only until the index is loaded
+    """
+
+    name = "spammers"
+    cost = 1
+
+    def __init__(self, index: "SpammerIndex"):
+        self.index = index
+
+    async def _check_db(self, context: SpamContext):
+        if await Spammers.objects.filter(telegram_id=context.user_id).aexists():
+            return Verdict.BAN, "known spammer"
+        return None
+
+    def check(self, context: SpamContext):
+        if not self.index.loaded:
+            return self._check_db(context)
+        if context.user_id in self.index:
+            return Verdict.BAN, "known spammer"
+        return None
+
+
+class DomainStage(Stage):
+    """Link to a domain from global or chat blocklist"""
+
+    name = "domains"
+    cost = 2
+
+    def __init__(self, blocklist: "DomainBlocklist", verdict: Verdict = Verdict.DELETE):
+        self.blocklist = blocklist
+        self.verdict = verdict
+
+    def check(self, context: SpamContext):
+        for url in extract_urls(context.text, context.entities):
+            domain = url_domain(url)
+            if domain is None:
+                continue
+            entry = self.blocklist.match(context.chat_id, domain)
+            if entry is not None:
+                return self.verdict, f"blocked domain {entry}"
+        return None
+
+
+class BlocklistStage(Stage):
+    """Phrase or pattern from chat blocklist, see ChatSettings.blocked_phrases"""
+
+    name = "blocklist"
+    cost = 3
+
+    def __init__(self, cache: "BlocklistCache", verdict: Verdict = Verdict.DELETE):
+        self.cache = cache
+        self.verdict = verdict
+
+    def check(self, context: SpamContext):
+        if context.chat_settings is None or not context.text:
+            return None
+        blocklist = self.cache.get(context.chat_settings)
+        if blocklist is None:
+            return None
+        found = blocklist.search(context.text)
+        if found is not None:
+            return self.verdict, f"blocked {found}"
+        return None
+
+
+class DuplicatesStage(CpuStage):
+    """
+    Same text with small changes posted in many chats within a short window,
+    earlier copies are only indexed. Signature of long text is made in process pool,
+    index is process local and is updated in the event loop
+    """
+
+    name = "duplicates"
+    cost = 5
+    analyze = staticmethod(prepare)
+
+    def __init__(
+        self,
+        index: "NearDuplicateIndex",
+        verdict: Verdict = Verdict.DELETE,
+        offload_length: int = 1000,
+    ):
+        self.index = index
+        self.verdict = verdict
+        self.offload_length = offload_length
+
+    def features(self, context: SpamContext) -> tuple:
+        return context.text, self.index.min_length, self.index.hashes
+
+    def offload(self, context: SpamContext) -> bool:
+        # short texts are faster in place than pickled to a worker
+        return len(context.text) >= self.offload_length
+
+    def finish(self, context: SpamContext, analysis: "Optional[tuple]"):
+        chats = self.index.add(context.chat_id, context.message_id, analysis)
+        if chats >= self.index.min_chats:
+            return self.verdict, f"duplicate in {chats} chats"
+        return None
+
+
+class ClassifierStage(Stage):
+    """
+    Spam probability of hashed-feature classifier, threshold is per chat,
+    see ChatSettings.classifier_threshold. Messages are scored in micro-batches
+    """
+
+    name = "classifier"
+    cost = 6
+
+    def __init__(self, scorer: "BatchScorer", verdict: Verdict = Verdict.DELETE):
+        self.scorer = scorer
+        self.verdict = verdict
+
+    async def _check(self, context: SpamContext, threshold: float):
+        probability = await self.scorer.score(context.text)
+        if probability is not None and probability >= threshold:
+            return self.verdict, f"{probability:.2f}"
+        return None
+
+    def check(self, context: SpamContext):
+        threshold = getattr(context.chat_settings, "classifier_threshold", 1.0)
+        if self.scorer.model is None or not context.text or threshold >= 1:
+            return None
+        return self._check(context, threshold)
+
+
+class StageStats:
+    __slots__ = (
+        "calls",
+        "total",
+        "max",
+        "timeouts",
+        "late",
+        "errors",
+        "offloaded",
+        "fallbacks",
+        "verdicts",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+        self.late = 0
+        self.errors = 0
+        self.offloaded = 0
+        self.fallbacks = 0
+        self.verdicts = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "avg": self.total / self.calls if self.calls else 0.0,
+            "max": self.max,
+            "timeouts": self.timeouts,
+            "late": self.late,
+            "errors": self.errors,
+            "offloaded": self.offloaded,
+            "fallbacks": self.fallbacks,
+            "verdicts": {x.name.lower(): y for x, y in self.verdicts.items()},
+        }
+
+
+class SpamPipeline:
+    """
+    Runs stages from the cheapest to the most expensive one until a stage returns a verdict.
+    Per chat configuration is ChatSettings.spam_stages:
+    {stage name: {"enabled": false}} disables stage,
+    {stage name: {"verdict": "delete"}} replaces verdict of stage, unknown verdict is ignored.
+    Stage errors and timeouts are counted and treated as PASS.
+    CpuStage runs in executor when it is set, in place otherwise
+    """
+
+    def __init__(
+        self,
+        stages: "Iterable[Stage]" = (),
+        budget: float = 0.05,
+        executor: "Optional[CpuExecutor]" = None,
+    ):
+        self.stages = []
+        self.budget = budget
+        self.executor = executor
+        self.messages = 0
+        self.verdicts = Counter()
+        self._stats: "Dict[str, StageStats]" = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage: Stage):
+        """
+        Add stage, keeps order by cost, stages with equal cost keep insertion order
+        :param stage: Stage
+        :return:
+        """
+        self.stages.append(stage)
+        self.stages.sort(key=lambda x: x.cost)
+        self._stats[stage.name] = StageStats()
+
+    async def _run_stage(self, stage: Stage, context: SpamContext):
+        budget = self.budget if stage.budget is None else stage.budget
+        if self.executor is not None and isinstance(stage, CpuStage) and stage.offload(context):
+            stats = self._stats[stage.name]
+            future = self.executor.submit(stage.analyze, *stage.features(context))
+            if future is None:
+                stats.fallbacks += 1
+                return stage.fallback
+            stats.offloaded += 1
+            try:
+                analysis = await asyncio.wait_for(asyncio.shield(future), budget)
+            except asyncio.TimeoutError:
+                # verdict is too late, but the result still updates stage state,
+                # e.g. the near-duplicate index has to see every long message
+                future.add_done_callback(lambda x: self._finish_late(stage, context, x))
+                raise
+            return stage.finish(context, analysis)
+        result = stage.check(context)
+        if inspect.isawaitable(result):
+            result = await asyncio.wait_for(result, budget)
+        return result
+
+    def _finish_late(self, stage: CpuStage, context: SpamContext, future: "asyncio.Future"):
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._stats[stage.name].late += 1
+        try:
+            stage.finish(context, future.result())
+        except Exception:
+            logger.exception(f"Spam stage {stage.name} failed")
+
+    async def run(
+        self, context: SpamContext, chat_settings: "ChatSettings" = None
+    ) -> "Optional[SpamResult]":
+        """
+        Check message
+        :param context: SpamContext
+        :param chat_settings: ChatSettings
+        :return: SpamResult or None if no stage decided
+        """
+        self.messages += 1
+        context.chat_settings = chat_settings
+        config = getattr(chat_settings, "spam_stages", None)
+        if not isinstance(config, dict):
+            config = {}
+        for stage in self.stages:
+            stage_config = config.get(stage.name)
+            if not isinstance(stage_config, dict):
+                stage_config = {}
+            if not stage_config.get("enabled", True):
+                continue
+            stats = self._stats[stage.name]
+            started = time.perf_counter()
+            try:
+                result = await self._run_stage(stage, context)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                result = None
+            except Exception:
+                stats.errors += 1
+                logger.exception(f"Spam stage {stage.name} failed")
+                result = None
+            elapsed = time.perf_counter() - started
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+
+            verdict, reason = result if isinstance(result, tuple) else (result, None)
+            if not verdict:
+                continue
+            if verdict > Verdict.CLEAN and "verdict" in stage_config:
+                # invalid name keeps verdict of stage, see ChatSettings.clean
+                override = Verdict.get(stage_config["verdict"])
+                if override is not None:
+                    verdict = override
+                if not verdict:
+                    continue
+            stats.verdicts[verdict] += 1
+            self.verdicts[verdict] += 1
+            return SpamResult(verdict, stage.name, reason)
+        self.verdicts[Verdict.PASS] += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "verdicts": {x.name.lower(): y for x, y in self.verdicts.items()},
+            "stages": {x.name: self._stats[x.name].as_dict() for x in self.stages},
+        }
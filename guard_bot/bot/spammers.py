@@ -0,0 +1,210 @@
+import asyncio
+import math
+import time
+import typing
+
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+import numpy as np
+
+from guard_bot.bot.models import Spammers
+
+if typing.TYPE_CHECKING:
+    from datetime import datetime
+    from typing import Iterable, Optional, Tuple
+
+_MASK = (1 << 64) - 1
+
+
+def _mix(value: int) -> int:
+    """splitmix64 finalizer, spreads sequential telegram ids over all bits"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+def _mix_array(values: "np.ndarray") -> "np.ndarray":
+    """_mix over int64 array, uint64 arithmetic wraps like the masked one"""
+    values = np.ascontiguousarray(values, dtype=np.int64).view(np.uint64) + np.uint64(
+        0x9E3779B97F4A7C15
+    )
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class BloomFilter:
+    """
+    Bit array with k probes derived from one 64 bit hash (double hashing)
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1024)
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.probes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: int):
+        hashed = _mix(value)
+        first, second = hashed & 0xFFFFFFFF, hashed >> 32 | 1
+        for i in range(self.probes):
+            yield (first + i * second) % self.size
+
+    def add(self, value: int):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, values: "np.ndarray"):
+        """
+        Vectorized "add" of many values, sets the same bits
+        :param values: int64 array
+        :return:
+        """
+        hashed = _mix_array(values)
+        first, second = hashed & np.uint64(0xFFFFFFFF), hashed >> np.uint64(32) | np.uint64(1)
+        bits = np.unpackbits(np.frombuffer(self.bits, dtype=np.uint8), bitorder="little")
+        for i in range(self.probes):
+            bits[(first + np.uint64(i) * second) % np.uint64(self.size)] = 1
+        self.bits = bytearray(np.packbits(bits, bitorder="little").tobytes())
+
+    def __contains__(self, value: int) -> bool:
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def build_index(
+    ids: "array", bloom_error_rate: "Optional[float]"
+) -> "Tuple[array, Optional[BloomFilter]]":
+    """
+    CPU bound part of the full load, runs in executor. numpy releases the GIL
+    for most of the work, so the event loop keeps handling updates
+    :param ids: int64 array, unsorted
+    :param bloom_error_rate: float or None without bloom filter
+    :return: tuple (sorted int64 array, bloom filter or None)
+    """
+    values = np.sort(np.frombuffer(ids, dtype=np.int64))
+    bloom = None
+    if bloom_error_rate:
+        bloom = BloomFilter(len(values) * 2, bloom_error_rate)
+        bloom.update(values)
+    result = array("q")
+    result.frombytes(values.tobytes())
+    return result, bloom
+
+
+class SpammerIndex:
+    """
+    Process local set of spammer telegram IDs.
+    IDs are kept in sorted int64 array (8 bytes per ID), new IDs go to a small set
+    which is merged into the array when it grows over "merge_threshold".
+    Optional bloom filter answers "not a spammer" for most senders without search.
+    Incremental refresh reads rows changed since last cursor, deleted rows disappear
+    on the next full load
+    """
+
+    def __init__(self, bloom_error_rate: "Optional[float]" = 0.01, merge_threshold: int = 1024):
+        self.bloom_error_rate = bloom_error_rate
+        self.merge_threshold = merge_threshold
+        self._ids = array("q")
+        self._delta = set()
+        self._bloom = None
+        self.cursor: "Optional[datetime]" = None
+        self.loaded = False
+        self.lookups = 0
+        self.bloom_rejects = 0
+        self.hits = 0
+        self.last_load_duration = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._ids) + len(self._delta)
+
+    def __contains__(self, user_id: int) -> bool:
+        self.lookups += 1
+        if self._bloom is not None and user_id not in self._bloom:
+            self.bloom_rejects += 1
+            return False
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        found = i < len(ids) and ids[i] == user_id or user_id in self._delta
+        if found:
+            self.hits += 1
+        return found
+
+    def _build(self, ids: "array"):
+        self._ids, self._bloom = build_index(ids, self.bloom_error_rate)
+        self._delta = set()
+
+    def add(self, user_ids: "Iterable[int]"):
+        """
+        Add IDs without database, e.g. after import or ban
+        :param user_ids: iterable of int
+        :return:
+        """
+        for user_id in user_ids:
+            if user_id in self._delta:
+                continue
+            i = bisect_left(self._ids, user_id)
+            if i < len(self._ids) and self._ids[i] == user_id:
+                continue
+            self._delta.add(user_id)
+            if self._bloom is not None:
+                self._bloom.add(user_id)
+        if len(self._delta) > self.merge_threshold:
+            self._merge()
+
+    def _merge(self):
+        ids = array("q", merge(self._ids, sorted(self._delta)))
+        if self._bloom is not None and len(ids) > self._bloom.capacity:
+            self._build(ids)
+        else:
+            self._ids, self._delta = ids, set()
+
+    async def load(self):
+        """
+        Full reload, drops IDs deleted from database
+        :return:
+        """
+        async with self._lock:
+            started = time.monotonic()
+            # rows are streamed into int64 array, sorting and bloom filter don't block the loop
+            ids, cursor = await Spammers.get_ids()
+            loop = asyncio.get_running_loop()
+            ids, bloom = await loop.run_in_executor(None, build_index, ids, self.bloom_error_rate)
+            self._ids, self._delta, self._bloom = ids, set(), bloom
+            self.cursor = cursor
+            self.loaded = True
+            self.last_load_duration = time.monotonic() - started
+
+    async def refresh(self) -> int:
+        """
+        Read IDs changed since last cursor, loads everything on first call
+        :return: int, number of read rows
+        """
+        if not self.loaded:
+            await self.load()
+            return len(self)
+        async with self._lock:
+            ids, cursor = await Spammers.get_ids(self.cursor)
+            self.add(ids)
+            self.cursor = cursor
+        return len(ids)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "delta": len(self._delta),
+            "bytes": self._ids.itemsize * len(self._ids)
+            + (len(self._bloom.bits) if self._bloom is not None else 0),
+            "lookups": self.lookups,
+            "bloom_rejects": self.bloom_rejects,
+            "hits": self.hits,
+            "last_load_duration": self.last_load_duration,
+        }
@@ -61,6 +61,58 @@ with env.prefixed("TG_"):
     BETWEEN_GROUPS_REFRESH_COOLDOWN = env.int(
         "BETWEEN_GROUPS_REFRESH_COOLDOWN", required=True
     )
+    ADMIN_REFRESH_CONCURRENCY = env.int("ADMIN_REFRESH_CONCURRENCY", default=4)
+    REQUESTS_RATE = env.float("REQUESTS_RATE", default=10.0)
+    REQUESTS_BURST = env.float("REQUESTS_BURST", default=20.0)
+    MODERATION_CONCURRENCY = env.int("MODERATION_CONCURRENCY", default=8)
+    USERNAME_CACHE_SIZE = env.int("USERNAME_CACHE_SIZE", default=100000)
+    # released usernames can be taken by another account at once, keep mappings short
+    USERNAME_CACHE_TTL = env.int("USERNAME_CACHE_TTL", default=10 * 60)
+    USERNAME_FLUSH_PERIOD = env.int("USERNAME_FLUSH_PERIOD", default=60)
+    AUDIT_QUEUE_SIZE = env.int("AUDIT_QUEUE_SIZE", default=10000)
+    AUDIT_BATCH_SIZE = env.int("AUDIT_BATCH_SIZE", default=100)
+    AUDIT_FLUSH_INTERVAL = env.float("AUDIT_FLUSH_INTERVAL", default=0.5)
+    CHAT_SETTINGS_CACHE_TTL = env.int("CHAT_SETTINGS_CACHE_TTL", default=300)
+    CHAT_SETTINGS_NEGATIVE_TTL = env.int("CHAT_SETTINGS_NEGATIVE_TTL", default=60)
+    SPAM_STAGE_BUDGET = env.float("SPAM_STAGE_BUDGET", default=0.05)
+    SPAMMERS_REFRESH_PERIOD = env.int("SPAMMERS_REFRESH_PERIOD", default=60)
+    SPAMMERS_FULL_RELOAD_EVERY = env.int("SPAMMERS_FULL_RELOAD_EVERY", default=60)
+    SPAMMERS_BLOOM_ERROR_RATE = env.float("SPAMMERS_BLOOM_ERROR_RATE", default=0.01)
+    DUPLICATES_WINDOW = env.int("DUPLICATES_WINDOW", default=600)
+    DUPLICATES_MIN_CHATS = env.int("DUPLICATES_MIN_CHATS", default=3)
+    DUPLICATES_MIN_LENGTH = env.int("DUPLICATES_MIN_LENGTH", default=30)
+    DUPLICATES_CAPACITY = env.int("DUPLICATES_CAPACITY", default=100000)
+    DUPLICATES_SIMILARITY = env.float("DUPLICATES_SIMILARITY", default=0.6)
+    FLOOD_IDLE = env.int("FLOOD_IDLE", default=600)
+    EDIT_CACHE_CHATS = env.int("EDIT_CACHE_CHATS", default=1000)
+    EDIT_CACHE_MESSAGES = env.int("EDIT_CACHE_MESSAGES", default=200)
+    BLOCKLIST_CACHE_SIZE = env.int("BLOCKLIST_CACHE_SIZE", default=1000)
+    # 0 workers is number of cores, negative disables process pool
+    CPU_POOL_WORKERS = env.int("CPU_POOL_WORKERS", default=0)
+    CPU_POOL_PENDING_PER_WORKER = env.int("CPU_POOL_PENDING_PER_WORKER", default=2)
+    DUPLICATES_OFFLOAD_LENGTH = env.int("DUPLICATES_OFFLOAD_LENGTH", default=1000)
+    LOOP_LAG_INTERVAL = env.float("LOOP_LAG_INTERVAL", default=1)
+    STATS_PERIOD = env.int("STATS_PERIOD", default=60)
+    CLASSIFIER_MODEL_PATH = env.str(
+        "CLASSIFIER_MODEL_PATH", default=str(BASE_DIR.joinpath("model", "spam.npy"))
+    )
+    CLASSIFIER_BATCH_DELAY = env.float("CLASSIFIER_BATCH_DELAY", default=0.005)
+    CLASSIFIER_BATCH_SIZE = env.int("CLASSIFIER_BATCH_SIZE", default=64)
+    EVENT_WORKERS = env.int("EVENT_WORKERS", default=16)
+    EVENT_QUEUE_SIZE = env.int("EVENT_QUEUE_SIZE", default=10000)
+    EVENT_CHAT_QUEUE_SIZE = env.int("EVENT_CHAT_QUEUE_SIZE", default=1000)
+    # wait, drop_new or drop_oldest
+    EVENT_OVERFLOW = env.str("EVENT_OVERFLOW", default="drop_oldest")
+    # producers waiting for space with "wait" overflow, events of later ones are dropped
+    EVENT_MAX_WAITING = env.int("EVENT_MAX_WAITING", default=1000)
+    USERWARN_PARTITIONS_AHEAD = env.int("USERWARN_PARTITIONS_AHEAD", default=2)
+    USERWARN_RETENTION_MONTHS = env.int("USERWARN_RETENTION_MONTHS", default=12)
+    USERWARN_ARCHIVE_DIR = env.str(
+        "USERWARN_ARCHIVE_DIR", default=str(BASE_DIR.joinpath("archive"))
+    )
+    ADMIN_CACHE_TTL = env.int(
+        "ADMIN_CACHE_TTL", default=ADMIN_GROUPS_REFRESH_PERIOD * 60 * 2
+    )
     if TESTING:
         TEST_SERVER = env.str("TEST_SERVER", "")
         TEST_PORT = env.int("TEST_PORT", 0)
@@ -124,8 +124,13 @@ async def iter_participants(*args, **kwargs):
 
 def dummy_message():
     event = MagicMock()
+    event.is_private = False
+    event.chat_id = 1
     event.message = AsyncMock()
     event.message.text = '!test_command'
+    event.message.message = event.message.text
+    event.message.entities = None
+    event.message.media = None
     event.message.from_id = 1
     event.message.chat = MagicMock()
     event.message.chat.id = 1
@@ -142,13 +147,15 @@ def message_event():
     del event
 
 
-@pytest.fixture
-def patched_command():
+@pytest_asyncio.fixture
+async def patched_command():
     with unittest.mock.patch('guard_bot.bot.management.commands.start_bot.TelegramClient'):
         com = Command()
         com.client = AsyncMock()
         yield com
 
+        await com.dispatcher.close()
+        await com.audit.close()
         del com
 
 
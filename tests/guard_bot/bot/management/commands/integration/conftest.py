@@ -16,7 +16,28 @@ from telethon.tl.functions.messages import CreateChatRequest, ExportChatInviteRe
     ImportChatInviteRequest, MigrateChatRequest
 from telethon.tl.patched import MessageService
 
-from guard_bot.bot.management.commands.start_bot import Command
+from guard_bot.bot.audit import AuditWriter
+from guard_bot.bot.cache import AdminCache, ChatSettingsCache, MessageHashCache, UsernameCache
+from guard_bot.bot.classifier import BatchScorer
+from guard_bot.bot.dispatcher import ChatDispatcher
+from guard_bot.bot.domains import DomainBlocklist
+from guard_bot.bot.duplicates import NearDuplicateIndex
+from guard_bot.bot.flood import FloodDetector
+from guard_bot.bot.keywords import BlocklistCache
+from guard_bot.bot.locks import KeyedLock
+from guard_bot.bot.notify import PgListener
+from guard_bot.bot.spam import (
+    AdminStage,
+    BlocklistStage,
+    ClassifierStage,
+    DomainStage,
+    DuplicatesStage,
+    SpamPipeline,
+    SpammersStage,
+)
+from guard_bot.bot.spammers import SpammerIndex
+from guard_bot.bot.scheduler import RefreshScheduler, TokenBucket
+from guard_bot.bot.management.commands.start_bot import Command, CommandRegistry
 
 
 class PatchedTelegramClient(TelegramClient):
@@ -68,6 +89,35 @@ class PatchedCommand(Command):
     def __init__(self, *args, **kwargs):
         super(BaseCommand).__init__(*args, **kwargs)
         self.me = None
+        self.locks = KeyedLock()
+        self.requests_bucket = TokenBucket(settings.REQUESTS_RATE, settings.REQUESTS_BURST)
+        self.refresh_scheduler = RefreshScheduler(self.requests_bucket)
+        self.admin_cache = AdminCache(settings.ADMIN_CACHE_TTL)
+        self.usernames = UsernameCache(settings.USERNAME_CACHE_SIZE, settings.USERNAME_CACHE_TTL)
+        self.audit = AuditWriter(flush_interval=0)
+        self.chat_settings = ChatSettingsCache(settings.CHAT_SETTINGS_CACHE_TTL)
+        self.spammers = SpammerIndex()
+        self.listener = PgListener()
+        self.duplicates = NearDuplicateIndex()
+        self.domains = DomainBlocklist()
+        self.flood = FloodDetector()
+        self.slow_mode_restores = {}
+        self.blocklists = BlocklistCache(settings.BLOCKLIST_CACHE_SIZE)
+        self.executor = None
+        self.classifier = BatchScorer(settings.CLASSIFIER_MODEL_PATH)
+        self.message_hashes = MessageHashCache(settings.EDIT_CACHE_CHATS, settings.EDIT_CACHE_MESSAGES)
+        self.spam_pipeline = SpamPipeline(
+            [
+                AdminStage(self.admin_cache),
+                SpammersStage(self.spammers),
+                DomainStage(self.domains),
+                BlocklistStage(self.blocklists),
+                DuplicatesStage(self.duplicates),
+                ClassifierStage(self.classifier),
+            ]
+        )
+        self.dispatcher = ChatDispatcher()
+        self.commands = CommandRegistry(self)
 
     async def set_user(self):
         self.client = await get_telegram_user()
@@ -140,6 +190,8 @@ async def as_bot():
     await command.set_user()
     user = command.client
     yield user
+    await command.dispatcher.close()
+    await command.audit.close()
     if user.is_connected():
         await user.disconnect()
 
@@ -0,0 +1,71 @@
+import gzip
+import select
+
+import pytest
+from django.core.management import call_command, CommandError
+
+from guard_bot.bot.management.commands.import_spammers import IdStream
+from guard_bot.bot.models import SPAMMERS_CHANNEL, Spammers
+from guard_bot.bot.notify import PgListener
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_id_stream():
+    lines = ['telegram_id,comment\n', '1,spam\n', '"2",x\n', '3 text\n', '\n', '-4\n', '9' * 20 + '\n', '٣\n']
+    reports = []
+    stream = IdStream(iter(lines), report_every=2, report=lambda rows, elapsed: reports.append(rows))
+    assert stream.read(3) == '1\n2\n'
+    assert stream.read() == '3\n'
+    assert stream.read() == ''
+    assert (stream.rows, stream.invalid) == (3, 4)
+    assert reports == [2]
+
+
+def get_notifies(conn, timeout=5):
+    # notifications are delivered asynchronously
+    select.select([conn], [], [], timeout)
+    conn.poll()
+    notifies = [(x.channel, x.payload) for x in conn.notifies]
+    conn.notifies.clear()
+    return notifies
+
+
+def test_import_spammers(tmp_path, capsys):
+    Spammers.objects.create(telegram_id=1)
+    Spammers.objects.create(telegram_id=2, from_cas=True)
+    Spammers.objects.create(telegram_id=3, from_cas=True)
+    path = tmp_path / 'cas.csv.gz'
+    with gzip.open(path, 'wt') as file:
+        file.write('id,date\n1,2023\n2,2023\n4,2023\n4,2023\n5\nbroken\n')
+    listener = PgListener()
+    listener.subscribe(SPAMMERS_CHANNEL, print)
+    conn = listener._connect()
+    try:
+        call_command('import_spammers', str(path), cas=True, replace=True, report_every=2)
+        out = capsys.readouterr().out
+        assert 'Read 2 rows' in out and 'Read 4 rows' in out
+        assert 'Read 5 rows (2 invalid)' in out
+        assert 'Inserted 2, updated 1, deleted 1' in out
+        assert dict(Spammers.objects.values_list('telegram_id', 'from_cas')) == {
+            1: True, 2: True, 4: True, 5: True
+        }
+        assert get_notifies(conn) == [(SPAMMERS_CHANNEL, 'reload')]
+
+        # manual IDs are not replaced by CAS ones
+        path = tmp_path / 'manual.txt'
+        path.write_text('6\n1\n')
+        call_command('import_spammers', str(path), report_every=0)
+        assert 'Inserted 1, updated 0, deleted 0' in capsys.readouterr().out
+        assert Spammers.objects.get(telegram_id=1).from_cas
+        assert not Spammers.objects.get(telegram_id=6).from_cas
+        assert get_notifies(conn) == [(SPAMMERS_CHANNEL, 'reload')]
+
+        # nothing changed, nothing to reload
+        call_command('import_spammers', str(path))
+        assert get_notifies(conn, timeout=0.5) == []
+    finally:
+        conn.close()
+
+    with pytest.raises(CommandError):
+        call_command('import_spammers', str(tmp_path / 'missing.csv'))
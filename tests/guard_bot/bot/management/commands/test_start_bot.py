@@ -1,15 +1,23 @@
+import asyncio
+from datetime import timedelta
 import re
 import unittest.mock
 from collections import OrderedDict
 from unittest.mock import MagicMock, AsyncMock, call
 import pytest
 from telethon import types
-from telethon.errors import UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError, SecondsInvalidError
+from telethon.errors import UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError, SecondsInvalidError, \
+    FloodWaitError, ChatNotModifiedError
 
 from guard_bot.bot.management.commands.start_bot import TG_USER, DOG_USER, SHARP_USER, COMMAND, HOURS, MINUTES, DAYS, \
     USERS_LIST, PERIOD, USERS, USERS_AND_PERIOD, SLOW_MODE_VALUES, attr_setter, admin_check, Command, get_command, \
-    get_user_name, get_id_from_entity, Lock, USER_PERMS, USER_PERMS_MAPPING, USERS_AND_PERMS
-from guard_bot.bot.models import ChatAdmins, UserWarn, WarnType, ChatSettings
+    get_user_name, get_id_from_entity, USER_PERMS, USER_PERMS_MAPPING, USERS_AND_PERMS, COMMAND_PREFIX, \
+    NOT_COMMAND, CommandRegistry
+from guard_bot.bot.cache import AdminCache
+from guard_bot.bot.locks import KeyedLock
+from guard_bot.bot.scheduler import RefreshScheduler, TokenBucket
+from guard_bot.bot.models import ChatAdmins, UserWarn, WarnType, ChatSettings, AdminRights, Spammers
+from guard_bot.bot.spam import SpamContext, SpamResult, Verdict
 
 USERS_TXT_TEST = '@dog_user1 #12345678 [tg_user](tg://user?id=34535433) 1111112333 1233456gt comment'
 COMMAND_TXT_TEST = '!command ' + USERS_TXT_TEST
@@ -148,41 +156,70 @@ async def test_attr_setter():
 
 
 @pytest.mark.asyncio
-async def test_admin_check(chat_admin_can_ban, chat_admin_cant_ban):
+async def test_attr_setter_rejects_long_command():
+    method = AsyncMock()
+    decorated = attr_setter(attrs=USERS_AND_PERIOD_TEST)(method)
+
+    event = MagicMock()
+    event.message = AsyncMock()
+    event.message.text = '!ban' + ' #1' * 2000
+    event.message.chat.id = 1
+    assert await decorated(MagicMock(), event) is None
+    assert method.call_count == 0
+    assert event.message.reply.call_args_list == [call('wat?')]
+
+
+@pytest.mark.asyncio
+async def test_admin_check(patched_command, chat_admin_can_ban, chat_admin_cant_ban):
 
     @admin_check('can_ban')
     async def test_async_function(self, *args, **kwargs):
         return True
-    dummy_self = MagicMock()
-    dummy_self.self = 'self'
+
+    async def no_participants(*args, **kwargs):
+        for x in []:
+            yield x
+
+    patched_command.client.iter_participants = no_participants
     event = MagicMock()
     event.message.chat.id = 1
     event.message.sender.id = 1
     another_event = MagicMock()
     another_event.message.chat.id = 2
     another_event.message.sender.id = 2
+    cant_ban_event = MagicMock()
+    cant_ban_event.message.chat.id = 1
+    cant_ban_event.message.sender.id = 2
 
-    assert await test_async_function(dummy_self, event) is True
-    assert await test_async_function(dummy_self, another_event) is None
+    assert await test_async_function(patched_command, event) is True
+    assert await test_async_function(patched_command, another_event) is None
+    assert await test_async_function(patched_command, cant_ban_event) is None
+    assert patched_command.admin_cache.stats() == {'chats': 2, 'hits': 1, 'misses': 2}
+
+    await ChatAdmins.objects.filter(chat_id=1).adelete()
+    assert await test_async_function(patched_command, event) is True
+    patched_command.admin_cache.invalidate(1)
+    assert await test_async_function(patched_command, event) is None
 
 
 @pytest.mark.asyncio
-async def test_admin_check_for_first_sync(iter_participants):
+async def test_admin_check_for_first_sync(patched_command, iter_participants):
 
     @admin_check('can_add_admin')
     async def test_async_function(self, *args, **kwargs):
         return True
-    dummy_self = MagicMock()
-    dummy_self.self = 'self'
-    dummy_self.client = AsyncMock()
-    dummy_self.client.iter_participants = iter_participants
-    dummy_self.groups_memset = set()
+    patched_command.client.iter_participants = iter_participants
 
     creator_event = MagicMock()
     creator_event.message.chat.id = 1
     creator_event.message.sender.id = 7
+    admin_event = MagicMock()
+    admin_event.message.chat.id = 1
+    admin_event.message.sender.id = 4
 
-    assert await test_async_function(dummy_self, creator_event) is True
+    assert await test_async_function(patched_command, creator_event) is True
+    assert await test_async_function(patched_command, admin_event) is None
+    assert patched_command.admin_cache.get(1) == {7: AdminRights.CAN_ADD_ADMIN}
 
 
 @pytest.mark.asyncio
@@ -192,15 +229,35 @@ async def test_handle(event_loop):
         patched_object = patched_command()
         patched_object.handle = original_handle
         patched_object.handle(patched_object)
-        assert patched_object.loop.create_task.call_count == 2
+        assert patched_object.executor.start.call_count == 1
+        assert patched_object.loop.create_task.call_count == 7
         assert patched_object.loop.create_task.call_args_list == [
             call(patched_object.get_me(), name='get_me'),
             call(patched_object.refresh_admins_task(), name='refresh_admins'),
+            call(patched_object.usernames_task(), name='usernames'),
+            call(patched_object.listener.listen(), name='listener'),
+            call(patched_object.spammers_task(), name='spammers'),
+            call(patched_object.loop_lag.run(), name='loop_lag'),
+            call(patched_object.stats_task(), name='stats'),
         ]
         assert patched_object.refresh_admins_task.call_count == 2
         assert patched_object.refresh_admins_task.call_args_list == [call(), call()]
         assert patched_object.set_events.call_count == 1
         assert patched_object.client.run_until_disconnected.call_count == 1
+        assert patched_object.shutdown.call_count == 1
+        assert patched_object.loop.run_until_complete.call_args == call(patched_object.shutdown())
+
+
+@pytest.mark.asyncio
+async def test_stats_task(patched_command, caplog):
+    caplog.set_level('INFO', logger='asyncio')
+    with unittest.mock.patch(
+            'guard_bot.bot.management.commands.start_bot.asyncio.sleep', side_effect=[None, asyncio.CancelledError]
+    ):
+        with pytest.raises(asyncio.CancelledError):
+            await patched_command.stats_task()
+    logged = [x.getMessage().split(':')[0] for x in caplog.records]
+    assert logged == ['Event loop lag', 'Dispatcher', 'Spam pipeline', 'Message hashes', 'Process pool']
 
 
 @pytest.mark.asyncio
@@ -220,11 +277,13 @@ async def test_refresh_admins_for_chat(chat_admin_can_ban, chat_admin_cant_ban,
         com = Command()
         com.client = AsyncMock()
         com.client.iter_participants = iter_participants
-        com.groups_memset = set()
+        com.locks = KeyedLock()
+        com.admin_cache = AdminCache(60)
 
         chat_id = 1
         chat_admins = await ChatAdmins.get_admins_by_chat(chat_id=chat_id)
         await com.refresh_admins_for_chat(chat_id=1, db_admins=chat_admins[chat_id])
+        assert com.admin_cache.get(chat_id) == {3: 1, 4: 3, 5: 2, 6: 0, 7: 7}
         qs = ChatAdmins.objects.filter(chat_id=chat_id)
         assert await qs.acount() == 5
         assert [x async for x in qs.values_list('user_id', flat=True)] == [3, 4, 5, 6, 7]
@@ -232,20 +291,11 @@ async def test_refresh_admins_for_chat(chat_admin_can_ban, chat_admin_cant_ban,
         assert [x async for x in qs.filter(can_delete=True).values_list('user_id', flat=True)] == [3, 4, 7]
         assert [x async for x in qs.filter(can_add_admin=True).values_list('user_id', flat=True)] == [7]
 
-        class PatchedLock(Lock):
-            async def __aenter__(self):
-                locked = await self._acquire_lock()
-                if locked:
-                    return self
-                raise Exception("Patched for test")
-
-        with unittest.mock.patch('guard_bot.bot.management.commands.start_bot.Lock', PatchedLock):
-            async with Lock(com.groups_memset, obj_id=chat_id):
-                with pytest.raises(Exception, match='Patched for test'):
-                    await com.refresh_admins_for_chat(chat_id=1, db_admins=chat_admins[chat_id])
-        async with Lock(com.groups_memset, obj_id=chat_id):
+        async with com.locks.acquire(('refresh_admins', chat_id)):
             await com.refresh_admins_for_chat(chat_id=1, db_admins=chat_admins[chat_id])
             assert f"Reloading admins for chat {chat_id}. Already locked by another coroutine" in caplog.messages
+        assert len(com.locks) == 0
+        assert com.locks.stats()['keys'][('refresh_admins', chat_id)]['timeouts'] == 1
 
 
 @pytest.mark.asyncio
@@ -256,9 +306,11 @@ async def test__refresh_admins_task(chat_admin_can_ban, chat_admin_cant_ban, ano
         with unittest.mock.patch(
                 'guard_bot.bot.management.commands.start_bot.Command.refresh_admins_for_chat') as mock:
             com = Command()
+            com.refresh_scheduler = RefreshScheduler(TokenBucket(100), concurrency=2)
             await com._refresh_admins_task()
             assert mock.call_count == 2
             assert mock.call_args_list == [call(1, {1, 2}), call(2, {3})]
+            assert com.refresh_scheduler.stats()['chats'] == 2
 
 
 @pytest.mark.asyncio
@@ -297,13 +349,38 @@ def test_set_events(patched_command):
         patched_command = Command()
         patched_command.client = MagicMock()
         patched_command.set_events()
-        assert patched_command.client.add_event_handler.call_count == 2
+        assert patched_command.client.add_event_handler.call_count == 4
         assert patched_command.client.add_event_handler.call_args_list == [
-            call(patched_command.on_new_message, events.NewMessage(incoming=True)),
-            call(patched_command.on_edit_message, events.MessageEdited(incoming=True)),
+            call(patched_command.run_command, events.NewMessage(incoming=True, pattern=COMMAND_PREFIX)),
+            call(patched_command.queue_new_message, events.NewMessage(incoming=True, pattern=NOT_COMMAND)),
+            call(patched_command.queue_edit_message, events.MessageEdited(incoming=True)),
+            call(patched_command.on_chat_action, events.ChatAction()),
         ]
 
 
+def test_command_filters():
+    assert COMMAND_PREFIX.match('!ban @user').group(1) == 'ban'
+    assert COMMAND_PREFIX.match('! ban').group(1) == ''
+    assert COMMAND_PREFIX.match('ban') is None
+    assert NOT_COMMAND.match('!ban') is None
+    assert NOT_COMMAND.match('hello !ban')
+    assert NOT_COMMAND.match('')
+
+
+def test_command_registry(patched_command):
+    registry = patched_command.commands
+    assert sorted(registry.handlers) == [
+        'ban', 'dwarn', 'freeze', 'kick', 'mute', 'off', 'on', 'refresh_admins', 'sban', 'skick', 'smute',
+        'unban', 'unfreeze', 'unmute', 'unwarn', 'warn']
+    assert registry.handlers['ban'] == patched_command.ban
+    with pytest.raises(TypeError):
+        registry.handlers['spam'] = patched_command.spam
+    assert registry.get('ban') == patched_command.ban
+    assert registry.get('spam') is None
+    assert registry.get('get_me') is None
+    assert registry.stats() == {'ban': 1, '?': 2}
+
+
 def test_get_command():
     assert get_command('!run baby run') == 'run'
     assert get_command('! run baby run') == ''
@@ -313,30 +390,140 @@ def test_get_command():
 @pytest.mark.asyncio
 async def test_run_command(message_event, patched_command):
     patched_command.test_command = AsyncMock()
+    patched_command.commands.handlers = {'test_command': patched_command.test_command}
+    message_event.pattern_match = COMMAND_PREFIX.match(message_event.message.text)
     await patched_command.run_command(message_event)
     assert patched_command.test_command.call_count == 1
     assert patched_command.test_command.call_args_list == [call(message_event)]
 
-    message_event.message.text = '!not_existing_command'
+    message_event.pattern_match = COMMAND_PREFIX.match('!not_existing_command')
     await patched_command.run_command(message_event)
     assert message_event.message.reply.call_count == 1
     assert message_event.message.reply.call_args_list == [call('wat?')]
 
 
 @pytest.mark.asyncio
-async def test_spam_check(patched_command):
-    assert await patched_command.spam_check(None) is None
+async def test_spam_check(patched_command, message_event):
+    message_event.message.id = 10
+    message_event.message.message = 'spam'
+    # chats opt in
+    assert await patched_command.spam_check(message_event) is None
+    assert patched_command.spam_pipeline.stats()['messages'] == 0
+    await ChatSettings.objects.acreate(chat_id=1, spam_check=True)
+    patched_command.chat_settings.invalidate()
+    assert await patched_command.spam_check(message_event) is None
+    assert patched_command.spam_pipeline.stats()['messages'] == 1
+
+    await Spammers.objects.acreate(telegram_id=message_event.message.sender.id)
+    result = await patched_command.spam_check(message_event)
+    assert result == SpamResult(Verdict.BAN, 'spammers', 'known spammer')
+    assert patched_command.client.delete_messages.call_args == call(1, message_ids=10)
+    assert patched_command.client.edit_permissions.call_args == call(1, 1, view_messages=False)
+    await patched_command.audit.flush()
+    assert [x async for x in UserWarn.objects.order_by('id').values_list('warn_type', 'comment')] == [
+        (WarnType.SPAM, 'spammers: known spammer'),
+        (WarnType.BAN, 'spammers: known spammer'),
+    ]
+
+    # admins are not checked
+    patched_command.admin_cache.set(1, {1: int(AdminRights.CAN_BAN)})
+    assert await patched_command.spam_check(message_event) == SpamResult(Verdict.CLEAN, 'admin')
+    patched_command.admin_cache.invalidate()
+
+    await ChatSettings.objects.filter(chat_id=1).aupdate(spam_check=False)
+    patched_command.chat_settings.invalidate()
+    assert await patched_command.spam_check(message_event) is None
+
+    # users can't be restricted in private chats
+    message_event.is_private = True
+    assert await patched_command.flood_check(message_event) is False
+    await ChatSettings.objects.filter(chat_id=1).aupdate(spam_check=True)
+    patched_command.chat_settings.invalidate()
+    messages = patched_command.spam_pipeline.stats()['messages']
+    assert await patched_command.spam_check(message_event) is None
+    assert patched_command.spam_pipeline.stats()['messages'] == messages
+
+    message_event.message.sender = None
+    assert await patched_command.spam_check(message_event) is None
+
+
+@pytest.mark.asyncio
+async def test_spam_check_edit(patched_command, message_event):
+    message_event.message.id = 10
+    message_event.message.message = 'text'
+    await ChatSettings.objects.acreate(chat_id=1, spam_check=True)
+    await patched_command.spam_check(message_event)
+    # reaction or link preview
+    message_event.message.media = types.MessageMediaWebPage(webpage=types.WebPageEmpty(id=1))
+    await patched_command.on_edit_message(message_event)
+    assert patched_command.spam_pipeline.stats()['messages'] == 1
+
+    message_event.message.message = 'spam'
+    await patched_command.on_edit_message(message_event)
+    await patched_command.on_edit_message(message_event)
+    assert patched_command.spam_pipeline.stats()['messages'] == 2
+    assert patched_command.message_hashes.stats() == {
+        'chats': 1, 'messages': 1, 'hits': 2, 'misses': 1, 'hit_rate': 2 / 3
+    }
+
+
+@pytest.mark.asyncio
+async def test_on_chat_action(patched_command):
+    await Spammers.objects.acreate(telegram_id=2)
+    await ChatSettings.objects.acreate(chat_id=1, spam_check=True)
+    await ChatSettings.objects.acreate(chat_id=3, spam_check=False)
+    await patched_command.spammers.load()
+    # marked id of supergroup, settings and records use the bare one
+    event = MagicMock(user_joined=True, user_added=False, is_group=True, chat_id=-1000000000001, user_ids=[1, 2])
+    event.get_chat = AsyncMock(return_value=MagicMock(id=1))
+    event.action_message.id = 10
+    await patched_command.on_chat_action(event)
+    assert patched_command.client.delete_messages.call_args_list == [call(1, message_ids=10)]
+    assert patched_command.client.edit_permissions.call_args_list == [call(1, 2, view_messages=False)]
+    await patched_command.audit.flush()
+    assert await UserWarn.objects.filter(chat_id=1, user_id=2, warn_type=WarnType.BAN).aexists()
+
+    event.user_joined = False
+    await patched_command.on_chat_action(event)
+    event.user_joined, event.is_group = True, False
+    await patched_command.on_chat_action(event)
+    event.is_group = True
+    event.get_chat.return_value = MagicMock(id=3)
+    await patched_command.on_chat_action(event)
+    assert patched_command.client.edit_permissions.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_apply_verdict(patched_command, message_event):
+    await ChatSettings.objects.acreate(chat_id=1, warn_count=2)
+    context = SpamContext(event=message_event, chat_id=1, user_id=2, message_id=10, text='spam')
+
+    await patched_command.apply_verdict(context, SpamResult(Verdict.DELETE, 'test'))
+    assert patched_command.client.delete_messages.call_args == call(1, message_ids=10)
+    assert patched_command.client.edit_permissions.call_count == 0
+
+    await patched_command.apply_verdict(context, SpamResult(Verdict.WARN, 'test', 'reason'))
+    assert patched_command.client.edit_permissions.call_count == 0
+    await patched_command.apply_verdict(context, SpamResult(Verdict.WARN, 'test', 'reason'))
+    assert patched_command.client.edit_permissions.call_args == call(
+        1, 2, until_date=timedelta(days=1), send_messages=False)
+
+    patched_command.client.delete_messages.side_effect = ChatAdminRequiredError(None)
+    await patched_command.apply_verdict(context, SpamResult(Verdict.BAN, 'test'))
+    assert patched_command.client.edit_permissions.call_count == 1
+
+    await patched_command.audit.flush()
+    assert sorted([x async for x in UserWarn.objects.values_list('warn_type', flat=True)]) == [
+        WarnType.WARN, WarnType.WARN, WarnType.MUTE, WarnType.SPAM, WarnType.SPAM, WarnType.SPAM
+    ]
 
 
 @pytest.mark.asyncio
 async def test_on_new_message(message_event, patched_command):
     patched_command.run_command, patched_command.spam_check = AsyncMock(), AsyncMock()
-    await patched_command.on_new_message(message_event)
-    assert patched_command.run_command.call_count == 1
-    assert patched_command.run_command.call_args_list == [call(message_event)]
-
     message_event.message.text = 'not command'
     await patched_command.on_new_message(message_event)
+    assert patched_command.run_command.call_count == 0
     assert patched_command.spam_check.call_count == 1
     assert patched_command.spam_check.call_args_list == [call(message_event)]
 
@@ -346,7 +533,19 @@ async def test_on_edit_message(message_event, patched_command):
     patched_command.spam_check = AsyncMock()
     await patched_command.on_edit_message(message_event)
     assert patched_command.spam_check.call_count == 1
-    assert patched_command.spam_check.call_args_list == [call(message_event)]
+    assert patched_command.spam_check.call_args_list == [call(message_event, is_edit=True)]
+
+
+@pytest.mark.asyncio
+async def test_queue_messages(message_event, patched_command):
+    calls = []
+    patched_command.on_new_message = AsyncMock(side_effect=lambda x: calls.append('new'))
+    patched_command.on_edit_message = AsyncMock(side_effect=lambda x: calls.append('edit'))
+    await patched_command.queue_new_message(message_event)
+    await patched_command.queue_edit_message(message_event)
+    await patched_command.dispatcher.join()
+    assert calls == ['new', 'edit']
+    assert patched_command.dispatcher.stats()['processed'] == 2
 
 
 def test_get_user_name():
@@ -387,6 +586,24 @@ async def test_get_user_id(patched_command):
     assert await patched_command.get_user_id(types.InputPeerChat(chat_id=4)) == 4
 
 
+@pytest.mark.asyncio
+async def test_get_user_id_cached(patched_command, message_event):
+    patched_command.client.get_input_entity = AsyncMock(return_value=types.InputPeerUser(user_id=5, access_hash=0))
+    assert await patched_command.get_user_id('@User') == 5
+    assert await patched_command.get_user_id('@user') == 5
+    assert patched_command.client.get_input_entity.call_count == 1
+
+    message_event.message.sender = types.User(id=6, username='Sender')
+    await patched_command.on_new_message(message_event)
+    assert await patched_command.get_user_id('@sender') == 6
+    assert patched_command.client.get_input_entity.call_count == 1
+
+    await patched_command.usernames.flush()
+    patched_command.usernames.memory.clear()
+    assert await patched_command.get_user_id('@sender') == 6
+    assert patched_command.client.get_input_entity.call_count == 1
+
+
 def exc():
     exceptions = (UserAdminInvalidError, ChatAdminRequiredError, UserIdInvalidError)
     for exception in exceptions:
@@ -437,6 +654,38 @@ async def test__mute_or_ban(patched_command, message_event, parsed_message):
            'Reason: comment'
 
 
+@pytest.mark.asyncio
+async def test__mute_or_ban_concurrent(patched_command, message_event, parsed_message, settings):
+    settings.MODERATION_CONCURRENCY = 2
+    running, max_running = 0, 0
+
+    async def edit_permissions(chat_id, user_id, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01 if user_id % 2 else 0.02)
+        running -= 1
+        if user_id == 3:
+            error = FloodWaitError(request=None, capture=0)
+            error.seconds = 0
+            raise error
+
+    patched_command.client.edit_permissions = edit_permissions
+    parsed_message['users'] = [str(x) for x in range(1, 7)]
+    parsed_message['days'] = parsed_message['hours'] = parsed_message['minutes'] = 0
+    assert await patched_command._mute_or_ban(message_event, **parsed_message) == \
+           'User [1](tg://user?id=1) muted\n' \
+           'User [2](tg://user?id=2) muted\n' \
+           'User [3](tg://user?id=3) not muted\n' \
+           'User [4](tg://user?id=4) muted\n' \
+           'User [5](tg://user?id=5) muted\n' \
+           'User [6](tg://user?id=6) muted\n' \
+           'Reason: comment'
+    assert max_running == 2
+    await patched_command.audit.flush()
+    assert await UserWarn.objects.filter(warn_type=WarnType.MUTE).acount() == 5
+
+
 @pytest.mark.asyncio
 async def test_ban(patched_command, message_event, chat_admin_can_ban):
     message_event.message.text = '!ban #123 #456 comment'
@@ -447,6 +696,27 @@ async def test_ban(patched_command, message_event, chat_admin_can_ban):
     assert patched_command.client.send_message.call_args == call(message_event.message.chat.id, message=result)
 
 
+@pytest.mark.asyncio
+async def test_ban_unknown_user(patched_command, message_event, chat_admin_can_ban):
+    message_event.message.text = '!ban @ghost #123 comment'
+    patched_command.client.get_input_entity.side_effect = ValueError('No user has "ghost" as username')
+    await patched_command.ban(message_event)
+    result = 'User @ghost not found\n' \
+             'User [123](tg://user?id=123) banned\n' \
+             'Reason: comment'
+    assert patched_command.client.send_message.call_args == call(message_event.message.chat.id, message=result)
+    assert patched_command.client.edit_permissions.call_count == 1
+    message_event.message.delete.assert_called_once()
+
+    patched_command.client.get_input_entity.side_effect = FloodWaitError(None, capture=5)
+    message_event.message.text = '!unwarn @ghost'
+    await patched_command.unwarn(message_event)
+    assert patched_command.client.send_message.call_args == call(
+        message_event.message.chat.id, message='User @ghost not found\n'
+    )
+    assert patched_command.requests_bucket.paused_until > 0
+
+
 @pytest.mark.asyncio
 async def test_sban(patched_command, message_event, chat_admin_can_ban, parsed_ban_message):
     message_event.message.text = '!sban #123 #456 comment'
@@ -503,6 +773,7 @@ async def test__kick(patched_command, parsed_message, message_event):
 
     assert await patched_command._kick(message_event, **parsed_message) == \
            'User [123](tg://user?id=123) kicked\nUser [456](tg://user?id=456) kicked\nReason: comment'
+    await patched_command.audit.flush()
     assert await UserWarn.objects.filter(
         chat_id=parsed_message['chat_id'], user_id=123, warn_type=WarnType.KICK).acount() == 1
     assert await UserWarn.objects.filter(
@@ -560,6 +831,7 @@ async def test__warn(patched_command, message_event, chat_admin_can_ban):
         result = await patched_command._warn(
             message_event, message_event.message.chat.id, users=['123', '456'], comment='comment')
 
+    await patched_command.audit.flush()
     assert await UserWarn.objects.filter(
                 chat_id=message_event.message.chat.id, user_id=123, warn_type=WarnType.WARN, comment='comment'
     ).acount() == chat_settings.warn_count + 1
@@ -647,6 +919,7 @@ async def test_unwarn(patched_command, message_event, chat_admin_can_ban):
 
     message_event.message.text = '!warn #123 #456 warn'
     await patched_command.warn(message_event)
+    await patched_command.audit.flush()
     assert await UserWarn.objects.filter(
         chat_id=message_event.message.chat.id, user_id=123, comment='warn').acount() == 1
     assert await UserWarn.objects.filter(
@@ -661,7 +934,16 @@ async def test_unwarn(patched_command, message_event, chat_admin_can_ban):
         chat_id=message_event.message.chat.id, user_id=456, comment='warn').acount() == 1
     assert patched_command.client.send_message.call_args == call(
         message_event.message.chat.id,
-        message='User warnings was delete for [123](tg://user?id=123). Current count: 0\nReason: unwarn'
+        message='User warnings was delete for [123](tg://user?id=123). Deleted: 1\nReason: unwarn'
+    )
+
+    message_event.message.text = '!unwarn #123 #456 #789'
+    await patched_command.unwarn(message_event)
+    assert patched_command.client.send_message.call_args == call(
+        message_event.message.chat.id,
+        message='User warnings was delete for [123](tg://user?id=123). Deleted: 0\n'
+                'User warnings was delete for [456](tg://user?id=456). Deleted: 1\n'
+                'User warnings was delete for [789](tg://user?id=789). Deleted: 0\n'
     )
 
 
@@ -833,4 +1115,96 @@ async def test_off(patched_command, message_event, chat_admin_can_ban):
         message='User perms for [123](tg://user?id=123) restricted: message,gif,poll\n'
                 'User perms for [456](tg://user?id=456) restricted: message,gif,poll\n'
                 'Reason: comment'
-    )
\ No newline at end of file
+    )
+
+@pytest.mark.asyncio
+async def test_on_spammers_notify(patched_command):
+    patched_command.loop = MagicMock()
+    patched_command.spammers = MagicMock()
+    patched_command.on_spammers_notify('refresh')
+    patched_command.on_spammers_notify('reload')
+    assert patched_command.loop.create_task.call_args_list == [
+        call(patched_command.spammers.refresh(), name='spammers_refresh'),
+        call(patched_command.spammers.load(), name='spammers_load'),
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_flood_check(patched_command, message_event):
+    await ChatSettings.objects.acreate(
+        chat_id=1, flood_user_limit=2, flood_chat_limit=2, flood_mute_period=timedelta(hours=25)
+    )
+    # marked id of supergroup, everything is keyed by the bare one
+    message_event.chat_id = -1000000000001
+    message_event.message.is_reply = True
+    patched_command.spam_check = AsyncMock()
+    patched_command.flood_slow_mode = AsyncMock()
+    patched_command.admin_cache.set(1, {5: 0})
+    message_event.message.sender = types.User(id=5)
+    for _ in range(5):
+        await patched_command.on_new_message(message_event)
+    assert patched_command.spam_check.call_count == 5
+    assert patched_command.admin_cache.stats() == {'chats': 1, 'hits': 0, 'misses': 0}
+
+    message_event.message.sender = types.User(id=2)
+    for _ in range(2):
+        await patched_command.on_new_message(message_event)
+    patched_command.flood_slow_mode.assert_not_called()
+    await patched_command.on_new_message(message_event)
+    assert patched_command.spam_check.call_count == 7
+    # replied message author is not muted
+    patched_command.client.get_messages.assert_not_called()
+    assert patched_command.client.edit_permissions.call_args == \
+        call(1, 2, until_date=timedelta(days=1, hours=1), send_messages=False)
+    assert patched_command.flood_slow_mode.call_args.args[0] == 1
+    assert patched_command.client.send_message.call_count == 1
+    message_event.message.delete.assert_called_once()
+    await patched_command.audit.flush()
+    assert await UserWarn.objects.filter(user_id=2, warn_type=WarnType.MUTE, comment='flood').aexists()
+
+
+@pytest.mark.asyncio
+async def test_flood_slow_mode(patched_command):
+    chat_settings = ChatSettings(chat_id=1, flood_slow_mode_period=timedelta(seconds=0.01))
+    patched_command.loop = asyncio.get_running_loop()
+    patched_command.client.return_value = MagicMock(full_chat=MagicMock(slowmode_seconds=0))
+    with unittest.mock.patch('guard_bot.bot.management.commands.start_bot.ToggleSlowModeRequest') as request:
+        await patched_command.flood_slow_mode(1, chat_settings)
+        task = patched_command.slow_mode_restores[1]
+        # flood goes on, slow mode is on already
+        await patched_command.flood_slow_mode(1, chat_settings)
+        assert request.call_args_list == [call(channel=1, seconds=30)]
+        await task
+        assert request.call_args_list == [call(channel=1, seconds=30), call(channel=1, seconds=0)]
+    assert patched_command.slow_mode_restores == {}
+    assert patched_command.client.send_message.call_args_list == [
+        call(1, message='Slow mode on.'), call(1, message='Slow mode off.')
+    ]
+
+    # slow mode set by admins is not touched
+    patched_command.client.reset_mock()
+    patched_command.client.return_value = MagicMock(full_chat=MagicMock(slowmode_seconds=60))
+    await patched_command.flood_slow_mode(1, chat_settings)
+    assert patched_command.client.call_count == 1
+    assert patched_command.slow_mode_restores == {}
+
+    patched_command.client.return_value = MagicMock(full_chat=MagicMock(slowmode_seconds=0))
+    with unittest.mock.patch(
+            'guard_bot.bot.management.commands.start_bot.ToggleSlowModeRequest',
+            side_effect=ChatNotModifiedError(request=None)
+    ):
+        await patched_command.flood_slow_mode(1, chat_settings)
+    assert patched_command.slow_mode_restores == {}
+    patched_command.client.send_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_reload_domains(patched_command):
+    patched_command.loop = MagicMock()
+    patched_command.domains = MagicMock()
+    patched_command.reload_domains('1')
+    patched_command.reload_domains()
+    assert patched_command.loop.create_task.call_args_list == [
+        call(patched_command.domains.reload(), name='domains_reload'),
+    ] * 2
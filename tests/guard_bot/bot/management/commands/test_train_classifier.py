@@ -0,0 +1,63 @@
+import select
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+
+from guard_bot.bot.classifier import NaiveBayes
+from guard_bot.bot.models import CLASSIFIER_CHANNEL, UserWarn, WarnType
+from guard_bot.bot.notify import PgListener
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_train_classifier(tmp_path, capsys, settings):
+    output = tmp_path / 'spam.npy'
+    settings.CLASSIFIER_MODEL_PATH = str(output)
+    spam = UserWarn.objects.create(
+        chat_id=1, user_id=1, warn_type=WarnType.SPAM, comment='blocklist: x', text='earn from home, write me'
+    )
+    UserWarn.objects.create(
+        chat_id=1, user_id=2, warn_type=WarnType.SPAM, comment='classifier: 0.99', text='meeting on friday'
+    )
+    UserWarn.objects.create(chat_id=1, user_id=3, warn_type=WarnType.SPAM, comment='duplicates')
+    with pytest.raises(CommandError):
+        call_command('train_classifier', output=str(output), bits=12)
+
+    ham = tmp_path / 'ham.txt'
+    ham.write_text('see you on friday\n\n')
+    # deleted by mistake, user was unbanned later
+    reversed_spam = UserWarn.objects.create(
+        chat_id=1, user_id=4, warn_type=WarnType.SPAM, comment='domains', text='friday meeting notes'
+    )
+    UserWarn.objects.filter(pk=reversed_spam.pk).update(created=timezone.now() - timedelta(hours=1))
+    UserWarn.objects.create(chat_id=1, user_id=4, warn_type=WarnType.UNBAN)
+
+    listener = PgListener()
+    listener.subscribe(CLASSIFIER_CHANNEL, print)
+    conn = listener._connect()
+    try:
+        # too few messages for the default minimum
+        with pytest.raises(CommandError):
+            call_command('train_classifier', output=str(output), bits=12, ham=[str(ham)])
+        # bots load the model from settings only
+        other = tmp_path / 'other.npy'
+        call_command('train_classifier', output=str(other), bits=12, ham=[str(ham)], min_documents=1)
+        assert 'Running bots are not notified' in capsys.readouterr().out
+        assert other.exists()
+        call_command('train_classifier', bits=12, ham=[str(ham)], min_documents=1)
+        # notification is delivered asynchronously
+        select.select([conn], [], [], 5)
+        conn.poll()
+        assert [(x.channel, x.payload) for x in conn.notifies] == [(CLASSIFIER_CHANNEL, str(output))]
+    finally:
+        conn.close()
+    out = capsys.readouterr().out
+    assert 'Trained on 1 spam and 2 ham messages' in out
+    assert 'not notified' not in out
+    model = NaiveBayes.load(output)
+    assert model.score(spam.text) > 0.5 > model.score('meeting on friday')
+
+    with pytest.raises(CommandError):
+        call_command('train_classifier', output=str(output), bits=40)
@@ -0,0 +1,64 @@
+import gzip
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command, CommandError
+from django.utils import timezone
+
+from guard_bot.bot.models import UserWarn, WarnType, ChatSettings
+from guard_bot.bot.partitions import create_partition, list_partitions, month_start, partition_for
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_userwarn_partitions(tmp_path):
+    table = UserWarn._meta.db_table
+    now = timezone.now()
+    old = now - timedelta(days=200)
+    warn = UserWarn.objects.create(chat_id=1, user_id=1, warn_type=WarnType.WARN, comment='archived')
+    UserWarn.objects.filter(pk=warn.pk).update(created=old)
+    create_partition(table, partition_for(table, old))
+    UserWarn.objects.create(chat_id=1, user_id=1, warn_type=WarnType.WARN, comment='hot')
+    # written before partitioning, stays in default partition
+    default_warn = UserWarn.objects.create(chat_id=1, user_id=1, warn_type=WarnType.WARN, comment='default')
+    UserWarn.objects.filter(pk=default_warn.pk).update(created=now - timedelta(days=400))
+
+    # failed archive keeps partition attached for the next run
+    with patch(
+        'guard_bot.bot.management.commands.userwarn_partitions.archive_partition',
+        side_effect=OSError('No space left on device'),
+    ):
+        with pytest.raises(OSError):
+            call_command('userwarn_partitions', ahead=4, retention=1, archive_dir=str(tmp_path))
+    assert partition_for(table, old) in list_partitions(table)
+    assert UserWarn.objects.filter(pk=warn.pk).exists()
+
+    call_command('userwarn_partitions', ahead=4, retention=1, archive_dir=str(tmp_path))
+
+    names = [x.name for x in list_partitions(table)]
+    assert partition_for(table, old).name not in names
+    for months in range(5):
+        assert partition_for(table, month_start(now, months)).name in names
+    assert all(x.end > month_start(now, -1) for x in list_partitions(table))
+    assert list(UserWarn.objects.values_list('comment', flat=True)) == ['hot']
+
+    with gzip.open(tmp_path / f'{partition_for(table, old).name}.csv.gz', 'rt') as file:
+        rows = file.read().splitlines()
+    assert rows[0] == 'id,created,user_id,chat_id,comment,warn_type,text'
+    assert rows[1].startswith(f'{warn.pk},') and rows[1].endswith(',1,1,archived,1,')
+    default_archive, = tmp_path.glob(f'{table}_default_*.csv.gz')
+    with gzip.open(default_archive, 'rt') as file:
+        rows = file.read().splitlines()
+    assert len(rows) == 2 and rows[1].startswith(f'{default_warn.pk},')
+
+    # repeated run changes nothing
+    call_command('userwarn_partitions', ahead=4, retention=1, archive_dir=str(tmp_path))
+    assert [x.name for x in list_partitions(table)] == names
+    assert len(list(tmp_path.glob(f'{table}_default_*'))) == 1
+
+
+def test_userwarn_partitions_retention_check(tmp_path):
+    ChatSettings.objects.create(chat_id=1, warn_counter_period=timedelta(days=90))
+    with pytest.raises(CommandError):
+        call_command('userwarn_partitions', retention=1, archive_dir=str(tmp_path))
@@ -0,0 +1,66 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from guard_bot.bot.audit import AuditWriter
+from guard_bot.bot.models import UserWarn, WarnType
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_audit_writer_batches():
+    writer = AuditWriter(maxsize=100, batch_size=3, flush_interval=10)
+    for user_id in range(3):
+        await writer.write(chat_id=1, user_id=user_id, warn_type=WarnType.WARN, comment='spam')
+    # full batch is written without waiting for interval
+    for _ in range(10):
+        if writer.written == 3:
+            break
+        await asyncio.sleep(0.05)
+    assert writer.written == 3
+    assert writer.last_batch_size == 3
+
+    await writer.write(chat_id=1, user_id=10, warn_type=WarnType.BAN)
+    assert await UserWarn.objects.filter(user_id=10).acount() == 0
+    await writer.flush()
+    assert await UserWarn.objects.filter(user_id=10, warn_type=WarnType.BAN).acount() == 1
+    assert await UserWarn.objects.filter(chat_id=1, comment='spam').acount() == 3
+
+    stats = writer.stats()
+    assert stats['depth'] == 0
+    assert stats['enqueued'] == 4
+    assert stats['written'] == 4
+    assert stats['failed'] == 0
+    assert stats['last_batch_size'] == 1
+    await writer.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_audit_writer_close():
+    writer = AuditWriter(batch_size=100, flush_interval=10)
+    await writer.flush()
+    for user_id in range(5):
+        await writer.write(chat_id=2, user_id=user_id, warn_type=WarnType.KICK)
+    await writer.close()
+    assert await UserWarn.objects.filter(chat_id=2).acount() == 5
+    assert writer._task is None
+    with pytest.raises(RuntimeError):
+        await writer.write(chat_id=2, user_id=1, warn_type=WarnType.KICK)
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_audit_writer_failed_batch():
+    writer = AuditWriter(flush_interval=0)
+    with patch.object(UserWarn.objects, 'abulk_create', side_effect=Exception('db is down')):
+        await writer.write(chat_id=3, user_id=1, warn_type=WarnType.WARN)
+        await writer.flush()
+    assert writer.stats()['failed'] == 1
+    assert writer.stats()['written'] == 0
+
+    await writer.write(chat_id=3, user_id=2, warn_type=WarnType.WARN)
+    await writer.close()
+    assert writer.stats()['written'] == 1
+    assert await UserWarn.objects.filter(chat_id=3).acount() == 1
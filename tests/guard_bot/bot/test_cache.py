@@ -0,0 +1,143 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+import pytest
+from django.utils import timezone
+
+from guard_bot.bot.cache import AdminCache, ChatSettingsCache, LRUCache, MessageHashCache, UsernameCache
+from guard_bot.bot.models import ChatSettings, TelegramUsername
+
+
+def test_admin_cache():
+    cache = AdminCache(ttl=10)
+    assert cache.get(1) is None
+    cache.set(1, {1: 7})
+    assert cache.get(1) == {1: 7}
+    assert cache.stats() == {'chats': 1, 'hits': 1, 'misses': 1}
+
+    assert cache.peek(1) == {1: 7}
+    assert cache.peek(2) is None
+    assert cache.stats() == {'chats': 1, 'hits': 1, 'misses': 1}
+
+    with patch('guard_bot.bot.cache.time.monotonic', return_value=10 ** 9):
+        assert cache.peek(1) is None
+        assert cache.stats()['chats'] == 1
+        assert cache.get(1) is None
+    assert cache.stats() == {'chats': 0, 'hits': 1, 'misses': 2}
+
+    cache.set(1, {1: 7})
+    cache.set(2, {2: 1})
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.get(2) == {2: 1}
+    cache.invalidate()
+    assert cache.get(2) is None
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set(1, 'a')
+    cache.set(2, 'b')
+    assert cache.get(1) == 'a'
+    cache.set(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get(3) == 'c'
+    assert cache.peek(1) == 'a'
+    assert len(cache) == 2
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 1}
+    with patch('guard_bot.bot.cache.time.monotonic', return_value=10 ** 9):
+        assert cache.get(1, 'default') == 'default'
+        assert cache.peek(3) is None
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_username_cache():
+    cache = UsernameCache(maxsize=10, ttl=60)
+    assert await cache.get('@nobody') is None
+
+    cache.set('@Someone', 1)
+    cache.learn(MagicMock(id=2, username='Sender'))
+    cache.learn(MagicMock(id=3, username=None))
+    assert await cache.get('someone') == 1
+    assert await cache.get('@SENDER') == 2
+    assert cache.pending == {'someone': 1, 'sender': 2}
+
+    await cache.flush()
+    assert cache.pending == {}
+    cache.learn(MagicMock(id=2, username='Sender'))
+    assert cache.pending == {}
+
+    cache.memory.clear()
+    assert await cache.get('@sender') == 2
+    assert cache.stats()['db_hits'] == 1
+
+    await TelegramUsername.objects.filter(username='someone').aupdate(updated=timezone.now() - timedelta(days=1))
+    cache.memory.clear()
+    assert await cache.get('@someone') is None
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_username_cache_released_username():
+    cache = UsernameCache(maxsize=10, ttl=60)
+    cache.learn(MagicMock(id=1, username='old'))
+    cache.learn(MagicMock(id=2, username='other'))
+    await cache.flush()
+    # user 1 renamed, "old" is free and must not resolve to user 1
+    cache.learn(MagicMock(id=1, username='new'))
+    assert await cache.get('old') is None
+    assert await cache.get('new') == 1
+    # user 2 dropped username
+    cache.learn(MagicMock(id=2, username=None))
+    assert cache.released == {'old': 1, 'other': 2}
+    await cache.flush()
+    assert await cache.get('other') is None
+    assert cache.stats()['releases'] == 2
+
+    # "old" is taken by user 3, the rename of user 1 does not delete new mapping
+    cache.learn(MagicMock(id=3, username='Old'))
+    cache.released = {'old': 1}
+    await cache.flush()
+    rows = TelegramUsername.objects.values_list('username', 'user_id')
+    assert {x async for x in rows} == {('new', 1), ('old', 3)}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_chat_settings_cache():
+    cache = ChatSettingsCache(ttl=60, negative_ttl=10)
+    settings = await cache.get(1)
+    assert settings.pk is None
+    assert settings.warn_count == 3
+    assert await ChatSettings.objects.acount() == 0
+    assert (await cache.get(1)).pk is None
+    assert cache.stats()['negative_hits'] == 1
+
+    await ChatSettings.objects.acreate(chat_id=1, warn_count=5)
+    with patch('guard_bot.bot.cache.time.monotonic', return_value=10 ** 9):
+        assert (await cache.get(1)).warn_count == 5
+    cache.on_notify('1')
+    assert (await cache.get(1)).warn_count == 5
+    assert (await cache.get(1)).warn_count == 5
+    assert cache.stats() == {
+        'chats': 1, 'hits': 1, 'negative_hits': 1, 'misses': 3, 'invalidations': 1
+    }
+
+
+def test_message_hash_cache():
+    cache = MessageHashCache(max_chats=2, max_messages=2)
+    cache.remember(1, 1, b'a')
+    assert not cache.changed(1, 1, b'a')
+    assert cache.changed(1, 1, b'b')
+    assert not cache.changed(1, 1, b'b')
+    # unknown message is a change
+    assert cache.changed(1, 2, b'a')
+    cache.remember(1, 3, b'c')
+    assert cache.changed(1, 2, b'a') is False
+    assert cache.changed(1, 1, b'b')
+
+    cache.remember(2, 1, b'a')
+    cache.remember(3, 1, b'a')
+    assert cache.changed(1, 1, b'b')
+    assert cache.stats() == {'chats': 2, 'messages': 2, 'hits': 3, 'misses': 4, 'hit_rate': 3 / 7}
@@ -0,0 +1,106 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from guard_bot.bot.classifier import BatchScorer, NaiveBayes, features
+from guard_bot.bot.models import ChatSettings
+from guard_bot.bot.spam import ClassifierStage, SpamContext, Verdict
+
+SPAM = [
+    'Earn 500$ per day working from home, write me in private messages',
+    'Crypto investment with guaranteed profit, write me in private',
+    'Earn money online from home, only 10 places left',
+]
+HAM = [
+    'Does anyone know how to configure the router at home?',
+    'Meeting is moved to friday, see you there',
+    'Thanks, the fix from the last release works for me',
+]
+
+
+def test_features():
+    columns = features('Write me, WRITE me!', bits=10)
+    assert len(columns) == 7
+    assert columns.max() < 1024
+    assert list(columns[:2]) == list(columns[2:4])
+    assert len(features('🔥🔥')) == 0
+
+
+def test_train_score_and_mmap(tmp_path):
+    model, spam, ham = NaiveBayes.train(SPAM, HAM + ['🔥'], bits=12)
+    assert (spam, ham) == (3, 3)
+    assert len(model.weights) == 4097
+    assert model.score('earn from home, write me') > 0.9
+    assert model.score('see you at the meeting on friday') < 0.1
+
+    texts = ['earn from home', '', 'meeting on friday', 'write me in private']
+    scores = model.score_batch([features(x, 12) for x in texts])
+    assert np.allclose(scores, [model.score(x) for x in texts])
+    assert scores[1] == pytest.approx(0.5)
+
+    path = tmp_path / 'model' / 'spam.npy'
+    model.save(path)
+    loaded = NaiveBayes.load(path)
+    assert isinstance(loaded.weights, np.memmap)
+    assert loaded.bits == 12
+    assert loaded.score('earn from home') == pytest.approx(model.score('earn from home'))
+
+    with pytest.raises(ValueError):
+        NaiveBayes.train(SPAM, [], bits=12)
+    with pytest.raises(ValueError):
+        NaiveBayes.train(SPAM, HAM, bits=12, min_documents=4)
+
+
+def test_train_unbalanced():
+    # share of spam in training data does not make every message spam
+    spam = [f'{x} {i}' for i in range(1000) for x in SPAM[:1]]
+    model, spam_count, ham_count = NaiveBayes.train(spam, HAM, bits=12)
+    assert (spam_count, ham_count) == (1000, 3)
+    assert model.weights[-1] == 0
+    assert model.score('ok') < 0.5
+    assert model.score('') == pytest.approx(0.5)
+    assert model.score('earn per day from home') > 0.9
+
+
+@pytest.mark.asyncio
+async def test_batch_scorer(tmp_path):
+    path = tmp_path / 'spam.npy'
+    scorer = BatchScorer(path, max_delay=0.01, max_batch=3)
+    assert not scorer.load()
+    assert await scorer.score('earn from home') is None
+    NaiveBayes.train(SPAM, HAM, bits=12)[0].save(path)
+    assert scorer.load()
+
+    # messages within delay are one batch, full batch is scored at once
+    scores = await asyncio.gather(*(scorer.score(x) for x in SPAM + HAM[:1]))
+    assert scores[0] > 0.9 and scores[3] < 0.1
+    assert scorer.stats()['batches'] == 2
+    assert scorer.stats()['max_batch'] == 3
+    assert scorer.stats()['scored'] == 4
+
+    path.write_bytes(b'broken')
+    assert scorer.load()
+    assert scorer.model.bits == 12
+
+
+@pytest.mark.asyncio
+async def test_classifier_stage(tmp_path):
+    path = tmp_path / 'spam.npy'
+    NaiveBayes.train(SPAM, HAM, bits=12)[0].save(path)
+    scorer = BatchScorer(path, max_delay=0)
+    stage = ClassifierStage(scorer)
+    context = SpamContext(None, 1, 1, 1, 'earn from home, write me', chat_settings=ChatSettings(chat_id=1))
+    assert stage.check(context) is None
+    scorer.load()
+    verdict, reason = await stage.check(context)
+    assert verdict == Verdict.DELETE and float(reason) > 0.95
+    context.chat_settings.classifier_threshold = 1
+    assert stage.check(context) is None
+    context.chat_settings.classifier_threshold = 0.5
+    context.text = 'meeting on friday'
+    assert await stage.check(context) is None
+    # no features, no evidence
+    context.chat_settings.classifier_threshold = 0.1
+    context.text = '🔥🔥'
+    assert await stage.check(context) is None
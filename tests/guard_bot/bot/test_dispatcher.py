@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from guard_bot.bot.dispatcher import ChatDispatcher, Overflow
+
+
+def recorder(handled, delay=0.0):
+    async def handler(event):
+        await asyncio.sleep(delay)
+        handled.append(event)
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_order_per_chat_and_parallel_chats():
+    handled = []
+    dispatcher = ChatDispatcher(workers=4)
+    handler = recorder(handled, delay=0.01)
+    for i in range(5):
+        for chat in 'abc':
+            await dispatcher.put(chat, handler, f'{chat}{i}')
+    await dispatcher.join()
+    for chat in 'abc':
+        assert [x for x in handled if x[0] == chat] == [f'{chat}{i}' for i in range(5)]
+    stats = dispatcher.stats()
+    assert (stats['enqueued'], stats['processed'], stats['size'], stats['chats']) == (15, 15, 0, 0)
+    assert stats['max_size'] == 15
+    assert stats['max_wait'] >= 0.04
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_raided_chat_does_not_starve_others():
+    handled = []
+    dispatcher = ChatDispatcher(workers=1, chat_maxsize=100)
+    handler = recorder(handled)
+    for i in range(50):
+        await dispatcher.put('raid', handler, f'raid{i}')
+    await dispatcher.put('quiet', handler, 'quiet')
+    await dispatcher.join()
+    # round robin, quiet chat waits for one event of the raid only
+    assert handled.index('quiet') == 1
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_overflow():
+    handled = []
+    gate = asyncio.Event()
+
+    async def blocked(event):
+        await gate.wait()
+        handled.append(event)
+
+    dispatcher = ChatDispatcher(workers=1, maxsize=4, chat_maxsize=2, overflow=Overflow.DROP_NEW)
+    await dispatcher.put('a', blocked, 0)
+    await asyncio.sleep(0)
+    for i in range(1, 4):
+        await dispatcher.put('a', blocked, i)
+    assert dispatcher.stats()['dropped'] == 1
+    gate.set()
+    await dispatcher.join()
+    assert handled == [0, 1, 2]
+    await dispatcher.close()
+
+    handled.clear()
+    gate.clear()
+    dispatcher = ChatDispatcher(workers=1, maxsize=3, chat_maxsize=2, overflow='drop_oldest')
+    await dispatcher.put('a', blocked, 'a0')
+    await asyncio.sleep(0)
+    for event in ('a1', 'a2', 'a3', 'b0', 'c0'):
+        await dispatcher.put(event[0], blocked, event)
+    # a1 dropped by chat limit, a2 by total limit as "a" is the longest chat
+    assert dispatcher.stats()['dropped'] == 2
+    gate.set()
+    await dispatcher.join()
+    assert sorted(handled) == ['a0', 'a3', 'b0', 'c0']
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_overflow_wait_and_errors():
+    handled = []
+    dispatcher = ChatDispatcher(workers=2, maxsize=2, overflow='wait')
+    handler = recorder(handled, delay=0.01)
+
+    async def broken(event):
+        raise ValueError(event)
+
+    await dispatcher.put('a', broken, 'x')
+    for i in range(6):
+        await dispatcher.put('a', handler, i)
+    assert dispatcher.stats()['waits'] > 0
+    await dispatcher.close()
+    assert handled == list(range(6))
+    assert dispatcher.stats()['errors'] == 1
+    with pytest.raises(RuntimeError):
+        await dispatcher.put('a', handler, 7)
+
+
+@pytest.mark.asyncio
+async def test_overflow_wait_limit():
+    assert ChatDispatcher().overflow == Overflow.DROP_OLDEST
+    handled = []
+    gate = asyncio.Event()
+
+    async def blocked(event):
+        await gate.wait()
+        handled.append(event)
+
+    dispatcher = ChatDispatcher(workers=1, maxsize=1, overflow=Overflow.WAIT, max_waiting=2)
+    await dispatcher.put('a', blocked, 0)
+    await asyncio.sleep(0)
+    await dispatcher.put('a', blocked, 1)
+    producers = [asyncio.create_task(dispatcher.put('a', blocked, i)) for i in (2, 3, 4)]
+    await asyncio.sleep(0)
+    # third producer is not parked, its event is dropped
+    assert (dispatcher.stats()['waiting'], dispatcher.stats()['dropped']) == (2, 1)
+    gate.set()
+    await asyncio.gather(*producers)
+    await dispatcher.join()
+    assert handled == [0, 1, 2, 3]
+    assert dispatcher.stats()['waiting'] == 0
+    await dispatcher.close()
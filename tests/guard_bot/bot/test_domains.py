@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+from asgiref.sync import sync_to_async
+from telethon import types
+
+from guard_bot.bot.domains import DomainBlocklist, DomainTrie, extract_urls, normalize_domain, url_domain
+from guard_bot.bot.models import BlockedDomain
+from guard_bot.bot.spam import DomainStage, SpamContext, Verdict
+
+
+def test_normalize_domain():
+    assert normalize_domain(' Example.XYZ. ') == 'example.xyz'
+    assert normalize_domain('пример.рф') == 'xn--e1afmkfd.xn--p1ai'
+    assert normalize_domain('') is None
+    assert normalize_domain('bad..entry') is None
+    assert url_domain('HTTPS://user@Sub.Example.xyz:8080/path?q=1') == 'sub.example.xyz'
+    assert url_domain('example.xyz/path') == 'example.xyz'
+    assert url_domain('http://[broken') is None
+
+
+def test_extract_urls():
+    text = 'Привет 👋 go to example.xyz/x and click here'
+    entities = [
+        types.MessageEntityBold(offset=0, length=6),
+        types.MessageEntityUrl(offset=16, length=13),
+        types.MessageEntityTextUrl(offset=40, length=4, url='https://spam.xyz'),
+    ]
+    assert extract_urls(text, entities) == ['example.xyz/x', 'https://spam.xyz']
+    assert extract_urls('see https://spam.xyz/a, Spam.XYZ or пример.рф, not 1.5 or a.b') == \
+        ['https://spam.xyz/a,', 'Spam.XYZ', 'пример.рф']
+
+
+def test_domain_trie():
+    trie = DomainTrie(['example.xyz', '*.wild.xyz', 'пример.рф', 'bad..entry', ''])
+    assert len(trie) == 3
+    assert trie.match('example.xyz') == 'example.xyz'
+    assert trie.match('a.b.example.xyz') == 'example.xyz'
+    assert trie.match('wild.xyz') is None
+    assert trie.match('a.wild.xyz') == '*.wild.xyz'
+    assert trie.match('notexample.xyz') is None
+    assert trie.match('xyz') is None
+    assert trie.match('sub.xn--e1afmkfd.xn--p1ai') == 'пример.рф'
+
+
+def test_domain_trie_lookup_does_not_depend_on_size():
+    small = DomainTrie(f'domain{x}.xyz' for x in range(100))
+    large = DomainTrie(f'domain{x}.xyz' for x in range(200_000))
+
+    def measure(trie):
+        started = time.perf_counter()
+        for _ in range(10_000):
+            trie.match('a.b.domain7.xyz')
+            trie.match('a.b.clean.com')
+        return time.perf_counter() - started
+
+    assert measure(large) < measure(small) * 3
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_domain_blocklist():
+    blocklist = DomainBlocklist()
+    await BlockedDomain.objects.acreate(domain='spam.xyz')
+    await BlockedDomain.objects.acreate(domain='*.chat.xyz', chat_id=1)
+    await blocklist.reload()
+    assert blocklist.match(1, 'a.spam.xyz') == 'spam.xyz'
+    assert blocklist.match(1, 'a.chat.xyz') == '*.chat.xyz'
+    assert blocklist.match(2, 'a.chat.xyz') is None
+
+    # requests during load are coalesced into one more load
+    await asyncio.gather(*[blocklist.reload() for _ in range(5)])
+    assert blocklist.loads == 3
+
+    await sync_to_async(BlockedDomain.objects.filter(domain='spam.xyz').delete)()
+    await blocklist.reload()
+    assert blocklist.match(1, 'a.spam.xyz') is None
+    assert blocklist.stats() == {
+        'global': 0, 'chats': 1, 'chat_entries': 1, 'loads': 4, 'lookups': 4, 'hits': 2,
+        'last_load_duration': blocklist.last_load_duration,
+    }
+
+    stage = DomainStage(blocklist)
+    context = SpamContext(None, 1, 1, 1, 'visit www.chat.xyz now')
+    assert stage.check(context) == (Verdict.DELETE, 'blocked domain *.chat.xyz')
+    context.chat_id = 2
+    assert stage.check(context) is None
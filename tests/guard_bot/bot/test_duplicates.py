@@ -0,0 +1,68 @@
+import random
+import string
+import time
+
+from guard_bot.bot.duplicates import NearDuplicateIndex, normalize, signature
+from guard_bot.bot.spam import DuplicatesStage, SpamContext, Verdict
+
+SPAM = 'Earn 500$ per day working from home!!! Write me in private messages, only 10 places left'
+
+
+def random_text(length=100):
+    return ''.join(random.choice(string.ascii_lowercase + ' ') for _ in range(length))
+
+
+def similarity(first, second):
+    first, second = signature(normalize(first)), signature(normalize(second))
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+def test_normalize_and_signature():
+    assert normalize('  Earn 500$ per DAY!!! 🔥🔥 call_me ') == 'earn 0 per day call me'
+    assert signature('abc') is None
+    sig = signature(normalize(SPAM))
+    assert len(sig) == 64
+    assert sig == signature(normalize(SPAM.upper()))
+    assert similarity(SPAM, SPAM.replace('500', '700').replace('10', '9') + ' 🔥') == 1
+    assert similarity(SPAM, SPAM.replace('home', 'house')) > 0.6
+    assert similarity(SPAM, random_text()) < 0.3
+
+
+def test_near_duplicate_index():
+    index = NearDuplicateIndex(window=60, min_chats=3, min_length=30)
+    assert index.check(1, 1, 'hello') == 0
+    assert index.check(1, 2, SPAM, now=0) == 1
+    # same chat and edit of indexed message are not counted
+    assert index.check(1, 3, SPAM, now=1) == 1
+    assert index.check(2, 1, SPAM.replace('home', 'house'), now=2) == 2
+    assert index.check(2, 1, SPAM, now=3) == 2
+    assert len(index) == 3
+    assert index.check(3, 1, random_text(), now=4) == 1
+    assert index.check(4, 1, SPAM.replace('only', 'just'), now=5) == 3
+    assert index.stats()['duplicates'] == 1
+
+    # window eviction
+    assert index.check(5, 1, SPAM, now=62) == 3
+    assert index.check(6, 1, SPAM, now=200) == 1
+    assert len(index) == 1
+    assert index.stats()['buckets'] == 16
+    assert index.stats()['evictions'] == 6
+
+
+def test_near_duplicate_index_capacity_and_speed():
+    index = NearDuplicateIndex(window=600, capacity=1000)
+    texts = [random_text(200) for _ in range(2000)]
+    started = time.perf_counter()
+    for i, text in enumerate(texts):
+        assert index.check(i % 50, i, text, now=0) == 1
+    assert (time.perf_counter() - started) / len(texts) < 0.001
+    assert len(index) == 1000
+    assert sum(len(x) for x in index._buckets.values()) == 1000 * 16
+    assert index.stats()['evictions'] == 1000
+
+
+def test_duplicates_stage():
+    index = NearDuplicateIndex(min_chats=2)
+    stage = DuplicatesStage(index)
+    assert stage.check(SpamContext(None, 1, 1, 1, SPAM)) is None
+    assert stage.check(SpamContext(None, 2, 2, 1, SPAM)) == (Verdict.DELETE, 'duplicate in 2 chats')
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from guard_bot.bot.duplicates import NearDuplicateIndex, prepare
+from guard_bot.bot.executor import CpuExecutor, LoopLagMonitor
+from guard_bot.bot.spam import DuplicatesStage, SpamContext, SpamPipeline, Verdict
+
+SPAM = 'Earn 500$ per day working from home!!! Write me in private messages, only 10 places left. ' * 20
+
+
+@pytest.mark.asyncio
+async def test_cpu_executor():
+    executor = CpuExecutor(workers=2, pending_per_worker=1)
+    try:
+        assert executor.max_pending == 2
+        # functions are imported by workers, test module needs django, so stdlib ones are used
+        first, second = executor.submit(time.sleep, 0.5), executor.submit(os.getpid)
+        assert executor.submit(time.sleep, 0) is None
+        await first
+        assert await second != os.getpid()
+        await asyncio.sleep(0.01)
+        assert executor.stats() == {
+            'workers': 2, 'pending': 0, 'submitted': 2, 'completed': 2, 'rejected': 1, 'broken': 0
+        }
+        # caller timeout does not free the worker
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(executor.submit(time.sleep, 0.3), 0.01)
+        assert executor.pending == 1
+        await asyncio.sleep(0.5)
+        assert executor.pending == 0
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_offload():
+    executor = CpuExecutor(workers=1, pending_per_worker=1)
+    index = NearDuplicateIndex(min_chats=2)
+    stage = DuplicatesStage(index, offload_length=100)
+    stage.budget = 5
+    pipeline = SpamPipeline([stage], executor=executor)
+    lag = LoopLagMonitor(interval=0.01)
+    lag_task = asyncio.create_task(lag.run())
+    try:
+        assert await pipeline.run(SpamContext(None, 1, 1, 1, SPAM)) is None
+        result = await pipeline.run(SpamContext(None, 2, 1, 1, SPAM))
+        assert result.verdict == Verdict.DELETE
+        # short text is checked in place
+        assert await pipeline.run(SpamContext(None, 3, 1, 1, SPAM[:50])) is None
+        stats = pipeline.stats()['stages']['duplicates']
+        assert (stats['calls'], stats['offloaded'], stats['fallbacks']) == (3, 2, 0)
+
+        executor.submit(time.sleep, 0.2)
+        assert await pipeline.run(SpamContext(None, 3, 1, 2, SPAM)) is None
+        assert pipeline.stats()['stages']['duplicates']['fallbacks'] == 1
+        assert lag.stats()['max'] < 0.1
+    finally:
+        lag_task.cancel()
+        executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_offload_timeout():
+    executor = CpuExecutor(workers=1, pending_per_worker=2)
+    index = NearDuplicateIndex(min_chats=2)
+    stage = DuplicatesStage(index, offload_length=100)
+    stage.budget = 0.01
+    pipeline = SpamPipeline([stage], executor=executor)
+    try:
+        executor.start()
+        assert executor.stats()['completed'] == 0
+        # worker is busy, call times out but message is indexed when worker is done
+        executor.submit(time.sleep, 0.2)
+        assert await pipeline.run(SpamContext(None, 1, 1, 1, SPAM)) is None
+        stats = pipeline.stats()['stages']['duplicates']
+        assert (stats['timeouts'], stats['late']) == (1, 0)
+        await asyncio.sleep(0.5)
+        assert pipeline.stats()['stages']['duplicates']['late'] == 1
+        stage.budget = 5
+        result = await pipeline.run(SpamContext(None, 2, 1, 1, SPAM))
+        assert result.verdict == Verdict.DELETE
+    finally:
+        executor.shutdown()
+
+
+def test_duplicates_stage_in_place():
+    index = NearDuplicateIndex(min_chats=2)
+    stage = DuplicatesStage(index)
+    assert stage.features(SpamContext(None, 1, 1, 1, 'text')) == ('text', 30, 64)
+    assert stage.check(SpamContext(None, 1, 1, 1, SPAM)) is None
+    assert stage.check(SpamContext(None, 2, 1, 1, SPAM)) == (Verdict.DELETE, 'duplicate in 2 chats')
+    assert prepare('short') is None
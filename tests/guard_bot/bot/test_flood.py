@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from guard_bot.bot.flood import FloodDetector
+from guard_bot.bot.models import ChatSettings
+
+
+def test_flood_detector_user():
+    detector = FloodDetector(idle=600)
+    chat_settings = ChatSettings(chat_id=1, flood_user_limit=3, flood_user_period=timedelta(seconds=3))
+    assert [detector.hit(1, 1, chat_settings, now=0)[0] for _ in range(3)] == [False] * 3
+    assert detector.hit(1, 1, chat_settings, now=0) == (True, False)
+    # bucket is refilled after flood, other users and chats are separate
+    assert detector.hit(1, 1, chat_settings, now=0) == (False, False)
+    assert detector.hit(1, 2, chat_settings, now=0) == (False, False)
+    assert detector.hit(2, 1, chat_settings, now=0) == (False, False)
+
+    # one message per second is allowed
+    chat_settings.flood_user_limit = 1
+    chat_settings.flood_user_period = timedelta(seconds=1)
+    assert [detector.hit(1, 3, chat_settings, now=x)[0] for x in range(10)] == [False] * 10
+    assert detector.hit(1, 3, chat_settings, now=9.5)[0]
+
+    chat_settings.flood_user_limit = 0
+    assert not any(detector.hit(1, 4, chat_settings, now=10)[0] for _ in range(10))
+    assert detector.stats() == {'users': 4, 'chats': 2, 'user_floods': 2, 'chat_floods': 0, 'evictions': 0}
+
+
+def test_flood_detector_chat_and_eviction():
+    detector = FloodDetector(idle=60)
+    chat_settings = ChatSettings(chat_id=1, flood_chat_limit=5, flood_chat_period=timedelta(seconds=10))
+    assert [detector.hit(1, x, chat_settings, now=1)[1] for x in range(6)] == [False] * 5 + [True]
+    assert detector.hit(1, 7, chat_settings, now=1) == (False, False)
+    assert detector.stats()['users'] == 7
+
+    detector.hit(2, 1, chat_settings, now=100)
+    assert detector.stats() == {'users': 1, 'chats': 1, 'user_floods': 0, 'chat_floods': 1, 'evictions': 8}
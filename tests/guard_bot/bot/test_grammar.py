@@ -0,0 +1,58 @@
+import re
+from collections import OrderedDict
+
+import pytest
+
+from guard_bot.bot.grammar import USERS, USERS_AND_PERIOD, USERS_AND_PERMS, PERIOD_ONLY, MAX_COMMAND_LENGTH, \
+    MAX_COMMAND_TOKENS, CommandArgs, CommandTooLong, GrammarError, compile_grammar
+
+
+@pytest.mark.parametrize('spec, text, result', [
+    (USERS, '!ban', {'command': 'ban'}),
+    (USERS, '!ban @user', {'command': 'ban', 'users': '@user'}),
+    (USERS, '!ban #123   @user  [u](tg://user?id=5) spam bot', {
+        'command': 'ban', 'users': ['123', '@user', '5'], 'comment': 'spam bot'}),
+    (USERS, '!ban reason @user', {'command': 'ban', 'comment': 'reason @user'}),
+    (USERS, 'ban @user', {'comment': 'ban @user'}),
+    (USERS_AND_PERIOD, '!mute @a 1d 2h 3m flood', {
+        'command': 'mute', 'users': '@a', 'days': '1', 'hours': '2', 'minutes': '3', 'comment': 'flood'}),
+    (USERS_AND_PERIOD, '!mute @a 2h 3h', {'command': 'mute', 'users': '@a', 'hours': ['2', '3']}),
+    (USERS_AND_PERIOD, '!mute 1hours', {'command': 'mute', 'hours': '1', 'comment': 'ours'}),
+    (USERS_AND_PERMS, '!on #1 message gif comment', {
+        'command': 'on', 'users': '1', 'perms': ['message', 'gif'], 'comment': 'comment'}),
+    (PERIOD_ONLY, '!freeze 5m', {'command': 'freeze', 'minutes': '5'}),
+    (PERIOD_ONLY, '', {}),
+])
+def test_parse(spec, text, result):
+    assert compile_grammar(spec).parse(text).as_dict() == result
+
+
+def test_parse_typed_result():
+    args = compile_grammar(USERS).parse('!kick @a #2 bye')
+    assert isinstance(args, CommandArgs)
+    assert args.command == 'kick'
+    assert args.users == ['@a', '2']
+    assert args.comment == 'bye'
+    assert args.days is None
+
+
+def test_compile_cached():
+    assert compile_grammar(USERS) is compile_grammar(OrderedDict(USERS))
+    assert compile_grammar(USERS) is not compile_grammar(USERS_AND_PERIOD)
+
+
+def test_compile_errors():
+    with pytest.raises(GrammarError, match='Unknown command attribute unknown'):
+        compile_grammar(OrderedDict({'unknown': re.compile(r'(\d+)')}))
+    with pytest.raises(GrammarError, match='has no value group'):
+        compile_grammar(OrderedDict({'command': re.compile(r'!\w+')}))
+
+
+def test_parse_bounded():
+    grammar = compile_grammar(USERS)
+    with pytest.raises(CommandTooLong):
+        grammar.parse('!ban ' + 'x' * MAX_COMMAND_LENGTH)
+    with pytest.raises(CommandTooLong):
+        grammar.parse('!ban' + ' #1' * MAX_COMMAND_TOKENS)
+    text = '!ban ' + '[' * (MAX_COMMAND_LENGTH - 5)
+    assert grammar.parse(text).comment == text[5:]
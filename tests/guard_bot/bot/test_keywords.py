@@ -0,0 +1,104 @@
+import time
+
+import pytest
+from django.core.exceptions import ValidationError
+
+from guard_bot.bot.keywords import AhoCorasick, BlocklistCache, ChatBlocklist, split_lines
+from guard_bot.bot.models import ChatSettings
+from guard_bot.bot.spam import BlocklistStage, SpamContext, Verdict
+
+
+def test_split_lines():
+    assert split_lines(' one \n\n two\r\n') == ['one', 'two']
+    assert split_lines(None) == []
+
+
+def test_aho_corasick():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers', 'Crypto Bot', 'ß'])
+    assert len(automaton) == 6
+    assert automaton.search('ushers') is None
+    assert automaton.search('ask HIS friend') == 'his'
+    assert automaton.search('ask him, she said') == 'she'
+    assert automaton.search('buy in crypto   bot') is None
+    assert automaton.search('buy in CRYPTO BOT!') == 'crypto bot'
+    assert automaton.search('STRASSE ss') == 'ss'
+    assert AhoCorasick().search('text') is None
+    # overlapping phrases found through fail links
+    assert AhoCorasick(['abcd', 'bc']).search('x abc bc') == 'bc'
+
+
+def test_aho_corasick_one_pass():
+    text = 'lorem ipsum dolor sit amet ' * 20
+    small = AhoCorasick([f'phrase{x}' for x in range(10)])
+    large = AhoCorasick([f'phrase{x}' for x in range(50_000)])
+
+    def measure(automaton):
+        started = time.perf_counter()
+        for _ in range(200):
+            automaton.search(text)
+        return time.perf_counter() - started
+
+    assert measure(large) < measure(small) * 3
+
+
+def test_chat_blocklist():
+    blocklist = ChatBlocklist(['free money'], [r'bit\.ly/\w+', '[broken', r'\d{5,}'])
+    assert blocklist.patterns == [r'bit\.ly/\w+', r'\d{5,}']
+    assert blocklist.search('get FREE money now') == 'phrase free money'
+    assert blocklist.search('see BIT.LY/abc') == r'pattern bit\.ly/\w+'
+    assert blocklist.search('call 1234567') == r'pattern \d{5,}'
+    assert blocklist.search('nothing here 123') is None
+
+
+def test_chat_blocklist_patterns_not_joined():
+    # inline flags, duplicate group names and backreferences break the joined regex
+    patterns = ['foo', '(?i)spam', '(?P<x>a)z', '(?P<x>b)z', r'(c)\1', r'\d{5,}']
+    blocklist = ChatBlocklist([], patterns)
+    assert blocklist.patterns == patterns
+    assert [index for index, _ in blocklist.separate] == [1, 2, 3, 4]
+    assert blocklist.search('FOO') == 'pattern foo'
+    assert blocklist.search('Spam') == 'pattern (?i)spam'
+    assert blocklist.search('bz') == 'pattern (?P<x>b)z'
+    assert blocklist.search('cc') == r'pattern (c)\1'
+    # backreference is not shifted by the group of the joined regex
+    assert blocklist.search('c1') is None
+    assert blocklist.search('123456') == r'pattern \d{5,}'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_chat_settings_blocklist_version():
+    chat_settings = ChatSettings(chat_id=1, blocked_patterns='[broken')
+    with pytest.raises(ValidationError):
+        chat_settings.full_clean()
+    chat_settings.blocked_patterns = 'foo\n(?i)spam\n(?P<x>a)\n(?P<x>b)\n(a)\\1'
+    chat_settings.full_clean()
+    chat_settings.blocked_patterns = ''
+    chat_settings.save()
+    assert chat_settings.blocklist_version == ''
+    chat_settings.blocked_phrases = 'spam'
+    chat_settings.save()
+    version = chat_settings.blocklist_version
+    assert version
+    chat_settings.warn_count = 5
+    chat_settings.save()
+    assert ChatSettings.objects.get(chat_id=1).blocklist_version == version
+
+
+def test_blocklist_stage():
+    cache = BlocklistCache(maxsize=10)
+    stage = BlocklistStage(cache)
+    chat_settings = ChatSettings(chat_id=1, blocked_phrases='spam', blocklist_version='1')
+    context = SpamContext(None, 1, 1, 1, 'it is spam', chat_settings=chat_settings)
+    assert stage.check(context) == (Verdict.DELETE, 'blocked phrase spam')
+    context.text = 'it is fine'
+    assert stage.check(context) is None
+    chat_settings.warn_count = 10
+    assert stage.check(context) is None
+    assert cache.stats()['compiles'] == 1
+
+    chat_settings.blocked_phrases, chat_settings.blocklist_version = 'fine', '2'
+    assert stage.check(context) == (Verdict.DELETE, 'blocked phrase fine')
+    assert cache.stats()['compiles'] == 2
+
+    assert stage.check(SpamContext(None, 2, 1, 1, 'spam', chat_settings=ChatSettings(chat_id=2))) is None
+    assert stage.check(SpamContext(None, 2, 1, 1, 'spam')) is None
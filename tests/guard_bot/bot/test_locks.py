@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from guard_bot.bot.locks import KeyedLock, LockException
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_fifo():
+    locks = KeyedLock()
+    order = []
+
+    async def worker(i):
+        async with locks.acquire('key'):
+            order.append(i)
+            await asyncio.sleep(0)
+
+    async with locks.acquire('key'):
+        tasks = [asyncio.create_task(worker(i)) for i in range(5)]
+        await asyncio.sleep(0)
+        assert locks.locked('key')
+        assert not locks.locked('another')
+    await asyncio.gather(*tasks)
+
+    assert order == [0, 1, 2, 3, 4]
+    assert len(locks) == 0
+    stats = locks.stats()['keys']['key']
+    assert stats['acquired'] == 6
+    assert stats['contended'] == 5
+    assert stats['timeouts'] == 0
+    assert stats['wait_max'] > 0
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_timeout():
+    locks = KeyedLock()
+    async with locks.acquire(1):
+        with pytest.raises(LockException, match='Already locked by another coroutine'):
+            async with locks.acquire(1, timeout=0.01):
+                pass
+        async with locks.acquire(2, timeout=0.01):
+            assert len(locks) == 2
+    assert len(locks) == 0
+    assert locks.stats()['keys'][1]['timeouts'] == 1
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_release_on_error():
+    locks = KeyedLock(max_stats_keys=2)
+    with pytest.raises(ValueError):
+        async with locks.acquire(1):
+            raise ValueError()
+    async with locks.acquire(2):
+        pass
+    async with locks.acquire(3):
+        pass
+    assert len(locks) == 0
+    assert list(locks.stats()['keys']) == [2, 3]
@@ -1,11 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 import pytest
 from unittest.mock import patch
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.utils import timezone
 
 
-from guard_bot.bot.models import WarnType, Spammers, ChatAdmins, UserWarn, ChatSettings
+from guard_bot.bot.models import WarnType, Spammers, ChatAdmins, UserWarn, ChatSettings, AdminRights
 
 pytestmark = pytest.mark.django_db(transaction=True)
 
@@ -58,6 +60,39 @@ class TestModels:
         assert await ChatAdmins.get_admins_by_chat(chat_id=1) == {1: {1}}
         assert await ChatAdmins.get_admins_by_chat() == {1: {1}}
 
+    @pytest.mark.asyncio
+    async def test_chat_admin_get_rights(self, not_shadow_chat_admin, shadow_chat_admin):
+        await ChatAdmins.objects.acreate(user_id=3, chat_id=1, can_ban=True)
+        await ChatAdmins.objects.acreate(user_id=4, chat_id=1, can_delete=True, can_add_admin=True)
+        assert await ChatAdmins.get_rights_by_chat(chat_id=1) == {
+            1: AdminRights.NONE,
+            2: AdminRights.NONE,
+            3: AdminRights.CAN_BAN,
+            4: AdminRights.CAN_DELETE | AdminRights.CAN_ADD_ADMIN,
+        }
+        assert await ChatAdmins.get_rights_by_chat(chat_id=2) == {}
+
+    def test_chat_admin_unique(self, not_shadow_chat_admin):
+        with pytest.raises(IntegrityError):
+            ChatAdmins.objects.create(chat_id=1, user_id=1)
+
+    @pytest.mark.asyncio
+    async def test_chat_admin_set_chat_admins(self, not_shadow_chat_admin, shadow_chat_admin):
+        await ChatAdmins.objects.acreate(user_id=3, chat_id=1, can_ban=True)
+        await ChatAdmins.objects.acreate(user_id=3, chat_id=2, can_ban=True)
+        rights = await ChatAdmins.aset_chat_admins(
+            1, {1: AdminRights.CAN_BAN, 4: AdminRights.CAN_DELETE}, delete_ids={3})
+        assert rights == {1: AdminRights.CAN_BAN, 2: AdminRights.NONE, 4: AdminRights.CAN_DELETE}
+        assert await ChatAdmins.get_rights_by_chat(chat_id=1) == rights
+        assert await ChatAdmins.objects.filter(chat_id=1).acount() == 3
+        assert await ChatAdmins.get_rights_by_chat(chat_id=2) == {3: AdminRights.CAN_BAN}
+
+    def test_admin_rights(self):
+        assert AdminRights.pack() == AdminRights.NONE
+        assert AdminRights.pack(True, True, True) == 7
+        assert AdminRights.pack(can_ban=True) == AdminRights.CAN_BAN
+        assert AdminRights.from_name('can_add_admin') == AdminRights.CAN_ADD_ADMIN
+
     def test_user_warn(self, user_warn_mute):
         assert user_warn_mute.user_id == 1
         assert user_warn_mute.chat_id == 1
@@ -90,8 +125,54 @@ class TestModels:
 
         assert await UserWarn.have_to_mute(user_id=1, chat_id=1) == chat_default_settings.mute_period
 
+        assert await UserWarn.delete_current_warnings(chat_id=1, user_id=1) == 2
         assert await UserWarn.delete_current_warnings(chat_id=1, user_id=1) == 0
 
+    @pytest.mark.asyncio
+    async def test_user_warn_delete_warnings(self):
+        for user_id in (1, 1, 2, 3):
+            await UserWarn.set_warn(chat_id=1, user_id=user_id, warn_type=WarnType.WARN)
+        await UserWarn.set_warn(chat_id=1, user_id=1, warn_type=WarnType.MUTE)
+        await UserWarn.set_warn(chat_id=2, user_id=1, warn_type=WarnType.WARN)
+        old = await UserWarn.set_warn(chat_id=1, user_id=3, warn_type=WarnType.WARN)
+        await UserWarn.objects.filter(pk=old.pk).aupdate(created=timezone.now() - timedelta(days=4))
+
+        assert await UserWarn.adelete_warnings(1, [1, 2, 1, 4], timedelta(days=3)) == {1: 2, 2: 1, 4: 0}
+        assert await UserWarn.adelete_warnings(1, [3], timedelta(days=3)) == {3: 1}
+        assert await UserWarn.adelete_warnings(1, [], timedelta(days=3)) == {}
+        assert await UserWarn.objects.filter(chat_id=1, warn_type=WarnType.WARN).acount() == 1
+        assert await UserWarn.objects.filter(chat_id=1, warn_type=WarnType.MUTE).acount() == 1
+        assert await UserWarn.objects.filter(chat_id=2).acount() == 1
+
+    @pytest.mark.asyncio
+    async def test_user_warn_awarn(self):
+        assert await UserWarn.awarn(chat_id=1, user_id=1, comment='first') == (1, None)
+        assert await UserWarn.awarn(chat_id=1, user_id=1) == (2, None)
+        assert await UserWarn.awarn(chat_id=1, user_id=1) == (3, timedelta(days=1))
+        assert await UserWarn.awarn(chat_id=1, user_id=2) == (1, None)
+        assert await UserWarn.objects.filter(chat_id=1, user_id=1, warn_type=WarnType.WARN).acount() == 3
+        assert await UserWarn.objects.filter(comment='first').acount() == 1
+
+        await ChatSettings.objects.acreate(chat_id=2, warn_count=1, mute_period=timedelta(hours=1))
+        assert await UserWarn.awarn(chat_id=2, user_id=1) == (1, timedelta(hours=1))
+
+        await UserWarn.objects.filter(chat_id=1, user_id=1).aupdate(created=timezone.now() - timedelta(days=4))
+        assert await UserWarn.awarn(chat_id=1, user_id=1) == (1, None)
+
+    def test_user_warn_concurrent(self):
+        ChatSettings.objects.create(chat_id=1, warn_count=2)
+
+        def warn(_):
+            try:
+                return UserWarn.warn(chat_id=1, user_id=1)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(warn, range(4)))
+        assert sorted(count for count, _ in results) == [1, 2, 3, 4]
+        assert sum(1 for _, mute in results if mute is None) == 1
+
     def test_chat_settings(self, chat_default_settings):
         assert chat_default_settings.chat_id == 0
         assert chat_default_settings.mute_period == timedelta(days=1)
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from asgiref.sync import sync_to_async
+
+from guard_bot.bot.cache import ChatSettingsCache
+from guard_bot.bot.models import CHAT_SETTINGS_CHANNEL, ChatSettings
+from guard_bot.bot.notify import PgListener
+
+
+async def wait_for(condition):
+    for _ in range(50):
+        if condition():
+            break
+        await asyncio.sleep(0.1)
+    return condition()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_pg_listener():
+    cache = ChatSettingsCache(ttl=60)
+    payloads = []
+    listener = PgListener()
+    listener.subscribe(CHAT_SETTINGS_CHANNEL, cache.on_notify, on_reconnect=cache.invalidate)
+    listener.subscribe('guard_bot_test', payloads.append)
+    listener.subscribe('guard_bot_broken', lambda payload: 1 / 0)
+    task = asyncio.create_task(listener.listen())
+    assert await wait_for(lambda: listener.listening)
+    assert cache.invalidations == 1
+
+    assert (await cache.get(1)).pk is None
+    settings = await ChatSettings.objects.acreate(chat_id=1, warn_count=5)
+    assert await wait_for(lambda: 1 not in cache._chats)
+    assert (await cache.get(1)).warn_count == 5
+
+    settings.warn_count = 7
+    await sync_to_async(settings.save)()
+    assert await wait_for(lambda: 1 not in cache._chats)
+    assert (await cache.get(1)).warn_count == 7
+
+    def notify():
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify('guard_bot_broken', ''), pg_notify('guard_bot_test', 'payload')")
+
+    await sync_to_async(notify)()
+    assert await wait_for(lambda: payloads)
+    assert payloads == ['payload']
+    assert listener.stats() == {
+        'channels': [CHAT_SETTINGS_CHANNEL, 'guard_bot_test', 'guard_bot_broken'],
+        'listening': True,
+        'notifications': 4,
+        'reconnects': 1,
+    }
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert not listener.listening
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from django.db import connection, transaction
+from django.utils import timezone as dj_timezone
+
+from guard_bot.bot.models import DELETE_WARNINGS_SQL, WARN_SQL, ChatSettings, UserWarn, WarnType
+from guard_bot.bot.partitions import (
+    create_partition,
+    list_partitions,
+    month_start,
+    partition_for,
+    detach_partition,
+)
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_month_start():
+    value = datetime(2023, 12, 15, 10, tzinfo=timezone.utc)
+    assert month_start(value) == datetime(2023, 12, 1, tzinfo=timezone.utc)
+    assert month_start(value, 1) == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert month_start(value, -12) == datetime(2022, 12, 1, tzinfo=timezone.utc)
+
+    partition = partition_for('bot_userwarn', value)
+    assert partition.name == 'bot_userwarn_p202312'
+    assert partition.end == datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_create_partition():
+    table = UserWarn._meta.db_table
+    old = dj_timezone.now() - timedelta(days=400)
+    warn = UserWarn.objects.create(chat_id=1, user_id=1, warn_type=WarnType.WARN)
+    UserWarn.objects.filter(pk=warn.pk).update(created=old)
+
+    partition = partition_for(table, old)
+    assert partition not in list_partitions(table)
+    create_partition(table, partition)
+    assert partition in list_partitions(table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {partition.name}')
+        assert cursor.fetchone() == (1,)
+        cursor.execute(f'SELECT count(*) FROM {table}_default')
+        assert cursor.fetchone() == (0,)
+
+    # hot queries do not touch old partitions
+    qs = UserWarn.get_warn_qs(chat_id=1, user_id=1, warn_period=timedelta(days=3))
+    assert partition.name not in qs.explain()
+    assert partition_for(table, dj_timezone.now()).name in qs.explain()
+
+    detach_partition(table, partition)
+    assert partition not in list_partitions(table)
+    assert UserWarn.objects.filter(pk=warn.pk).exists() is False
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {partition.name}')
+
+
+def explain(sql, params):
+    """Plan with run-time pruning, statement is rolled back"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF, SUMMARY OFF) {sql}', params)
+        plan = '\n'.join(x for x, in cursor.fetchall())
+        transaction.set_rollback(True)
+    return plan
+
+
+def scanned(plan, name):
+    """Executed scans of partition, pruned ones are absent or never executed"""
+    return [x for x in plan.splitlines() if 'Scan' in x and f' on {name} ' in x and 'never executed' not in x]
+
+
+def test_warn_queries_prune_partitions():
+    table = UserWarn._meta.db_table
+    old = partition_for(table, dj_timezone.now() - timedelta(days=400))
+    hot = partition_for(table, dj_timezone.now())
+    create_partition(table, old)
+    try:
+        # warn statement without its advisory lock
+        warn_sql = WARN_SQL.split(';', 1)[1].format(
+            warn_table=table, settings_table=ChatSettings._meta.db_table
+        )
+        plan = explain(warn_sql, {
+            'chat_id': 1, 'user_id': 1, 'comment': None, 'warn_type': WarnType.WARN,
+            'warn_count': 3, 'warn_counter_period': timedelta(days=3), 'mute_period': timedelta(days=1),
+        })
+        assert not scanned(plan, old.name)
+        assert scanned(plan, hot.name)
+
+        plan = explain(DELETE_WARNINGS_SQL.format(warn_table=table), {
+            'chat_id': 1, 'user_ids': [1, 2], 'warn_type': WarnType.WARN, 'warn_period': timedelta(days=3),
+        })
+        assert not scanned(plan, old.name)
+        assert scanned(plan, hot.name)
+    finally:
+        detach_partition(table, old)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {old.name}')
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from guard_bot.bot.scheduler import TokenBucket, RefreshScheduler
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    assert time.monotonic() - started >= 0.015
+
+    bucket.pause(0.05)
+    started = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - started >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_refresh_scheduler_concurrency():
+    scheduler = RefreshScheduler(TokenBucket(1000), concurrency=3)
+    running, max_running = 0, 0
+
+    async def refresh(chat_id, db_admins):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running, scheduler.in_flight)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await scheduler.run_cycle(refresh, {x: set() for x in range(10)})
+    assert max_running == 3
+    assert scheduler.in_flight == 0
+    stats = scheduler.stats()
+    assert stats['chats'] == 10
+    assert stats['last_cycle_duration'] < 0.1
+    assert scheduler.staleness(1) < 1
+    assert scheduler.staleness(100) is None
+
+    await scheduler.run_cycle(refresh, {1: set()})
+    assert scheduler.stats()['chats'] == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_scheduler_flood_wait():
+    scheduler = RefreshScheduler(TokenBucket(1000), concurrency=2)
+    calls = []
+
+    async def refresh(chat_id, db_admins):
+        calls.append(chat_id)
+        if chat_id == 1 and calls.count(1) == 1:
+            error = FloodWaitError(request=None, capture=0)
+            error.seconds = 0.01
+            raise error
+        if chat_id == 2:
+            raise ValueError('broken chat')
+
+    await scheduler.run_cycle(refresh, {1: set(), 2: set(), 3: set()})
+    assert calls.count(1) == 2
+    assert calls.count(2) == 1
+    assert scheduler.stats()['flood_waits'] == 1
+    assert scheduler.stats()['errors'] == 1
+    assert scheduler.staleness(2) is None
+    assert scheduler.staleness(1) is not None
@@ -0,0 +1,154 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from django.core.exceptions import ValidationError
+
+from guard_bot.bot.cache import AdminCache
+from guard_bot.bot.models import ChatSettings
+from telethon import types
+
+from guard_bot.bot.spam import (
+    AdminStage, SpamContext, SpamPipeline, SpamResult, Stage, Verdict, content_hash
+)
+
+
+class DummyStage(Stage):
+    def __init__(self, name, cost, result=None, delay=None, error=False, budget=None):
+        self.name, self.cost, self.result, self.delay, self.error, self.budget = \
+            name, cost, result, delay, error, budget
+        self.calls = 0
+
+    async def _check(self, context):
+        await asyncio.sleep(self.delay)
+        return self.result
+
+    def check(self, context):
+        self.calls += 1
+        if self.error:
+            raise ValueError('broken stage')
+        if self.delay is not None:
+            return self._check(context)
+        return self.result
+
+
+def get_context(text='text'):
+    return SpamContext(event=None, chat_id=1, user_id=2, message_id=3, text=text)
+
+
+def test_spam_context_from_event():
+    event = MagicMock()
+    event.message.chat.id = 1
+    event.message.sender.id = 2
+    event.message.id = 3
+    event.message.message = None
+    context = SpamContext.from_event(event, is_edit=True)
+    assert (context.chat_id, context.user_id, context.message_id, context.text, context.is_edit) == \
+           (1, 2, 3, '', True)
+    event.message.sender = None
+    assert SpamContext.from_event(event) is None
+
+
+@pytest.mark.asyncio
+async def test_spam_pipeline_order_and_short_circuit():
+    expensive = DummyStage('expensive', 100, Verdict.BAN)
+    cheap = DummyStage('cheap', 1, (Verdict.DELETE, 'link'))
+    clean = DummyStage('clean', 0)
+    pipeline = SpamPipeline([expensive, cheap, clean])
+    assert [x.name for x in pipeline.stages] == ['clean', 'cheap', 'expensive']
+
+    assert await pipeline.run(get_context()) == SpamResult(Verdict.DELETE, 'cheap', 'link')
+    assert expensive.calls == 0
+    assert SpamResult(Verdict.DELETE, 'cheap', 'link').comment == 'cheap: link'
+
+    clean.result = Verdict.CLEAN
+    assert await pipeline.run(get_context()) == SpamResult(Verdict.CLEAN, 'clean')
+    assert cheap.calls == 1
+
+    stats = pipeline.stats()
+    assert stats['messages'] == 2
+    assert stats['verdicts'] == {'delete': 1, 'clean': 1}
+    assert stats['stages']['clean']['calls'] == 2
+    assert stats['stages']['cheap']['verdicts'] == {'delete': 1}
+    assert stats['stages']['expensive']['calls'] == 0
+
+
+@pytest.mark.asyncio
+async def test_spam_pipeline_budget_and_errors():
+    slow = DummyStage('slow', 1, Verdict.BAN, delay=1)
+    broken = DummyStage('broken', 2, error=True)
+    fast = DummyStage('fast', 3, Verdict.WARN, delay=0, budget=1)
+    pipeline = SpamPipeline([slow, broken, fast], budget=0.01)
+
+    assert await pipeline.run(get_context()) == SpamResult(Verdict.WARN, 'fast')
+    stats = pipeline.stats()['stages']
+    assert stats['slow']['timeouts'] == 1
+    assert stats['broken']['errors'] == 1
+    assert stats['fast']['verdicts'] == {'warn': 1}
+
+    fast.result = None
+    assert await pipeline.run(get_context()) is None
+    assert pipeline.stats()['verdicts'] == {'warn': 1, 'pass': 1}
+
+
+@pytest.mark.asyncio
+async def test_spam_pipeline_chat_config():
+    first = DummyStage('first', 1, Verdict.BAN)
+    second = DummyStage('second', 2, Verdict.WARN)
+    pipeline = SpamPipeline([first, second])
+    chat_settings = ChatSettings(chat_id=1, spam_stages={'first': {'enabled': False}})
+    assert await pipeline.run(get_context(), chat_settings) == SpamResult(Verdict.WARN, 'second')
+    assert first.calls == 0
+
+    chat_settings.spam_stages = {'first': {'verdict': 'delete'}, 'second': {'verdict': 'pass'}}
+    assert await pipeline.run(get_context(), chat_settings) == SpamResult(Verdict.DELETE, 'first')
+    chat_settings.spam_stages = {'first': {'verdict': 'pass'}, 'second': {'verdict': 'pass'}}
+    assert await pipeline.run(get_context(), chat_settings) is None
+
+    # broken configuration saved past validation keeps verdicts of stages
+    chat_settings.spam_stages = {'first': {'verdict': 'remove'}, 'second': 'off'}
+    assert await pipeline.run(get_context(), chat_settings) == SpamResult(Verdict.BAN, 'first')
+    chat_settings.spam_stages = ['first']
+    assert await pipeline.run(get_context(), chat_settings) == SpamResult(Verdict.BAN, 'first')
+
+
+@pytest.mark.parametrize('spam_stages, valid', [
+    ({}, True),
+    ({'spammers': {'enabled': False}, 'domains': {'verdict': 'Ban'}}, True),
+    ({'domains': {'verdict': 'remove'}}, False),
+    ({'domains': {'verdict': 2}}, False),
+    ({'domains': {'enabled': 'no'}}, False),
+    ({'domains': {'limit': 1}}, False),
+    ({'domains': 'off'}, False),
+    (['domains'], False),
+])
+def test_chat_settings_spam_stages_validation(spam_stages, valid):
+    chat_settings = ChatSettings(chat_id=1, spam_stages=spam_stages)
+    if valid:
+        chat_settings.clean()
+    else:
+        with pytest.raises(ValidationError):
+            chat_settings.clean()
+
+
+def test_admin_stage():
+    cache = AdminCache(60)
+    stage = AdminStage(cache)
+    assert stage.check(get_context()) is None
+    cache.set(1, {2: 0})
+    assert stage.check(get_context()) == Verdict.CLEAN
+    # read-only check does not skew cache statistics
+    assert cache.stats() == {'chats': 1, 'hits': 0, 'misses': 0}
+
+
+def test_content_hash():
+    message = MagicMock(message='text', entities=None, media=None)
+    digest = content_hash(message)
+    message.media = types.MessageMediaWebPage(webpage=types.WebPagePending(id=1, date=None))
+    assert content_hash(message) == digest
+    message.entities = [types.MessageEntityBold(offset=0, length=4)]
+    assert content_hash(message) != digest
+    digest = content_hash(message)
+    message.media = types.MessageMediaPhoto(photo=types.PhotoEmpty(id=1))
+    assert content_hash(message) != digest
+    assert content_hash(message) == content_hash(message)
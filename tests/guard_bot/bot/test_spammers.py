@@ -0,0 +1,82 @@
+import random
+
+import numpy as np
+import pytest
+
+from guard_bot.bot.models import Spammers
+from guard_bot.bot.spam import SpamContext, SpammersStage, Verdict
+from guard_bot.bot.spammers import BloomFilter, SpammerIndex, _mix, _mix_array
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    values = random.sample(range(10 ** 12), 1000)
+    for value in values:
+        bloom.add(value)
+    assert all(value in bloom for value in values)
+    false_positives = sum(1 for value in range(10 ** 13, 10 ** 13 + 10000) if value in bloom)
+    assert false_positives < 300
+
+
+def test_bloom_filter_update():
+    values = random.sample(range(10 ** 12), 1000) + [-1, -2 ** 63, 2 ** 63 - 1]
+    array = np.array(values, dtype=np.int64)
+    assert [int(x) for x in _mix_array(array)] == [_mix(x) for x in values]
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for value in values:
+        bloom.add(value)
+    vectorized = BloomFilter(capacity=1000, error_rate=0.01)
+    vectorized.update(array)
+    assert vectorized.bits == bloom.bits
+
+
+@pytest.mark.parametrize('bloom_error_rate', [0.01, None])
+def test_spammer_index_add(bloom_error_rate):
+    index = SpammerIndex(bloom_error_rate=bloom_error_rate, merge_threshold=2)
+    index.add([5, 1])
+    assert 1 in index and 5 in index and 3 not in index
+    assert index.stats()['delta'] == 2
+    index.add([3, 1, 7])
+    assert index.stats()['delta'] == 0
+    assert list(index._ids) == [1, 3, 5, 7]
+    assert len(index) == 4
+    assert all(x in index for x in (1, 3, 5, 7))
+    assert 2 not in index
+    assert index.stats()['hits'] == 6
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_spammer_index_refresh():
+    await Spammers.objects.acreate(telegram_id=3)
+    await Spammers.objects.acreate(telegram_id=1)
+    index = SpammerIndex()
+    assert await index.refresh() == 2
+    assert index.loaded
+    assert 1 in index and 3 in index and 2 not in index
+
+    await Spammers.objects.acreate(telegram_id=2, from_cas=True)
+    await Spammers.objects.filter(telegram_id=1).adelete()
+    assert await index.refresh() >= 1
+    assert 2 in index
+    # deleted rows stay until full load
+    assert 1 in index
+    await index.load()
+    assert 1 not in index
+    assert list(index._ids) == [2, 3]
+    assert index.stats()['size'] == 2
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_spammers_stage():
+    index = SpammerIndex()
+    stage = SpammersStage(index)
+    context = SpamContext(event=None, chat_id=1, user_id=2, message_id=3, text='')
+    await Spammers.objects.acreate(telegram_id=2)
+    # database is used until index is loaded
+    assert await stage.check(context) == (Verdict.BAN, 'known spammer')
+    await index.load()
+    assert stage.check(context) == (Verdict.BAN, 'known spammer')
+    context.user_id = 4
+    assert stage.check(context) is None